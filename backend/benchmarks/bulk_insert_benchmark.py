@@ -0,0 +1,101 @@
+"""購入アイテムの一括登録（crud.insert_purchases_bulk）のスループットを測定するベンチマーク
+
+    python benchmarks/bulk_insert_benchmark.py --rows 10000 100000 1000000
+    python benchmarks/bulk_insert_benchmark.py --rows 10000 --legacy
+
+CSV インポートと同じく IMPORT_CHUNK_ROWS 行ずつ 1 トランザクションで登録し、件数ごとに
+新しい SQLite ファイルで rows/s を表示します。--legacy を付けると、1 行ごとに flush して ID を
+取得する従来の方式も同じ件数で測定します。
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import Callable, List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from osaifill import crud, importers, migrations, models, rollup, schemas
+
+BUDGETS = 10
+
+
+def make_purchases(dataset_id: str, count: int, rng: random.Random) -> List[schemas.PurchaseCreate]:
+    return [
+        schemas.PurchaseCreate(
+            dataset_id=dataset_id,
+            item_name=f"item-{i}",
+            amount=rng.randint(100, 50000),
+            category=rng.choice(["固定費", "旅費", "その他"]),
+            status=rng.choice(["書いただけ", "見積済み", "購入済み"]),
+            assignments=[schemas.BudgetAssignmentCreate(budget_id=f"b{rng.randrange(BUDGETS)}", amount=100)]
+            if rng.random() < 0.8 else [],
+        )
+        for i in range(count)
+    ]
+
+
+def insert_legacy(db: Session, dataset_id: str, purchases: List[schemas.PurchaseCreate]) -> None:
+    # 変更前の create_purchases_bulk と同じく、割当のために 1 行ずつ flush して ID を取得します
+    ids = []
+    for p_data in purchases:
+        purchase_data = p_data.model_dump(exclude={"assignments"})
+        purchase_data["dataset_id"] = dataset_id
+        db_purchase = models.Purchase(**purchase_data)
+        db.add(db_purchase)
+        db.flush()
+        ids.append(db_purchase.id)
+        for a in p_data.assignments:
+            db.add(models.BudgetAssignment(purchase_id=db_purchase.id, budget_id=a.budget_id, amount=a.amount))
+    db.flush()
+    rollup.add_purchases(db, crud._purchase_id_range(ids))
+    db.commit()
+
+
+def run(rows: int, chunk: int, insert: Callable[[Session, str, List[schemas.PurchaseCreate]], object], seed: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        migrations.upgrade(engine)
+        SessionLocal = sessionmaker(bind=engine, autoflush=False)
+        rng = random.Random(seed)
+        elapsed = 0.0
+        with SessionLocal() as db:
+            ds_id = crud.create_dataset(db, schemas.DatasetCreate(name="bench")).id
+            for b in range(BUDGETS):
+                crud.create_budget(db, schemas.BudgetCreate(id=f"b{b}", dataset_id=ds_id, name=f"b{b}", total_amount=10**9))
+            for start in range(0, rows, chunk):
+                # 入力データの生成時間は測定に含めません
+                batch = make_purchases(ds_id, min(chunk, rows - start), rng)
+                t0 = time.perf_counter()
+                insert(db, ds_id, batch)
+                elapsed += time.perf_counter() - t0
+                db.expunge_all()
+            assert db.query(models.Purchase).count() == rows
+            assert rollup.verify_dataset(db, ds_id) == []
+        engine.dispose()
+        return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--chunk", type=int, default=importers.IMPORT_CHUNK_ROWS)
+    parser.add_argument("--legacy", action="store_true", help="Also measure the per-row flush path")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    paths = [("bulk", crud.insert_purchases_bulk)]
+    if args.legacy:
+        paths.append(("per-row flush", insert_legacy))
+
+    print(f"{'rows':>10} {'path':<14} {'seconds':>9} {'rows/s':>10}")
+    for rows in args.rows:
+        for name, insert in paths:
+            elapsed = run(rows, args.chunk, insert, args.seed)
+            print(f"{rows:>10} {name:<14} {elapsed:>9.2f} {rows / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""ベンチマーク用の合成データ生成
+
+    python benchmarks/datagen.py --database bench.db --purchases 100000 --seed 1
+
+乱数のシードとサイズ（予算・担当者・購入アイテム・割当・実績の件数）が同じなら、ID を含めて同じデータを
+作ります。crud を通さずにモデルのテーブルへ一括で INSERT し、最後にロールアップを再構築するため、
+大きなデータセットでも短時間で作成できます。
+"""
+import argparse
+import json
+import random
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from osaifill import models, rollup
+
+STATUSES = ["書いただけ", "見積済み", "買い物中", "購入済み", "購入しない"]
+CATEGORIES = ["固定費", "旅費", "その他"]
+# ダッシュボードは購入予定の旅費をすべて返すため、旅費は一部だけにします
+CATEGORY_WEIGHTS = [45, 5, 50]
+INSERT_CHUNK_ROWS = 5000
+
+# CSV インポート・エクスポートと同じ列名のマッピング
+PURCHASE_MAPPING = {
+    "item_name": "アイテム名", "amount": "金額", "member_name": "担当者", "category": "区分",
+    "status": "ステータス", "priority": "優先度", "note": "備考", "budget_id": "対応お財布ID", "asgn_amount": "割当金額",
+}
+ACTUAL_EXPENSE_MAPPING = {"item_name": "内容", "amount": "金額"}
+
+
+@dataclass(frozen=True)
+class Sizes:
+    budgets: int = 20
+    members: int = 10
+    purchases: int = 10_000
+    # 割当のある購入アイテムの割合と、1 件あたりの最大の割当数
+    assigned_ratio: float = 0.8
+    max_assignments: int = 2
+    # データセット全体の実績の件数
+    actual_expenses: int = 5_000
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+SCALES = {
+    "small": Sizes(budgets=10, members=5, purchases=1_000, actual_expenses=500),
+    "medium": Sizes(),
+    "large": Sizes(budgets=50, members=20, purchases=100_000, actual_expenses=50_000),
+}
+
+
+def _insert_chunked(db: Session, model: Any, rows: List[Dict[str, Any]]) -> None:
+    for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+        db.execute(insert(model), rows[start:start + INSERT_CHUNK_ROWS])
+
+
+def generate_dataset(db: Session, sizes: Sizes, seed: int, name: str = "bench") -> str:
+    """sizes の件数のデータセットを作ってコミットし、その ID を返します"""
+    rng = random.Random(seed)
+    new_id = lambda: str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    dataset_id = new_id()
+    db.add(models.Dataset(id=dataset_id, name=name))
+    db.flush()
+
+    member_names = [f"member-{i}" for i in range(sizes.members)]
+    _insert_chunked(db, models.Member, [{"dataset_id": dataset_id, "name": n} for n in member_names])
+
+    budget_ids = [new_id() for _ in range(sizes.budgets)]
+    _insert_chunked(db, models.Budget, [
+        {"id": b_id, "dataset_id": dataset_id, "name": f"budget-{i}", "total_amount": float(rng.randint(10, 1000) * 10_000),
+         "unit": "JPY", "description": None}
+        for i, b_id in enumerate(budget_ids)
+    ])
+
+    # 購入アイテムの ID は割当から参照するため、既存の最大値の続きを明示的に振ります
+    first_id = (db.query(func.max(models.Purchase.id)).scalar() or 0) + 1
+    purchases: List[Dict[str, Any]] = []
+    assignments: List[Dict[str, Any]] = []
+    for i in range(sizes.purchases):
+        purchase_id = first_id + i
+        amount = float(rng.randint(100, 50_000))
+        purchases.append({
+            "id": purchase_id, "dataset_id": dataset_id,
+            "member_name": rng.choice(member_names) if member_names else None,
+            "category": rng.choices(CATEGORIES, CATEGORY_WEIGHTS)[0],
+            "item_name": f"item-{i}", "amount": amount, "unit": "JPY",
+            "status": rng.choice(STATUSES), "priority": rng.randint(1, 5), "note": None,
+        })
+        if budget_ids and rng.random() < sizes.assigned_ratio:
+            count = rng.randint(1, max(1, sizes.max_assignments))
+            for b_id in rng.sample(budget_ids, min(count, len(budget_ids))):
+                assignments.append({"purchase_id": purchase_id, "budget_id": b_id, "amount": round(amount / count)})
+    _insert_chunked(db, models.Purchase, purchases)
+    _insert_chunked(db, models.BudgetAssignment, assignments)
+
+    if budget_ids:
+        _insert_chunked(db, models.ActualExpense, [
+            {"budget_id": rng.choice(budget_ids), "item_name": f"expense-{i}", "amount": float(rng.randint(100, 20_000)), "unit": "JPY"}
+            for i in range(sizes.actual_expenses)
+        ])
+
+    # エクスポートした CSV をそのままインポートできるよう、取り込み設定も保存します
+    db.add(models.PurchaseImportSetting(dataset_id=dataset_id, mapping_json=json.dumps(PURCHASE_MAPPING, ensure_ascii=False)))
+    _insert_chunked(db, models.ImportSetting, [
+        {"budget_id": b_id, "mapping_json": json.dumps(ACTUAL_EXPENSE_MAPPING, ensure_ascii=False)} for b_id in budget_ids
+    ])
+
+    rollup.rebuild_dataset(db, dataset_id)
+    db.commit()
+    return dataset_id
+
+
+def main() -> None:
+    from sqlalchemy.orm import sessionmaker
+
+    from osaifill import migrations
+    from osaifill.database import make_engine
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic Osaifill dataset")
+    parser.add_argument("--database", required=True, help="SQLite file to create or extend")
+    parser.add_argument("--scale", choices=list(SCALES), default="medium")
+    for field, default in Sizes().as_dict().items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(default), default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    overrides = {f: getattr(args, f) for f in Sizes().as_dict() if getattr(args, f) is not None}
+    sizes = Sizes(**{**SCALES[args.scale].as_dict(), **overrides})
+    engine = make_engine(f"sqlite:///{args.database}")
+    migrations.upgrade(engine)
+    with sessionmaker(bind=engine, autoflush=False)() as db:
+        dataset_id = generate_dataset(db, sizes, args.seed)
+    engine.dispose()
+    print(dataset_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""書き込みスレッドによるグループコミット（writer.WriteCoordinator）の効果を測定するベンチマーク
+
+    python benchmarks/group_commit_benchmark.py
+    python benchmarks/group_commit_benchmark.py --threads 1 8 32 --writes 200 --profiles default tuned
+
+複数のスレッドから購入アイテムの登録（割当付き、crud.create_purchase）を繰り返し、
+各スレッドがそれぞれセッションを開いてコミットする従来の方式と、WriteCoordinator に渡して
+まとめてコミットする方式の writes/s を、SQLite のプロファイル（database.SQLITE_PROFILES）ごとに表示します。
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, List
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from osaifill import crud, migrations, models, schemas
+from osaifill.database import SQLITE_PROFILES, make_engine
+from osaifill.writer import WriteCoordinator, make_writer_engine
+
+
+def purchase(ds_id: str, i: int) -> schemas.PurchaseCreate:
+    return schemas.PurchaseCreate(
+        dataset_id=ds_id, item_name=f"item-{i}", amount=100 + i % 1000,
+        assignments=[schemas.BudgetAssignmentCreate(budget_id="b0", amount=100)],
+    )
+
+
+def run(profile_name: str, mode: str, threads: int, writes: int) -> "tuple[float, int]":
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        profile = SQLITE_PROFILES[profile_name]
+        engine = make_engine(url, profile, {"pool_size": threads, "max_overflow": 0})
+        migrations.upgrade(engine)
+        SessionLocal = sessionmaker(bind=engine, autoflush=False)
+        with SessionLocal() as db:
+            ds_id = str(crud.create_dataset(db, schemas.DatasetCreate(name="bench")).id)
+            crud.create_budget(db, schemas.BudgetCreate(id="b0", dataset_id=ds_id, name="b0", total_amount=10**9))
+
+        coordinator = WriteCoordinator(make_writer_engine(url)) if mode == "group" else None
+        failures: List[int] = []
+
+        def direct(i: int) -> None:
+            with SessionLocal() as db:
+                crud.create_purchase(db, purchase(ds_id, i))
+
+        def grouped(i: int) -> None:
+            assert coordinator is not None
+            coordinator.submit(crud.create_purchase, purchase(ds_id, i)).result()
+
+        write: Callable[[int], None] = grouped if coordinator else direct
+
+        def worker(t: int) -> None:
+            for n in range(writes):
+                try:
+                    write(t * writes + n)
+                except OperationalError:
+                    failures.append(1)
+
+        pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+        t0 = time.perf_counter()
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - t0
+
+        if coordinator:
+            coordinator.close()
+        with SessionLocal() as db:
+            assert db.query(models.Purchase).count() == threads * writes - len(failures)
+        engine.dispose()
+        return elapsed, len(failures)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", nargs="+", default=list(SQLITE_PROFILES), choices=list(SQLITE_PROFILES))
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--writes", type=int, default=100, help="Writes per thread")
+    args = parser.parse_args()
+
+    print(f"{'profile':<8} {'threads':>7} {'mode':<7} {'seconds':>8} {'writes/s':>9} {'failed':>7}")
+    for profile in args.profiles:
+        for threads in args.threads:
+            for mode in ("direct", "group"):
+                elapsed, failed = run(profile, mode, threads, args.writes)
+                total = threads * args.writes - failed
+                print(f"{profile:<8} {threads:>7} {mode:<7} {elapsed:>8.2f} {total / elapsed:>9.0f} {failed:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""インデックス追加（マイグレーション 0003）前後のクエリ時間を比較するベンチマーク
+
+    python benchmarks/index_benchmark.py --datasets 20 --purchases 5000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from osaifill import migrations, rollup
+
+STATUSES = ["書いただけ", "見積済み", "買い物中", "購入済み", "購入しない"]
+CATEGORIES = ["固定費", "旅費", "その他"]
+
+
+def populate(engine: Engine, datasets: int, purchases: int, budgets: int, seed: int) -> None:
+    rng = random.Random(seed)
+    with engine.begin() as conn:
+        purchase_id = 0
+        for d in range(datasets):
+            ds_id = f"ds-{d}"
+            conn.execute(text("INSERT INTO datasets (id, name) VALUES (:id, :name)"), {"id": ds_id, "name": ds_id})
+            budget_ids = [f"{ds_id}-b{b}" for b in range(budgets)]
+            conn.execute(
+                text("INSERT INTO budgets (id, dataset_id, name, total_amount, unit) VALUES (:id, :ds, :id, 1000000, 'JPY')"),
+                [{"id": b_id, "ds": ds_id} for b_id in budget_ids],
+            )
+            conn.execute(
+                text("INSERT INTO actual_expenses (budget_id, item_name, amount, unit) VALUES (:b, 'expense', :a, 'JPY')"),
+                [{"b": rng.choice(budget_ids), "a": rng.randint(100, 5000)} for _ in range(purchases // 2)],
+            )
+            rows = []
+            asgns = []
+            for _ in range(purchases):
+                purchase_id += 1
+                amount = rng.randint(100, 50000)
+                rows.append({
+                    "id": purchase_id, "ds": ds_id, "amount": amount,
+                    "status": rng.choice(STATUSES), "category": rng.choice(CATEGORIES),
+                })
+                if rng.random() < 0.8:
+                    asgns.append({"p": purchase_id, "b": rng.choice(budget_ids), "a": amount})
+            conn.execute(
+                text(
+                    "INSERT INTO purchases (id, dataset_id, item_name, amount, unit, status, category, priority) "
+                    "VALUES (:id, :ds, 'item', :amount, 'JPY', :status, :category, 3)"
+                ),
+                rows,
+            )
+            conn.execute(
+                text("INSERT INTO budget_assignments (purchase_id, budget_id, amount) VALUES (:p, :b, :a)"),
+                asgns,
+            )
+
+
+def workloads(engine: Engine, datasets: int, purchases: int) -> Dict[str, Callable[[], None]]:
+    rng = random.Random(0)
+    ds_id = f"ds-{datasets // 2}"
+    sample_purchases: List[int] = [rng.randint(1, datasets * purchases) for _ in range(200)]
+
+    def list_purchases() -> None:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT * FROM purchases WHERE dataset_id = :ds"), {"ds": ds_id}).fetchall()
+
+    def assignments_per_purchase() -> None:
+        # Purchase.assignments の遅延ロード / selectin ロードと同じ形
+        with engine.connect() as conn:
+            for p_id in sample_purchases:
+                conn.execute(text("SELECT * FROM budget_assignments WHERE purchase_id = :p"), {"p": p_id}).fetchall()
+
+    def budgets_and_expenses() -> None:
+        with engine.connect() as conn:
+            b_ids = [r[0] for r in conn.execute(text("SELECT id FROM budgets WHERE dataset_id = :ds"), {"ds": ds_id})]
+            for b_id in b_ids:
+                conn.execute(text("SELECT * FROM actual_expenses WHERE budget_id = :b"), {"b": b_id}).fetchall()
+
+    def dashboard_rebuild() -> None:
+        with Session(engine) as db:
+            rollup.compute_dataset_totals(db, ds_id)
+            rollup.compute_budget_totals(db, ds_id)
+
+    return {
+        "list_purchases": list_purchases,
+        "assignments_per_purchase(x200)": assignments_per_purchase,
+        "budgets_and_expenses": budgets_and_expenses,
+        "dashboard_rebuild": dashboard_rebuild,
+    }
+
+
+def measure(fn: Callable[[], None], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--datasets", type=int, default=20)
+    parser.add_argument("--purchases", type=int, default=5000, help="Purchases per dataset")
+    parser.add_argument("--budgets", type=int, default=10, help="Budgets per dataset")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        migrations.upgrade(engine, target=2)
+        populate(engine, args.datasets, args.purchases, args.budgets, args.seed)
+
+        cases = workloads(engine, args.datasets, args.purchases)
+        before = {name: measure(fn, args.repeat) for name, fn in cases.items()}
+        migrations.upgrade(engine)
+        after = {name: measure(fn, args.repeat) for name, fn in cases.items()}
+        engine.dispose()
+
+    print(f"{args.datasets} datasets x {args.purchases} purchases (median of {args.repeat} runs)")
+    print(f"{'workload':<32}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name in cases:
+        print(f"{name:<32}{before[name]:>12.2f}{after[name]:>12.2f}{before[name] / after[name]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
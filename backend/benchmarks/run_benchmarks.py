@@ -0,0 +1,227 @@
+"""主要な処理の所要時間を測定し、コミット間で比較できる JSON に書き出すベンチマーク
+
+    python benchmarks/run_benchmarks.py --scale medium --output results.json
+    python benchmarks/run_benchmarks.py --scale medium --output new.json --compare results.json
+
+datagen.generate_dataset() で作ったデータに対して API を TestClient から呼び、ダッシュボード、一覧、
+CSV インポート（購入アイテム・実績）、CSV エクスポート、予算の統合、データセットの引き継ぎと削除の
+時間を測定します。データを変更する処理は実行のたびに新しいデータベースを作り、データの作成は時間に含めません。
+レスポンスキャッシュは実行のたびに空にします。
+
+--output の JSON には、測定した環境（コミット、Python / SQLite のバージョン、件数、シード）と処理ごとの
+各回の時間、中央値・最小値・最大値が入ります。--compare に以前の JSON を渡すと、中央値の比を表示します。
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import sqlalchemy
+from fastapi.testclient import TestClient
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from datagen import SCALES, Sizes, generate_dataset
+from osaifill import migrations
+from osaifill.cache import response_cache
+from osaifill.database import get_db, make_engine
+from osaifill.main import app
+
+
+@dataclass
+class Context:
+    client: TestClient
+    dataset_id: str
+    budget_ids: List[str]
+    sizes: Sizes
+    purchases_csv: bytes = b""
+
+
+@dataclass
+class Case:
+    name: str
+    run: Callable[[Context], Any]
+    # データを変更する処理は、実行のたびに新しいデータベースで測定します
+    mutates: bool = False
+
+
+def ok(response: Any) -> Any:
+    assert response.status_code == 200, f"{response.request.url}: {response.status_code} {response.text[:200]}"
+    return response
+
+
+def purchases_csv(ctx: Context) -> bytes:
+    return ok(ctx.client.get(f"/api/purchases/export-csv?dataset_id={ctx.dataset_id}")).content
+
+
+def actual_expenses_csv(rows: int) -> bytes:
+    lines = ["内容,金額"] + [f"expense-{i},{100 + i % 20_000}" for i in range(rows)]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+CASES = [
+    Case("dashboard", lambda ctx: ok(ctx.client.get(f"/api/dashboard?dataset_id={ctx.dataset_id}"))),
+    Case("list_purchases", lambda ctx: ok(ctx.client.get(f"/api/purchases?dataset_id={ctx.dataset_id}"))),
+    Case("list_budgets", lambda ctx: ok(ctx.client.get(f"/api/budgets?dataset_id={ctx.dataset_id}"))),
+    Case("search_purchases", lambda ctx: ok(ctx.client.get(f"/api/purchases/search?dataset_id={ctx.dataset_id}&q=item-12"))),
+    Case("list_actual_expenses", lambda ctx: ok(ctx.client.get(f"/api/budgets/{ctx.budget_ids[0]}/actual-expenses"))),
+    Case("export_purchases_csv", purchases_csv),
+    Case("import_purchases_csv", lambda ctx: ok(ctx.client.post(
+        f"/api/purchases/import-csv?dataset_id={ctx.dataset_id}",
+        files={"file": ("purchases.csv", ctx.purchases_csv, "text/csv")}, data={"overwrite": "true"},
+    )), mutates=True),
+    Case("import_actual_expenses_csv", lambda ctx: ok(ctx.client.post(
+        f"/api/budgets/{ctx.budget_ids[0]}/import-csv",
+        files={"file": ("expenses.csv", actual_expenses_csv(ctx.sizes.actual_expenses), "text/csv")}, data={"overwrite": "true"},
+    )), mutates=True),
+    Case("merge_budgets", lambda ctx: ok(ctx.client.post(
+        "/api/budgets/merge", json={"source_budget_id": ctx.budget_ids[1], "target_budget_id": ctx.budget_ids[0]},
+    )), mutates=True),
+    Case("rollover_dataset", lambda ctx: ok(ctx.client.post(
+        "/api/datasets/rollover", json={"new_name": "rollover", "source_dataset_id": ctx.dataset_id},
+    )), mutates=True),
+    Case("delete_dataset", lambda ctx: ok(ctx.client.delete(f"/api/datasets/{ctx.dataset_id}")), mutates=True),
+]
+
+
+class Bench:
+    """一時ディレクトリに SQLite ファイルを作り、API の get_db をそのデータベースのセッションに差し替えます"""
+
+    def __init__(self, tmp: str, sizes: Sizes, seed: int) -> None:
+        self.tmp = tmp
+        self.sizes = sizes
+        self.seed = seed
+        self.databases = 0
+        self.engine: Optional[Engine] = None
+        self.SessionLocal: Optional[sessionmaker] = None
+        app.dependency_overrides[get_db] = self._get_db
+        self.client = TestClient(app)
+
+    def _get_db(self) -> Iterator[Session]:
+        assert self.SessionLocal is not None
+        with self.SessionLocal() as db:
+            yield db
+
+    def fresh(self) -> Context:
+        """新しいデータベースに同じシードでデータセットを作ります"""
+        self.close()
+        self.databases += 1
+        self.engine = make_engine(f"sqlite:///{os.path.join(self.tmp, f'bench-{self.databases}.db')}")
+        migrations.upgrade(self.engine)
+        self.SessionLocal = sessionmaker(bind=self.engine, autoflush=False)
+        with self.SessionLocal() as db:
+            dataset_id = generate_dataset(db, self.sizes, self.seed)
+        budget_ids = [b["id"] for b in ok(self.client.get(f"/api/budgets?dataset_id={dataset_id}")).json()]
+        ctx = Context(self.client, dataset_id, sorted(budget_ids), self.sizes)
+        # インポートする CSV はエクスポートしたものを使います（時間には含めません）
+        ctx.purchases_csv = purchases_csv(ctx)
+        return ctx
+
+    def close(self) -> None:
+        if self.engine is not None:
+            self.engine.dispose()
+            self.engine = None
+
+
+def measure(bench: Bench, case: Case, repeat: int, shared: Optional[Context]) -> List[float]:
+    timings = []
+    # 1 回目は接続やクエリのコンパイルのキャッシュを温めるため、記録しません
+    for i in range(repeat + 1):
+        ctx = bench.fresh() if case.mutates or shared is None else shared
+        response_cache.clear()
+        t0 = time.perf_counter()
+        case.run(ctx)
+        elapsed = time.perf_counter() - t0
+        if i > 0:
+            timings.append(elapsed)
+    return timings
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(__file__))
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"\ncompared with {baseline_path} (median, new/old; < 1 is faster)")
+    print(f"{'case':<28} {'old ms':>10} {'new ms':>10} {'ratio':>7}")
+    for r in results:
+        old = baseline.get(r["name"])
+        if not old:
+            print(f"{r['name']:<28} {'-':>10} {r['median'] * 1000:>10.2f} {'-':>7}")
+            continue
+        print(f"{r['name']:<28} {old['median'] * 1000:>10.2f} {r['median'] * 1000:>10.2f} {r['median'] / old['median']:>7.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time Osaifill hot paths and write machine-readable results")
+    parser.add_argument("--scale", choices=list(SCALES), default="medium")
+    for field, default in Sizes().as_dict().items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(default), default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cases", nargs="+", choices=[c.name for c in CASES], default=[c.name for c in CASES])
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Print median ratios against a previous results file")
+    args = parser.parse_args()
+
+    overrides = {f: getattr(args, f) for f in Sizes().as_dict() if getattr(args, f) is not None}
+    sizes = Sizes(**{**SCALES[args.scale].as_dict(), **overrides})
+
+    results: List[Dict[str, Any]] = []
+    print(f"sizes={sizes.as_dict()} seed={args.seed} repeat={args.repeat}")
+    print(f"{'case':<28} {'median ms':>10} {'min ms':>10} {'max ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        bench = Bench(tmp, sizes, args.seed)
+        try:
+            shared: Optional[Context] = None
+            for case in (c for c in CASES if c.name in args.cases):
+                if not case.mutates and shared is None:
+                    shared = bench.fresh()
+                elif case.mutates:
+                    # 変更する処理の後は、読み取りの測定に共有のデータベースを使えないため作り直します
+                    shared = None
+                timings = measure(bench, case, args.repeat, shared)
+                result = {"name": case.name, "runs": timings, "median": statistics.median(timings), "min": min(timings), "max": max(timings)}
+                results.append(result)
+                print(f"{case.name:<28} {result['median'] * 1000:>10.2f} {result['min'] * 1000:>10.2f} {result['max'] * 1000:>10.2f}")
+        finally:
+            bench.close()
+            app.dependency_overrides.clear()
+
+    if args.output:
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "sqlalchemy": sqlalchemy.__version__,
+                "platform": platform.platform(),
+                "seed": args.seed,
+                "repeat": args.repeat,
+                "sizes": sizes.as_dict(),
+            },
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""SQLite の PRAGMA プロファイル（database.SQLITE_PROFILES）を読み書き混在の負荷で比較するベンチマーク
+
+    python benchmarks/sqlite_profile_benchmark.py
+    python benchmarks/sqlite_profile_benchmark.py --threads 16 --seconds 10 --write-ratio 0.5
+
+プロファイルごとに新しい SQLite ファイルを作って購入アイテムを登録し、複数のスレッドから API と同じく
+1 操作 1 セッションで crud 関数を呼び続けます。読み取りはダッシュボードと購入アイテム一覧の先頭ページ、
+書き込みは購入アイテムの登録とステータス変更です。操作数/s、レイテンシ（p50 / p95 / p99）と
+"database is locked" などで失敗した操作の数を表示します。
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from osaifill import crud, migrations, models, schemas
+from osaifill.database import SQLITE_PROFILES, make_engine, pool_options_from_env
+
+BUDGETS = 10
+STATUSES = ["書いただけ", "見積済み", "買い物中", "購入済み"]
+
+
+def seed(SessionLocal: "sessionmaker", rows: int, rng: random.Random) -> str:
+    with SessionLocal() as db:
+        ds_id = str(crud.create_dataset(db, schemas.DatasetCreate(name="bench")).id)
+        for b in range(BUDGETS):
+            crud.create_budget(db, schemas.BudgetCreate(id=f"b{b}", dataset_id=ds_id, name=f"b{b}", total_amount=10**9))
+        for start in range(0, rows, 1000):
+            crud.insert_purchases_bulk(db, ds_id, [
+                schemas.PurchaseCreate(
+                    dataset_id=ds_id, item_name=f"item-{i}", amount=rng.randint(100, 50000),
+                    # ダッシュボードは購入予定の旅費をすべて返すため、旅費は一部だけにします
+                    category=rng.choices(["固定費", "旅費", "その他"], weights=[45, 1, 54])[0], status=rng.choice(STATUSES),
+                    assignments=[schemas.BudgetAssignmentCreate(budget_id=f"b{rng.randrange(BUDGETS)}", amount=100)],
+                )
+                for i in range(start, min(rows, start + 1000))
+            ])
+    return ds_id
+
+
+def worker(
+    SessionLocal: "sessionmaker", ds_id: str, rows: int, write_ratio: float, deadline: float, seed_value: int,
+    latencies: Dict[str, List[float]], errors: List[str], lock: threading.Lock,
+) -> None:
+    rng = random.Random(seed_value)
+    local: Dict[str, List[float]] = {"read": [], "write": []}
+    local_errors: List[str] = []
+    page = schemas.PurchaseListQuery(dataset_id=ds_id, limit=50)
+    while time.perf_counter() < deadline:
+        kind = "write" if rng.random() < write_ratio else "read"
+        t0 = time.perf_counter()
+        try:
+            with SessionLocal() as db:
+                if kind == "read":
+                    if rng.random() < 0.5:
+                        crud.get_dashboard_summary(db, ds_id)
+                    else:
+                        crud.get_purchases(db, ds_id, page)
+                elif rng.random() < 0.5:
+                    crud.create_purchase(db, schemas.PurchaseCreate(
+                        dataset_id=ds_id, item_name="new", amount=rng.randint(100, 5000), status=rng.choice(STATUSES),
+                        assignments=[schemas.BudgetAssignmentCreate(budget_id=f"b{rng.randrange(BUDGETS)}", amount=100)],
+                    ))
+                else:
+                    crud.update_purchase_status(db, rng.randint(1, rows), rng.choice(STATUSES))
+        except OperationalError as e:
+            local_errors.append(str(e.orig))
+            continue
+        local[kind].append(time.perf_counter() - t0)
+    with lock:
+        for k, v in local.items():
+            latencies[k].extend(v)
+        errors.extend(local_errors)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(p) - 1]
+
+
+def run(profile_name: str, threads: int, seconds: float, rows: int, write_ratio: float, seed_value: int) -> Tuple[Dict[str, List[float]], List[str]]:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", SQLITE_PROFILES[profile_name], pool_options_from_env())
+        migrations.upgrade(engine)
+        SessionLocal = sessionmaker(bind=engine, autoflush=False)
+        ds_id = seed(SessionLocal, rows, random.Random(seed_value))
+
+        latencies: Dict[str, List[float]] = {"read": [], "write": []}
+        errors: List[str] = []
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+        pool = [
+            threading.Thread(target=worker, args=(SessionLocal, ds_id, rows, write_ratio, deadline, seed_value + i, latencies, errors, lock))
+            for i in range(threads)
+        ]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        with SessionLocal() as db:
+            assert db.query(models.Purchase).count() >= rows
+        engine.dispose()
+        return latencies, errors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", nargs="+", default=list(SQLITE_PROFILES), choices=list(SQLITE_PROFILES))
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--rows", type=int, default=20_000, help="Purchases seeded before the run")
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"threads={args.threads} seconds={args.seconds} rows={args.rows} write_ratio={args.write_ratio}")
+    print(f"{'profile':<8} {'op':<6} {'ops/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name in args.profiles:
+        latencies, errors = run(name, args.threads, args.seconds, args.rows, args.write_ratio, args.seed)
+        for op in ("read", "write"):
+            values = latencies[op]
+            print(
+                f"{name:<8} {op:<6} {len(values) / args.seconds:>8.0f} {percentile(values, 50) * 1000:>8.2f}"
+                f" {percentile(values, 95) * 1000:>8.2f} {percentile(values, 99) * 1000:>8.2f}"
+            )
+        summary = f"{len(errors)} failed"
+        if errors:
+            summary += f" (e.g. {max(set(errors), key=errors.count)})"
+        print(f"{name:<8} errors {summary}")
+
+
+if __name__ == "__main__":
+    main()
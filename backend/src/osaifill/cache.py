@@ -0,0 +1,135 @@
+"""ダッシュボード・一覧 API のプロセス内キャッシュ
+
+シリアライズ済みのレスポンス本文をデータセット単位で保持します。キーにはデータセットのバージョン
+（versions.py）を含めるため、書き込みの後に古い内容が返ることはありません。加えて、書き込みが
+コミットされるとそのデータセットのエントリーを破棄してメモリーを解放します。
+
+容量（本文のバイト数の合計）が上限を超えると最も長く使われていないエントリーから追い出し、
+TTL を過ぎたエントリーは次に参照されたときに破棄します。
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from . import versions
+
+# キャッシュに保持する本文の合計サイズの上限（0 でキャッシュを無効化）と有効期間
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+
+# 本文以外（キー・ヘッダー・管理情報）に使うおおよそのバイト数
+ENTRY_OVERHEAD_BYTES = 256
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(k) + len(v) for k, v in self.headers.items()) + ENTRY_OVERHEAD_BYTES
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+    entries: int = 0
+    bytes: int = 0
+    max_bytes: int = 0
+
+
+CacheKey = Tuple[str, Hashable]
+
+
+class ResponseCache:
+    """LRU・容量上限・TTL 付きのスレッドセーフなキャッシュ"""
+
+    def __init__(self, max_bytes: int, ttl_seconds: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[CacheKey, Tuple[float, CachedResponse]]" = OrderedDict()
+        self._by_dataset: Dict[str, Set[CacheKey]] = {}
+        self._bytes = 0
+        self._stats = CacheStats()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, dataset_id: str, key: Hashable) -> Optional[CachedResponse]:
+        with self._lock:
+            item = self._entries.get((dataset_id, key))
+            if item is None:
+                self._stats.misses += 1
+                return None
+            stored_at, value = item
+            if self._clock() - stored_at > self.ttl_seconds:
+                self._remove((dataset_id, key))
+                self._stats.expirations += 1
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end((dataset_id, key))
+            self._stats.hits += 1
+            return value
+
+    def put(self, dataset_id: str, key: Hashable, value: CachedResponse) -> None:
+        if value.size > self.max_bytes:
+            # 上限より大きいレスポンスは保持しません
+            return
+        with self._lock:
+            cache_key = (dataset_id, key)
+            if cache_key in self._entries:
+                self._remove(cache_key)
+            self._entries[cache_key] = (self._clock(), value)
+            self._by_dataset.setdefault(dataset_id, set()).add(cache_key)
+            self._bytes += value.size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats.evictions += 1
+
+    def invalidate(self, dataset_ids: Iterable[str]) -> None:
+        """データセットのエントリーをすべて破棄します"""
+        with self._lock:
+            for dataset_id in dataset_ids:
+                for cache_key in list(self._by_dataset.get(dataset_id, ())):
+                    self._remove(cache_key)
+                    self._stats.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_dataset.clear()
+            self._bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(**{
+                **asdict(self._stats),
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            })
+
+    def _remove(self, cache_key: CacheKey) -> None:
+        _, value = self._entries.pop(cache_key)
+        self._bytes -= value.size
+        keys = self._by_dataset.get(cache_key[0])
+        if keys is not None:
+            keys.discard(cache_key)
+            if not keys:
+                del self._by_dataset[cache_key[0]]
+
+
+response_cache = ResponseCache(CACHE_MAX_BYTES, CACHE_TTL_SECONDS)
+versions.on_commit(response_cache.invalidate)
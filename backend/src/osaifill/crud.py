@@ -1,8 +1,11 @@
-from sqlalchemy.orm import Session
-from . import models, schemas
+from sqlalchemy import ColumnElement, CursorResult, and_, case, delete, exists, func, insert, literal, select, update
+from sqlalchemy.orm import Query, Session, aliased, selectinload
+from . import models, rollup, schemas, versions
+from .money import from_minor, minor, to_minor
+from .pagination import Page, keyset_page
 import uuid
 import json
-from typing import List, Optional, cast, Any
+from typing import Dict, Iterator, List, Optional, Set, Tuple, cast, Any
 
 
 # --- Dataset CRUD ---
@@ -11,7 +14,7 @@ def get_datasets(db: Session) -> List[models.Dataset]:
 
 
 def create_dataset(db: Session, dataset: schemas.DatasetCreate) -> models.Dataset:
-    db_dataset = models.Dataset(name=dataset.name)
+    db_dataset = models.Dataset(name=dataset.name, rollup=models.DatasetRollup())
     db.add(db_dataset)
     db.commit()
     db.refresh(db_dataset)
@@ -28,49 +31,117 @@ def update_dataset(db: Session, dataset_id: str, dataset: schemas.DatasetUpdate)
 
 
 def delete_dataset(db: Session, dataset_id: str) -> bool:
-    db_dataset = db.query(models.Dataset).filter(models.Dataset.id == dataset_id).first()
-    if db_dataset:
-        db.delete(db_dataset)
-        db.commit()
-        return True
-    return False
+    """データセットを 1 回の DELETE で削除します（子の行はデータベースの ON DELETE CASCADE で削除されます）"""
+    deleted = cast(CursorResult[Any], db.execute(
+        delete(models.Dataset).where(models.Dataset.id == dataset_id).execution_options(synchronize_session=False)
+    )).rowcount
+    if not deleted:
+        return False
+    # 一括の DELETE は unit of work を通らないため、キャッシュの破棄のために明示します
+    versions.touch(db, dataset_id)
+    db.commit()
+    # セッションに読み込み済みの子の行は、データベースではすでに削除されています
+    db.expire_all()
+    return True
 
 
 # --- Dataset Rollover (Migration) ---
+ROLLOVER_BUDGET_NAME = "前年度繰越"
+
+
+def _budget_remaining(dataset_id: str) -> Tuple[Any, Any]:
+    """予算ごとの「予算総額 - 実績」（0 未満は 0）の式と、結合する実績の集計サブクエリを返します"""
+    spent = (
+        select(models.ActualExpense.budget_id, func.sum(models.ActualExpense.amount).label("spent"))
+        .join(models.Budget, models.Budget.id == models.ActualExpense.budget_id)
+        .where(models.Budget.dataset_id == dataset_id)
+        .group_by(models.ActualExpense.budget_id)
+        .subquery()
+    )
+    remaining = models.Budget.total_amount - func.coalesce(spent.c.spent, 0)
+    return case((remaining > 0, remaining), else_=0), spent
+
+
+def budget_remainders(db: Session, dataset_id: str) -> List[Tuple[models.Budget, float]]:
+    """データセットの予算と、実績を差し引いた余り（0 未満は 0）を 1 回の集計クエリで返します"""
+    remaining, spent = _budget_remaining(dataset_id)
+    rows = db.execute(
+        select(models.Budget, remaining)
+        .outerjoin(spent, spent.c.budget_id == models.Budget.id)
+        .where(models.Budget.dataset_id == dataset_id)
+        .order_by(models.Budget.id)
+    ).all()
+    return [(b, remaining) for b, remaining in rows]
+
+
+def carry_over_total(db: Session, dataset_id: str) -> float:
+    """データセットの予算の余りの合計（最小単位の整数のままデータベース上で合計します）"""
+    remaining, spent = _budget_remaining(dataset_id)
+    total = db.execute(
+        select(func.coalesce(func.sum(remaining), 0))
+        .select_from(models.Budget)
+        .outerjoin(spent, spent.c.budget_id == models.Budget.id)
+        .where(models.Budget.dataset_id == dataset_id)
+    ).scalar()
+    return cast(float, total)
+
+
 def rollover_dataset(db: Session, rollover: schemas.DatasetRollover) -> models.Dataset:
+    """新しいデータセットを作り、元のデータセットからメンバー・取り込み設定・予算の余りを引き継ぎます
+
+    コピーは INSERT ... SELECT と一括 INSERT で行い、全体を 1 回のコミットで確定します。
+    """
     # 1. 新しいデータセットを作成
-    new_ds = models.Dataset(name=rollover.new_name)
+    new_ds = models.Dataset(name=rollover.new_name, rollup=models.DatasetRollup())
     db.add(new_ds)
     db.flush() # ID確定
+    source_id = rollover.source_dataset_id
 
     # 2. メンバーのコピー
-    if rollover.carry_over_members and rollover.source_dataset_id:
-        old_members = db.query(models.Member).filter(models.Member.dataset_id == rollover.source_dataset_id).all()
-        for m in old_members:
-            new_m = models.Member(dataset_id=new_ds.id, name=m.name)
-            db.add(new_m)
-
-    # 3. 予算の繰り越し（金額の合算のみ行います）
-    carry_over_amount = 0.0
-    if rollover.source_dataset_id:
-        old_budgets = db.query(models.Budget).filter(models.Budget.dataset_id == rollover.source_dataset_id).all()
-        
-        for ob in old_budgets:
-            # 実績ベースの余りを計算
-            actual_paid = sum(ae.amount for ae in ob.actual_expenses)
-            remaining = ob.total_amount - actual_paid
-            carry_over_amount += max(0, remaining)
-
-    # 4. 繰り越し予算の作成（合算された一つの予算として登録します）
-    if rollover.carry_over_budget and carry_over_amount > 0:
-        rollover_budget = models.Budget(
-            dataset_id=new_ds.id,
-            name="前年度繰越",
-            total_amount=carry_over_amount,
-            unit="JPY",
-            description=f"旧データセット {rollover.source_dataset_id} からの繰り越し分です。"
-        )
-        db.add(rollover_budget)
+    if rollover.carry_over_members and source_id:
+        db.execute(insert(models.Member).from_select(
+            ["dataset_id", "name"],
+            select(literal(new_ds.id), models.Member.name).where(models.Member.dataset_id == source_id).order_by(models.Member.id),
+        ))
+
+    # 3. 購入予定 CSV の取り込み設定のコピー
+    if rollover.carry_over_settings and source_id:
+        db.execute(insert(models.PurchaseImportSetting).from_select(
+            ["dataset_id", "mapping_json"],
+            select(literal(new_ds.id), models.PurchaseImportSetting.mapping_json).where(models.PurchaseImportSetting.dataset_id == source_id),
+        ))
+
+    # 4. 予算の繰り越し（実績を差し引いた余りのある予算のみ）
+    if rollover.budget_carry_over == "per_budget":
+        remainders = [(b, r) for b, r in budget_remainders(db, source_id) if r > 0] if rollover.carry_over_budget and source_id else []
+        # 予算ごとに同じ名前で余りを引き継ぎ、実績 CSV の取り込み設定も新しい予算に付け替えます
+        new_ids: Dict[str, str] = {cast(str, b.id): str(uuid.uuid4()) for b, _ in remainders}
+        if new_ids:
+            db.execute(insert(models.Budget), [
+                {"id": new_ids[cast(str, b.id)], "dataset_id": new_ds.id, "name": b.name, "total_amount": remaining, "unit": b.unit,
+                 "description": f"旧データセット {source_id} の予算「{b.name}」からの繰り越し分です。"}
+                for b, remaining in remainders
+            ])
+            db.execute(insert(models.BudgetRollup), [{"budget_id": new_id} for new_id in new_ids.values()])
+        if rollover.carry_over_settings and new_ids:
+            setting_budget_id: ColumnElement[str] = models.ImportSetting.budget_id
+            settings = db.query(models.ImportSetting).filter(setting_budget_id.in_(list(new_ids))).all()
+            if settings:
+                db.execute(insert(models.ImportSetting), [
+                    {"budget_id": new_ids[cast(str, st.budget_id)], "mapping_json": st.mapping_json} for st in settings
+                ])
+    else:
+        # 合算された一つの予算として登録します
+        carry_over_amount = carry_over_total(db, source_id) if rollover.carry_over_budget and source_id else 0
+        if carry_over_amount > 0:
+            db.add(models.Budget(
+                dataset_id=new_ds.id,
+                name=ROLLOVER_BUDGET_NAME,
+                total_amount=carry_over_amount,
+                unit="JPY",
+                description=f"旧データセット {source_id} からの繰り越し分です。",
+                rollup=models.BudgetRollup(),
+            ))
 
     db.commit()
     db.refresh(new_ds)
@@ -109,8 +180,31 @@ def update_member(db: Session, member_id: int, member: schemas.MemberUpdate) ->
 
 
 # --- Budget CRUD ---
-def get_budgets(db: Session, dataset_id: str) -> List[models.Budget]:
-    return db.query(models.Budget).filter(models.Budget.dataset_id == dataset_id).all()
+def get_budgets(db: Session, dataset_id: str, params: Optional[schemas.BudgetListQuery] = None) -> Page[schemas.Budget]:
+    """予算一覧を返します（params.include に含まれない子要素はキーごと省略します）"""
+    params = params or schemas.BudgetListQuery(dataset_id=dataset_id)
+    # 子要素は予算ごとの遅延ロードではなく、種類ごとに 1 回の IN クエリでまとめて読み込みます
+    included = params.included_relations()
+    query = (
+        db.query(models.Budget)
+        .options(*[selectinload(getattr(models.Budget, name)) for name in included])
+        .filter(models.Budget.dataset_id == dataset_id)
+    )
+    sort_column: ColumnElement[Any] = {"id": models.Budget.id, "name": models.Budget.name}[params.sort]
+    page = keyset_page(query, sort_column, models.Budget.id, params.order == "desc", params.limit, params.cursor)
+    return Page([_budget_schema(b, included) for b in page.items], page.next_cursor)
+
+
+def _budget_schema(db_budget: models.Budget, included: Set[str]) -> schemas.Budget:
+    # 含めない子要素には触れずに変換し、遅延ロードが発生しないようにします
+    data = {c.key: getattr(db_budget, c.key) for c in models.Budget.__table__.columns}
+    data.update({name: getattr(db_budget, name) for name in included})
+    return schemas.Budget.model_validate(data)
+
+
+def get_budget_ids(db: Session, dataset_id: str) -> Set[str]:
+    """データセットの予算IDの集合を返します"""
+    return set(db.scalars(select(models.Budget.id).where(models.Budget.dataset_id == dataset_id)))
 
 
 def get_budget(db: Session, budget_id: str) -> Optional[models.Budget]:
@@ -125,6 +219,7 @@ def create_budget(db: Session, budget: schemas.BudgetCreate) -> models.Budget:
         total_amount=budget.total_amount,
         unit=budget.unit,
         description=budget.description,
+        rollup=models.BudgetRollup(),
     )
     db.add(db_budget)
     db.commit()
@@ -146,6 +241,14 @@ def update_budget(db: Session, budget_id: str, budget: schemas.BudgetUpdate) ->
 def delete_budget(db: Session, budget_id: str) -> bool:
     db_budget = get_budget(db, budget_id)
     if db_budget:
+        # 予算の削除で割当も消えるため、関係する購入アイテムの未割当額を更新します
+        purchase_id: ColumnElement[int] = models.Purchase.id
+        affected = purchase_id.in_(
+            select(models.BudgetAssignment.purchase_id).where(models.BudgetAssignment.budget_id == budget_id)
+        )
+        before = rollup.purchase_contribution(db, affected)
+        after = rollup.purchase_contribution(db, affected, models.BudgetAssignment.budget_id != budget_id)
+        rollup.apply_contribution(db, after - before)
         db.delete(db_budget)
         db.commit()
         return True
@@ -153,58 +256,161 @@ def delete_budget(db: Session, budget_id: str) -> bool:
 
 
 def merge_budgets(db: Session, merge_data: schemas.BudgetMerge) -> Optional[models.Budget]:
-    source_budget = db.query(models.Budget).filter(models.Budget.id == merge_data.source_budget_id).first()
-    target_budget = db.query(models.Budget).filter(models.Budget.id == merge_data.target_budget_id).first()
-    
-    if not source_budget or not target_budget:
+    return merge_budgets_into(db, merge_data.target_budget_id, [merge_data.source_budget_id])
+
+
+def merge_budgets_into(db: Session, target_budget_id: str, source_budget_ids: List[str]) -> Optional[models.Budget]:
+    """複数の予算を target にまとめ、統合元の予算を削除します（1 回のコミットで確定します）
+
+    予算・割当の件数に関係なく、数回の一括 UPDATE / INSERT ... SELECT / DELETE で処理します。
+    予算が見つからない場合、別のデータセットの予算を含む場合、target が統合元に含まれる場合は None を返します。
+    """
+    source_ids = list(dict.fromkeys(source_budget_ids))
+    if not source_ids or target_budget_id in source_ids:
         return None
-        
-    if source_budget.dataset_id != target_budget.dataset_id:
+    target_budget = db.query(models.Budget).filter(models.Budget.id == target_budget_id).first()
+    if not target_budget:
         return None
 
-    # 1. 総額の合算
-    target_budget.total_amount += source_budget.total_amount
-    
+    def from_sources(budget_id: ColumnElement[str]) -> ColumnElement[bool]:
+        """統合元の予算を指す行の条件"""
+        return budget_id.in_(source_ids)
+
+    sources = db.query(models.Budget.dataset_id, func.count(), func.sum(minor(models.Budget.total_amount))).filter(
+        from_sources(models.Budget.id)
+    ).group_by(models.Budget.dataset_id).all()
+    if len(sources) != 1 or sources[0][0] != target_budget.dataset_id or sources[0][1] != len(source_ids):
+        return None
+
+    # 1. 総額・集計値の合算（購入アイテム単位の割当合計は変わらないため予算側のみ更新します）
+    # 金額は最小単位の整数のまま、データベース上で加算します
+    target_budget.total_amount = minor(models.Budget.total_amount) + (sources[0][2] or 0)
+    actual, planned = db.query(
+        func.coalesce(func.sum(minor(models.BudgetRollup.actual_total)), 0), func.coalesce(func.sum(minor(models.BudgetRollup.planned_total)), 0)
+    ).filter(from_sources(models.BudgetRollup.budget_id)).one()
+    rollup.add_budget_totals(db, target_budget_id, actual=actual, planned=planned)
+
     # 2. BudgetAssignment の移動と合算
-    source_assignments = db.query(models.BudgetAssignment).filter(models.BudgetAssignment.budget_id == source_budget.id).all()
-    for sa in source_assignments:
-        existing_ta = db.query(models.BudgetAssignment).filter(
-            models.BudgetAssignment.budget_id == target_budget.id,
-            models.BudgetAssignment.purchase_id == sa.purchase_id
-        ).first()
-        
-        if existing_ta:
-            existing_ta.amount += sa.amount
-            db.delete(sa)
-        else:
-            sa.budget_id = target_budget.id
-            
-    # 3. ActualExpense の移動
-    db.query(models.ActualExpense).filter(models.ActualExpense.budget_id == source_budget.id).update(
-        {models.ActualExpense.budget_id: target_budget.id}
+    # 統合元の割当をすべて target に付け替えてから、同じ購入アイテムの割当を最小の id の行に合算します
+    assignment = models.BudgetAssignment
+    assignment_id: ColumnElement[int] = assignment.id
+    db.query(assignment).filter(from_sources(assignment.budget_id)).update({assignment.budget_id: target_budget_id}, synchronize_session=False)
+    keep = (
+        select(func.min(assignment_id))
+        .where(assignment.budget_id == target_budget_id)
+        .group_by(assignment.purchase_id)
+        .having(func.count() > 1)
     )
-    
-    # 4. ImportSetting (統合先に設定がなく、統合元にある場合は引き継ぐ)
-    if not target_budget.import_setting and source_budget.import_setting:
-        # SQLAlchemyの関係上、直接移動させるのは難しいため、新しいものを作成するか
-        # 既存のものを更新します
-        db_setting = models.ImportSetting(
-            budget_id=target_budget.id,
-            mapping_json=source_budget.import_setting.mapping_json
+    other = aliased(assignment)
+    db.execute(
+        update(assignment)
+        .where(assignment_id.in_(keep))
+        .values(amount=select(func.sum(other.amount)).where(other.budget_id == target_budget_id, other.purchase_id == assignment.purchase_id).scalar_subquery())
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(
+        delete(assignment)
+        .where(
+            assignment.budget_id == target_budget_id,
+            assignment_id.notin_(select(func.min(other.id)).where(other.budget_id == target_budget_id).group_by(other.purchase_id)),
         )
-        db.add(db_setting)
+        .execution_options(synchronize_session=False)
+    )
+
+    # 3. ActualExpense の移動
+    db.query(models.ActualExpense).filter(from_sources(models.ActualExpense.budget_id)).update(
+        {models.ActualExpense.budget_id: target_budget_id}, synchronize_session=False
+    )
+
+    # 4. ImportSetting（統合先に設定がなければ、統合元のうち先に指定された予算の設定を引き継ぎます）
+    setting = models.ImportSetting
+    order = case({budget_id: i for i, budget_id in enumerate(source_ids)}, value=setting.budget_id)
+    db.execute(insert(setting).from_select(
+        ["budget_id", "mapping_json"],
+        select(literal(target_budget_id), setting.mapping_json)
+        .where(from_sources(setting.budget_id), ~exists().where(setting.budget_id == target_budget_id).correlate(None))
+        .order_by(order)
+        .limit(1),
+    ))
+
+    # 5. 統合元の削除（子要素は移動済みのため、設定と集計値だけを消します）
+    db.query(setting).filter(from_sources(setting.budget_id)).delete(synchronize_session=False)
+    db.query(models.BudgetRollup).filter(from_sources(models.BudgetRollup.budget_id)).delete(synchronize_session=False)
+    db.query(models.Budget).filter(from_sources(models.Budget.id)).delete(synchronize_session=False)
+    versions.touch(db, cast(str, target_budget.dataset_id))
 
-    # 5. 統合元の削除
-    db.delete(source_budget)
-    
     db.commit()
+    # 一括更新はセッション内のオブジェクトに反映されないため、読み直します
+    db.expire_all()
     db.refresh(target_budget)
     return target_budget
 
 
 # --- Purchase CRUD ---
-def get_purchases(db: Session, dataset_id: str) -> List[models.Purchase]:
-    return db.query(models.Purchase).filter(models.Purchase.dataset_id == dataset_id).all()
+def get_purchases(db: Session, dataset_id: str, params: Optional[schemas.PurchaseListQuery] = None) -> Page[models.Purchase]:
+    params = params or schemas.PurchaseListQuery(dataset_id=dataset_id)
+    query = (
+        db.query(models.Purchase)
+        .options(selectinload(models.Purchase.assignments))
+        .filter(models.Purchase.dataset_id == dataset_id)
+    )
+    status: ColumnElement[Optional[str]] = models.Purchase.status
+    category: ColumnElement[Optional[str]] = models.Purchase.category
+    priority: ColumnElement[Optional[int]] = models.Purchase.priority
+    if params.status:
+        query = query.filter(status.in_(params.status))
+    if params.category:
+        query = query.filter(category.in_(params.category))
+    if params.member_name is not None:
+        query = query.filter(models.Purchase.member_name == params.member_name)
+    if params.priority_min is not None:
+        query = query.filter(priority >= params.priority_min)
+    if params.priority_max is not None:
+        query = query.filter(priority <= params.priority_max)
+    if params.budget_id is not None:
+        # (budget_id, purchase_id) のインデックスで割当の有無を確認します
+        query = query.filter(
+            select(models.BudgetAssignment.id)
+            .where(
+                models.BudgetAssignment.budget_id == params.budget_id,
+                models.BudgetAssignment.purchase_id == models.Purchase.id,
+            )
+            .exists()
+        )
+    sort_column: ColumnElement[Any] = {
+        "id": models.Purchase.id,
+        "amount": models.Purchase.amount,
+        "priority": models.Purchase.priority,
+        "category": models.Purchase.category,
+    }[params.sort]
+    return keyset_page(query, sort_column, models.Purchase.id, params.order == "desc", params.limit, params.cursor)
+
+
+def iter_purchase_export_rows(db: Session, dataset_id: str, chunk_size: int = 1000) -> Iterator[Tuple[Any, ...]]:
+    """CSVエクスポート用に購入アイテムと割当を 1 本の結合クエリで chunk_size 件ずつ読み出します
+
+    割当のないアイテムは割当列が None の 1 行、割当が複数あるアイテムは割当ごとに 1 行になります。
+    """
+    query: "Query[Any]" = (
+        db.query(
+            models.Purchase.member_name,
+            models.Purchase.category,
+            models.Purchase.item_name,
+            models.Purchase.amount,
+            models.Purchase.unit,
+            models.Purchase.status,
+            models.Purchase.priority,
+            models.Purchase.note,
+            models.BudgetAssignment.budget_id,
+            models.BudgetAssignment.amount,
+        )
+        .outerjoin(models.BudgetAssignment, models.BudgetAssignment.purchase_id == models.Purchase.id)
+        .filter(models.Purchase.dataset_id == dataset_id)
+        .order_by(models.Purchase.id, models.BudgetAssignment.id)
+        .yield_per(chunk_size)
+    )
+    for row in query:
+        yield tuple(row)
 
 
 def create_purchase(db: Session, purchase: schemas.PurchaseCreate) -> models.Purchase:
@@ -230,50 +436,188 @@ def create_purchase(db: Session, purchase: schemas.PurchaseCreate) -> models.Pur
         )
         db.add(db_assignment)
 
+    rollup.add_purchases(db, models.Purchase.id == db_purchase.id)
     db.commit()
     db.refresh(db_purchase)
     return db_purchase
 
 
-def create_purchases_bulk(db: Session, dataset_id: str, purchases: List[schemas.PurchaseCreate]) -> List[models.Purchase]:
-    db_purchases = []
-    for p_data in purchases:
-        db_purchase = models.Purchase(
-            dataset_id=dataset_id,
-            member_name=p_data.member_name,
-            category=p_data.category,
-            item_name=p_data.item_name,
-            amount=p_data.amount,
-            unit=p_data.unit,
-            status=p_data.status,
-            priority=p_data.priority,
-            note=p_data.note,
+def insert_purchases_bulk(db: Session, dataset_id: str, purchases: List[schemas.PurchaseCreate]) -> List[int]:
+    """購入アイテムを複数行 INSERT ... RETURNING で、割当を executemany でまとめて登録し、ID を入力順で返します"""
+    if not purchases:
+        return []
+
+    purchase_rows = [
+        _with_scalar_defaults(models.Purchase, {
+            "dataset_id": dataset_id,
+            "member_name": p_data.member_name,
+            "category": p_data.category,
+            "item_name": p_data.item_name,
+            "amount": p_data.amount,
+            "unit": p_data.unit,
+            "status": p_data.status,
+            "priority": p_data.priority,
+            "note": p_data.note,
+        })
+        for p_data in purchases
+    ]
+    # render_nulls で全行を同じ列構成にし、複数行 VALUES のバッチにまとめます。
+    # 1 文の中では入力順に連番の ID が振られるため、昇順に並べ替えると入力順と一致します
+    # （sort_by_parameter_order は SQLite では 1 行ずつの INSERT に戻ってしまうため使いません）。
+    ids: List[int] = sorted(
+        db.scalars(
+            insert(models.Purchase).returning(models.Purchase.id),
+            purchase_rows,
+            execution_options={"render_nulls": True},
         )
-        db.add(db_purchase)
-        db.flush()
-
-        for assignment in p_data.assignments:
-            db_assignment = models.BudgetAssignment(
-                purchase_id=db_purchase.id,
-                budget_id=assignment.budget_id,
-                amount=assignment.amount,
-            )
-            db.add(db_assignment)
-        db_purchases.append(db_purchase)
+    )
 
+    assignment_rows = [
+        {"purchase_id": purchase_id, "budget_id": assignment.budget_id, "amount": assignment.amount}
+        for purchase_id, p_data in zip(ids, purchases)
+        for assignment in p_data.assignments
+    ]
+    if assignment_rows:
+        db.execute(insert(models.BudgetAssignment), assignment_rows)
+
+    # 今回追加した ID 範囲だけを集計して加算します
+    rollup.add_purchases(db, _purchase_id_range(ids))
+    versions.touch(db, dataset_id)
     db.commit()
-    return db_purchases
+    return ids
+
+
+def create_purchases_bulk(db: Session, dataset_id: str, purchases: List[schemas.PurchaseCreate]) -> List[models.Purchase]:
+    ids = insert_purchases_bulk(db, dataset_id, purchases)
+    if not ids:
+        return []
+    return (
+        db.query(models.Purchase)
+        .options(selectinload(models.Purchase.assignments))
+        .filter(_purchase_id_range(ids))
+        .order_by(models.Purchase.id)
+        .all()
+    )
+
+
+def _with_scalar_defaults(model: Any, row: Dict[str, Any]) -> Dict[str, Any]:
+    # ORM の通常の INSERT と同様に、None の列にはモデルの既定値（unit="JPY" など）を使います
+    for key, value in row.items():
+        default = model.__table__.c[key].default
+        if value is None and default is not None and default.is_scalar:
+            row[key] = default.arg
+    return row
+
+
+def _purchase_id_range(ids: List[int]) -> Any:
+    # 一括登録した ID は同じトランザクション内の連番になるため、IN 句ではなく主キーの範囲で絞り込みます。
+    # dataset_id で絞るとデータセットのインデックスが選ばれ、件数が増えるほどチャンクごとの集計が遅くなります
+    return models.Purchase.id.between(min(ids), max(ids))
 
 
 def update_purchase_status(db: Session, purchase_id: int, status: str) -> Optional[models.Purchase]:
     db_purchase = db.query(models.Purchase).filter(models.Purchase.id == purchase_id).first()
     if db_purchase:
-        db_purchase.status = status
+        with rollup.track_purchases(db, models.Purchase.id == purchase_id):
+            db_purchase.status = status
         db.commit()
         db.refresh(db_purchase)
     return db_purchase
 
 
+# ロールアップ（rollup.purchase_contribution）の値に影響する項目
+ROLLUP_PURCHASE_FIELDS = {"status", "category", "amount"}
+# 一括更新の filter で複数の値を指定できる項目
+BATCH_FILTER_COLUMNS: Dict[str, ColumnElement[Optional[str]]] = {
+    "status": models.Purchase.status,
+    "category": models.Purchase.category,
+}
+
+
+def _batch_conditions(batch: schemas.PurchaseBatchUpdate) -> Tuple[List[ColumnElement[bool]], Set[str]]:
+    """一括更新の対象の条件（先頭はデータセットの条件）と、条件に使った項目を返します"""
+    conditions: List[ColumnElement[bool]] = [models.Purchase.dataset_id == batch.dataset_id]
+    filter_fields: Set[str] = set()
+    if batch.ids is not None:
+        purchase_id: ColumnElement[int] = models.Purchase.id
+        conditions.append(purchase_id.in_(batch.ids))
+    elif batch.filter is not None:
+        for name, values in (("status", batch.filter.status), ("category", batch.filter.category)):
+            if values:
+                conditions.append(BATCH_FILTER_COLUMNS[name].in_(values))
+                filter_fields.add(name)
+        if batch.filter.member_name is not None:
+            conditions.append(models.Purchase.member_name == batch.filter.member_name)
+            filter_fields.add("member_name")
+    return conditions, filter_fields
+
+
+def update_purchases_batch(db: Session, batch: schemas.PurchaseBatchUpdate) -> schemas.PurchaseBatchResult:
+    """ids または filter に一致するデータセット内の購入アイテムに、patch の値を 1 回の UPDATE で設定します"""
+    changes: Dict[str, Any] = batch.patch.model_dump(exclude_unset=True)
+    conditions, filter_fields = _batch_conditions(batch)
+
+    stmt = update(models.Purchase).where(*conditions).values(changes).execution_options(synchronize_session=False)
+    if batch.return_rows:
+        stmt = stmt.returning(models.Purchase.id)
+
+    def execute() -> Tuple[int, List[int]]:
+        result = cast(CursorResult[Any], db.execute(stmt))
+        if batch.return_rows:
+            ids = list(result.scalars())
+            return len(ids), ids
+        return result.rowcount, []
+
+    if ROLLUP_PURCHASE_FIELDS.isdisjoint(changes):
+        updated, ids = execute()
+    else:
+        # 更新で条件から外れる行も差分に含めるため、patch する項目を使わない条件で前後を集計します
+        tracked = and_(*conditions) if filter_fields.isdisjoint(changes) else conditions[0]
+        with rollup.track_purchases(db, tracked):
+            updated, ids = execute()
+    if updated:
+        versions.touch(db, batch.dataset_id)
+    db.commit()
+
+    purchases = None
+    if batch.return_rows:
+        rows = (
+            db.query(models.Purchase)
+            .options(selectinload(models.Purchase.assignments))
+            .filter(models.Purchase.id.in_(ids))
+            .order_by(models.Purchase.id)
+            .all()
+        ) if ids else []
+        purchases = [schemas.Purchase.model_validate(p) for p in rows]
+    return schemas.PurchaseBatchResult(updated=updated, purchases=purchases)
+
+
+def diff_assignments(
+    existing: List[models.BudgetAssignment], incoming: List[Dict[str, Any]],
+) -> Tuple[List[models.BudgetAssignment], List[Tuple[models.BudgetAssignment, float]], List[Tuple[str, float]]]:
+    """既存の割当と新しい割当を budget_id ごとに比較し、(削除, 金額の更新, 追加) を返します
+
+    同じ予算への割当が複数ある場合は、金額を合計した 1 件として扱います。
+    """
+    # 金額は保存時と同じ最小単位の整数で合計・比較します
+    wanted: Dict[str, int] = {}
+    for asgn in incoming:
+        wanted[asgn["budget_id"]] = wanted.get(asgn["budget_id"], 0) + to_minor(asgn["amount"])
+    deletes: List[models.BudgetAssignment] = []
+    updates: List[Tuple[models.BudgetAssignment, float]] = []
+    kept: Set[str] = set()
+    for db_asgn in existing:
+        budget_id = cast(str, db_asgn.budget_id)
+        if budget_id not in wanted or budget_id in kept:
+            deletes.append(db_asgn)
+            continue
+        kept.add(budget_id)
+        if to_minor(db_asgn.amount) != wanted[budget_id]:
+            updates.append((db_asgn, from_minor(wanted[budget_id])))
+    inserts = [(budget_id, from_minor(amount)) for budget_id, amount in wanted.items() if budget_id not in kept]
+    return deletes, updates, inserts
+
+
 def update_purchase(db: Session, purchase_id: int, purchase: schemas.PurchaseUpdate) -> Optional[models.Purchase]:
     db_purchase = db.query(models.Purchase).filter(models.Purchase.id == purchase_id).first()
     if not db_purchase:
@@ -281,19 +625,26 @@ def update_purchase(db: Session, purchase_id: int, purchase: schemas.PurchaseUpd
 
     update_data = purchase.model_dump(exclude_unset=True)
     assignments_data = update_data.pop("assignments", None)
-
-    for key, value in update_data.items():
-        setattr(db_purchase, key, value)
-
-    if assignments_data is not None:
-        db.query(models.BudgetAssignment).filter(models.BudgetAssignment.purchase_id == purchase_id).delete()
-        for asgn in assignments_data:
-            db_asgn = models.BudgetAssignment(
-                purchase_id=purchase_id,
-                budget_id=asgn["budget_id"],
-                amount=asgn["amount"],
-            )
-            db.add(db_asgn)
+    changes = {key: value for key, value in update_data.items() if getattr(db_purchase, key) != value}
+    # 割当は全件を削除して入れ直さず、変わったものだけを追加・更新・削除します
+    deletes, updates, inserts = diff_assignments(db_purchase.assignments, assignments_data) if assignments_data is not None else ([], [], [])
+
+    def apply() -> None:
+        for key, value in changes.items():
+            setattr(db_purchase, key, value)
+        for db_asgn in deletes:
+            db_purchase.assignments.remove(db_asgn)
+        for db_asgn, amount in updates:
+            setattr(db_asgn, "amount", amount)
+        for budget_id, amount in inserts:
+            db_purchase.assignments.append(models.BudgetAssignment(budget_id=budget_id, amount=amount))
+
+    if deletes or updates or inserts or not ROLLUP_PURCHASE_FIELDS.isdisjoint(changes):
+        with rollup.track_purchases(db, models.Purchase.id == purchase_id):
+            apply()
+    else:
+        # ロールアップに関係する値が変わらない場合は集計を省きます
+        apply()
 
     db.commit()
     db.refresh(db_purchase)
@@ -303,128 +654,104 @@ def update_purchase(db: Session, purchase_id: int, purchase: schemas.PurchaseUpd
 def delete_purchase(db: Session, purchase_id: int) -> bool:
     db_purchase = db.query(models.Purchase).filter(models.Purchase.id == purchase_id).first()
     if db_purchase:
-        db.delete(db_purchase)
+        with rollup.track_purchases(db, models.Purchase.id == purchase_id):
+            db.delete(db_purchase)
         db.commit()
         return True
     return False
 
 
 def clear_all_purchases(db: Session, dataset_id: str) -> bool:
-    # 削除処理を確実に行うために、まず関連する BudgetAssignment を削除します
-    # (cascade設定がありますが、念のための明示的削除です)
-    purchase_ids = [p.id for p in db.query(models.Purchase.id).filter(models.Purchase.dataset_id == dataset_id).all()]
-    if purchase_ids:
-        db.query(models.BudgetAssignment).filter(models.BudgetAssignment.purchase_id.in_(purchase_ids)).delete(synchronize_session='fetch')
-    
-    # 次に Purchase 本体を削除します
-    db.query(models.Purchase).filter(models.Purchase.dataset_id == dataset_id).delete(synchronize_session='fetch')
-    db.flush()
+    # 購入アイテムを 1 回の DELETE で削除します（割当はデータベースの ON DELETE CASCADE で削除されます）。
+    # ID を Python に読み込まない（synchronize_session=False）ため、件数に関係なくメモリを使いません。
+    # セッションに読み込み済みの購入アイテムは呼び出し側で expire_all() してください
+    with rollup.track_purchases(db, models.Purchase.dataset_id == dataset_id):
+        db.execute(
+            delete(models.Purchase).where(models.Purchase.dataset_id == dataset_id).execution_options(synchronize_session=False)
+        )
+    versions.touch(db, dataset_id)
     return True
 
 
 # --- Dashboard & Summary ---
 def get_dashboard_summary(db: Session, dataset_id: str) -> schemas.DashboardSummary:
-    budgets = db.query(models.Budget).filter(models.Budget.dataset_id == dataset_id).all()
-    all_purchases = db.query(models.Purchase).filter(models.Purchase.dataset_id == dataset_id).all()
-
-    budget_summaries: List[schemas.BudgetSummary] = []
-    overall_actual_total = 0.0
-
-    for b in budgets:
-        # 実績支払額の合計（CSV等からインポートされた確定支出）
-        actual_total = sum(ae.amount for ae in b.actual_expenses)
-        
-        # 予算別の予定額（未払の予定のみを抽出）
-        # 運用思想：ステータスが「書いただけ」「見積済み」のものを純粋な「予定」とみなします
-        planned_total = float(sum(
-            asgn.amount
-            for asgn in b.assignments
-            if asgn.purchase.status in ["書いただけ", "見積済み"]
-        ))
-        
+    # 集計値は書き込み時に更新済みのロールアップから読み取ります（予算数にのみ比例）
+    # 金額の足し引きは最小単位の整数のままデータベース上で行います
+    ds_rollup = rollup.ensure_dataset(db, dataset_id)
+    # 実績支払額の合計（CSV等からインポートされた確定支出）と、予算別の予定額（未払の予定のみ）
+    actual: Any = func.coalesce(models.BudgetRollup.actual_total, 0)
+    planned: Any = func.coalesce(models.BudgetRollup.planned_total, 0)
+    rows = db.execute(
         # 予算別の余り予測（予算総額 - すでに支払った実績 - これから発生する予定）
-        remaining_forecast = float(b.total_amount) - actual_total - planned_total
-
-        budget_summaries.append(
-            schemas.BudgetSummary(
-                budget_id=cast(str, b.id),
-                name=cast(str, b.name),
-                total_amount=cast(float, b.total_amount),
-                actual_total=float(actual_total),
-                planned_total=planned_total,
-                remaining_forecast=remaining_forecast,
-                unit=cast(str, b.unit),
-                description=cast(Optional[str], b.description),
-            )
+        select(models.Budget, actual, planned, models.Budget.total_amount - actual - planned)
+        .outerjoin(models.BudgetRollup, models.BudgetRollup.budget_id == models.Budget.id)
+        .where(models.Budget.dataset_id == dataset_id)
+        .order_by(models.Budget.id)
+    ).all()
+    budget_summaries = [
+        schemas.BudgetSummary(
+            budget_id=cast(str, b.id),
+            name=cast(str, b.name),
+            total_amount=cast(float, b.total_amount),
+            actual_total=actual_total,
+            planned_total=planned_total,
+            remaining_forecast=remaining_forecast,
+            unit=cast(str, b.unit),
+            description=cast(Optional[str], b.description),
         )
-        overall_actual_total += float(actual_total)
-
-    # 各カテゴリー別の予定額計算（未払分のみ）
-    fixed_cost_planned_total = float(
-        sum(
-            p.amount
-            for p in all_purchases
-            if p.category == "固定費" and p.status in ["書いただけ", "見積済み"]
+        for b, actual_total, planned_total, remaining_forecast in rows
+    ]
+
+    totals = {
+        f: cast(float, getattr(ds_rollup, f)) if ds_rollup else 0.0
+        for f in rollup.DATASET_FIELDS
+    }
+
+    # 全体の予定合計額と、全体の余り予測（全予算の総額 - 全実績 - 全未払予定）
+    budget_sums = (
+        select(
+            func.coalesce(func.sum(minor(models.Budget.total_amount)), 0).label("total"),
+            func.coalesce(func.sum(minor(models.BudgetRollup.actual_total)), 0).label("actual"),
         )
+        .select_from(models.Budget)
+        .outerjoin(models.BudgetRollup, models.BudgetRollup.budget_id == models.Budget.id)
+        .where(models.Budget.dataset_id == dataset_id)
+        .subquery()
     )
-    travel_planned_total = float(
-        sum(
-            p.amount
-            for p in all_purchases
-            if p.category == "旅費" and p.status in ["書いただけ", "見積済み"]
+    ds_planned = func.coalesce(
+        select(
+            minor(models.DatasetRollup.fixed_cost_planned_total)
+            + minor(models.DatasetRollup.travel_planned_total)
+            + minor(models.DatasetRollup.other_planned_total)
         )
+        .where(models.DatasetRollup.dataset_id == dataset_id)
+        .scalar_subquery(),
+        0,
     )
-    other_planned_total = float(
-        sum(
-            p.amount
-            for p in all_purchases
-            if p.category not in ["固定費", "旅費"] and p.status in ["書いただけ", "見積済み"]
-        )
-    )
-
-    # 全体の予定合計額
-    overall_planned_total = (
-        fixed_cost_planned_total + travel_planned_total + other_planned_total
-    )
-
-    # 未割当の予定額計算
-    unassigned_planned_total = float(
-        sum(
-            max(0.0, p.amount - sum(asgn.amount for asgn in p.assignments))
-            for p in all_purchases
-            if p.status in ["書いただけ", "見積済み"]
-        )
+    overall_actual_total, overall_planned_total, overall_remaining_forecast = (
+        from_minor(v) for v in db.execute(
+            select(budget_sums.c.actual, ds_planned, budget_sums.c.total - budget_sums.c.actual - ds_planned)
+        ).one()
     )
 
-    # 固定費分析用の総額（ステータスに関わらず、ただし「購入しない」は除外）
-    fixed_cost_total = float(
-        sum(
-            p.amount
-            for p in all_purchases
-            if p.category == "固定費" and p.status != "購入しない"
-        )
-    )
-    
-    # 全体の余り予測（全予算の総額 - 全実績 - 全未払予定）
-    overall_remaining_forecast = (
-        float(sum(b.total_amount for b in budgets))
-        - overall_actual_total
-        - overall_planned_total
+    travel_purchases = (
+        db.query(models.Purchase)
+        .options(selectinload(models.Purchase.assignments))
+        .filter(models.Purchase.dataset_id == dataset_id, rollup.is_travel(), rollup.is_purchasing())
+        .order_by(models.Purchase.id)
+        .all()
     )
 
-    travel_purchases = [p for p in all_purchases if p.category == "旅費" and p.status != "購入しない"]
-    travel_cost_total = float(sum(p.amount for p in travel_purchases))
-
     return schemas.DashboardSummary(
         overall_actual_total=overall_actual_total,
         overall_planned_total=overall_planned_total,
         overall_remaining_forecast=overall_remaining_forecast,
-        unassigned_planned_total=unassigned_planned_total,
-        fixed_cost_total=fixed_cost_total,
-        fixed_cost_planned_total=fixed_cost_planned_total,
-        travel_planned_total=travel_planned_total,
-        other_planned_total=other_planned_total,
-        travel_cost_total=travel_cost_total,
+        unassigned_planned_total=totals["unassigned_planned_total"],
+        fixed_cost_total=totals["fixed_cost_total"],
+        fixed_cost_planned_total=totals["fixed_cost_planned_total"],
+        travel_planned_total=totals["travel_planned_total"],
+        other_planned_total=totals["other_planned_total"],
+        travel_cost_total=totals["travel_cost_total"],
         budgets=budget_summaries,
         travel_items=cast(List[schemas.Purchase], travel_purchases),
     )
@@ -466,6 +793,7 @@ def save_import_setting(db: Session, budget_id: str, mapping_json: str) -> model
 def create_actual_expenses(db: Session, budget_id: str, expenses: List[schemas.ActualExpenseCreate], overwrite: bool = False) -> bool:
     if overwrite:
         db.query(models.ActualExpense).filter(models.ActualExpense.budget_id == budget_id).delete()
+        versions.touch_budget(db, budget_id)
 
     for exp in expenses:
         db_exp = models.ActualExpense(
@@ -476,17 +804,34 @@ def create_actual_expenses(db: Session, budget_id: str, expenses: List[schemas.A
         )
         db.add(db_exp)
 
+    # 実績額は Python で足し合わせず、登録後の行からデータベース上で合計し直します
+    rollup.refresh_budget_actual(db, budget_id)
     db.commit()
     return True
 
 
-def get_actual_expenses(db: Session, budget_id: str) -> List[models.ActualExpense]:
-    return db.query(models.ActualExpense).filter(models.ActualExpense.budget_id == budget_id).all()
+def create_actual_expense(db: Session, budget_id: str, expense: schemas.ActualExpenseCreate) -> models.ActualExpense:
+    expense_data = expense.model_dump()
+    expense_data["budget_id"] = budget_id
+    db_exp = models.ActualExpense(**expense_data)
+    db.add(db_exp)
+    rollup.add_budget_totals(db, budget_id, actual=to_minor(expense.amount))
+    db.commit()
+    db.refresh(db_exp)
+    return db_exp
+
+
+def get_actual_expenses(db: Session, budget_id: str, params: Optional[schemas.ActualExpenseListQuery] = None) -> Page[models.ActualExpense]:
+    params = params or schemas.ActualExpenseListQuery()
+    query = db.query(models.ActualExpense).filter(models.ActualExpense.budget_id == budget_id)
+    sort_column: ColumnElement[Any] = {"id": models.ActualExpense.id, "amount": models.ActualExpense.amount}[params.sort]
+    return keyset_page(query, sort_column, models.ActualExpense.id, params.order == "desc", params.limit, params.cursor)
 
 
 def delete_actual_expense(db: Session, expense_id: int) -> bool:
     db_exp = db.query(models.ActualExpense).filter(models.ActualExpense.id == expense_id).first()
     if db_exp:
+        rollup.add_budget_totals(db, cast(str, db_exp.budget_id), actual=-to_minor(db_exp.amount))
         db.delete(db_exp)
         db.commit()
         return True
@@ -496,8 +841,15 @@ def delete_actual_expense(db: Session, expense_id: int) -> bool:
 def update_actual_expense(db: Session, expense_id: int, expense: schemas.ActualExpenseCreate) -> Optional[models.ActualExpense]:
     db_exp = db.query(models.ActualExpense).filter(models.ActualExpense.id == expense_id).first()
     if db_exp:
-        for key, value in expense.model_dump().items():
+        update_data = expense.model_dump()
+        # budget_id を省略した更新（フロントエンドの通常の編集）では所属予算を維持します
+        if update_data.get("budget_id") is None:
+            update_data.pop("budget_id", None)
+
+        rollup.add_budget_totals(db, cast(str, db_exp.budget_id), actual=-to_minor(db_exp.amount))
+        for key, value in update_data.items():
             setattr(db_exp, key, value)
+        rollup.add_budget_totals(db, cast(str, db_exp.budget_id), actual=to_minor(db_exp.amount))
         db.commit()
         db.refresh(db_exp)
     return db_exp
@@ -1,28 +1,301 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
+import dataclasses
 import os
-from typing import Generator
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, Generator, Iterator, List, Mapping, Optional, Tuple, TypeVar, Union, cast
 from dotenv import load_dotenv, find_dotenv
 
+from . import metrics
+from .pagination import Page
+
 # .envファイルを親ディレクトリまで遡って検索
 load_dotenv(find_dotenv())
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./osaifill.db")
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args=(
-        {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+# 非同期ドライバー（sqlite+aiosqlite:// や postgresql+asyncpg:// など）を指定した場合は非同期モードで動作します
+_url = make_url(DATABASE_URL)
+ASYNC_MODE = _url.get_dialect().is_async
+
+
+
+def _sync_url(url: URL) -> URL:
+    return url.set(drivername=url.get_backend_name()) if url.get_dialect().is_async else url
+
+
+# マイグレーションや CLI は同期エンジンを使うため、非同期モードでも同じバックエンドの同期ドライバーで接続します
+SYNC_DATABASE_URL = _sync_url(_url)
+
+
+def _connect_args(url: Any) -> Dict[str, Any]:
+    return {"check_same_thread": False} if make_url(url).get_backend_name() == "sqlite" else {}
+
+
+# --- SQLite の PRAGMA と接続プール ---
+
+@dataclass(frozen=True)
+class SqliteProfile:
+    """接続ごとに実行する PRAGMA（None の項目は SQLite の既定値のままにします）"""
+    journal_mode: Optional[str] = None
+    synchronous: Optional[str] = None
+    # 負の値は KiB 単位、正の値はページ数
+    cache_size: Optional[int] = None
+    mmap_size: Optional[int] = None
+    busy_timeout_ms: Optional[int] = None
+    temp_store: Optional[str] = None
+
+    def pragmas(self) -> List[Tuple[str, Any]]:
+        values = [
+            ("journal_mode", self.journal_mode),
+            ("synchronous", self.synchronous),
+            ("cache_size", self.cache_size),
+            ("mmap_size", self.mmap_size),
+            ("busy_timeout", self.busy_timeout_ms),
+            ("temp_store", self.temp_store),
+        ]
+        return [(name, value) for name, value in values if value is not None]
+
+
+SQLITE_PROFILES: Dict[str, SqliteProfile] = {
+    # SQLite の既定値（ロールバックジャーナル・synchronous=FULL）
+    "default": SqliteProfile(),
+    # WAL で読み取りと書き込みが互いを待たないようにし、ロック待ちはエラーにせず busy_timeout まで待ちます
+    "tuned": SqliteProfile(
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        cache_size=-64 * 1024,
+        mmap_size=256 * 1024 * 1024,
+        busy_timeout_ms=5000,
+        temp_store="MEMORY",
     ),
-)
+}
+
+_PRAGMA_CHOICES = {
+    "journal_mode": {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"},
+    "synchronous": {"OFF", "NORMAL", "FULL", "EXTRA"},
+    "temp_store": {"DEFAULT", "FILE", "MEMORY"},
+}
+_PRAGMA_ENV = {
+    "journal_mode": "SQLITE_JOURNAL_MODE",
+    "synchronous": "SQLITE_SYNCHRONOUS",
+    "cache_size": "SQLITE_CACHE_SIZE",
+    "mmap_size": "SQLITE_MMAP_SIZE",
+    "busy_timeout_ms": "SQLITE_BUSY_TIMEOUT_MS",
+    "temp_store": "SQLITE_TEMP_STORE",
+}
+
+
+def sqlite_profile_from_env(env: Mapping[str, str] = os.environ) -> SqliteProfile:
+    """SQLITE_PROFILE（default / tuned）を基に、SQLITE_* の環境変数で個別の PRAGMA を上書きします"""
+    name = env.get("SQLITE_PROFILE", "tuned")
+    if name not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLITE_PROFILE: {name} (expected one of {', '.join(SQLITE_PROFILES)})")
+    overrides: Dict[str, Any] = {}
+    for field, var in _PRAGMA_ENV.items():
+        raw = env.get(var)
+        if raw is None or raw == "":
+            continue
+        if field in _PRAGMA_CHOICES:
+            value = raw.upper()
+            if value not in _PRAGMA_CHOICES[field]:
+                raise ValueError(f"Invalid {var}: {raw}")
+            overrides[field] = value
+        else:
+            overrides[field] = int(raw)
+    return dataclasses.replace(SQLITE_PROFILES[name], **overrides)
+
+
+def pool_options_from_env(env: Mapping[str, str] = os.environ) -> Dict[str, Any]:
+    """DB_POOL_SIZE などの環境変数から create_engine に渡す接続プールの設定を返します"""
+    return {
+        "pool_size": int(env.get("DB_POOL_SIZE", "5")),
+        "max_overflow": int(env.get("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(env.get("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(env.get("DB_POOL_RECYCLE", "-1")),
+        "pool_pre_ping": env.get("DB_POOL_PRE_PING", "").lower() in ("1", "true", "yes"),
+    }
+
+
+def _is_memory_sqlite(url: URL) -> bool:
+    return url.get_backend_name() == "sqlite" and (
+        url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+    )
+
+
+def engine_options(url: Any, pool_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    options: Dict[str, Any] = {"connect_args": _connect_args(url)}
+    # インメモリの SQLite は接続ごとに別のデータベースになるため、SQLAlchemy 既定の専用プールのままにします
+    if not _is_memory_sqlite(make_url(url)):
+        options.update(pool_options if pool_options is not None else pool_options_from_env())
+        # 接続の取得待ちの時間をメトリクスに記録します
+        options["poolclass"] = metrics.timed_pool(AsyncAdaptedQueuePool if make_url(url).get_dialect().is_async else QueuePool)
+    return options
+
+
+def apply_sqlite_profile(engine: Engine, profile: SqliteProfile) -> None:
+    """新しい接続を開くたびに profile の PRAGMA を実行します"""
+    if engine.url.get_backend_name() != "sqlite" or not profile.pragmas():
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in profile.pragmas():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def enable_sqlite_foreign_keys(engine: Engine) -> None:
+    """新しい接続を開くたびに外部キー制約（ON DELETE CASCADE を含む）を有効にします
+
+    SQLite は接続ごとに PRAGMA foreign_keys=ON を実行しない限り、外部キーを検査せず連鎖削除も行いません。
+    """
+    if engine.url.get_backend_name() != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _enable_foreign_keys(dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA foreign_keys=ON")
+        finally:
+            cursor.close()
+
+
+def make_engine(url: Any, profile: Optional[SqliteProfile] = None, pool_options: Optional[Dict[str, Any]] = None) -> Engine:
+    """接続プールの設定と SQLite の PRAGMA（外部キー制約を含む）を適用した同期エンジンを作ります"""
+    new_engine = create_engine(url, **engine_options(url, pool_options))
+    apply_sqlite_profile(new_engine, profile if profile is not None else SQLITE_PROFILE)
+    enable_sqlite_foreign_keys(new_engine)
+    return new_engine
+
+
+SQLITE_PROFILE = sqlite_profile_from_env()
+
+engine = make_engine(SYNC_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = None
+AsyncSessionLocal: Optional[async_sessionmaker[AsyncSession]] = None
+if ASYNC_MODE:
+    async_engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+    apply_sqlite_profile(async_engine.sync_engine, SQLITE_PROFILE)
+    enable_sqlite_foreign_keys(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+
 Base = declarative_base()
 
+T = TypeVar("T")
+
+# ルートが受け取るセッション（同期モードでは Session、非同期モードでは AsyncSession）
+DbSession = Union[Session, AsyncSession]
+
 
-def get_db() -> Generator[Session, None, None]:
+def get_sync_db() -> Generator[Session, None, None]:
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    assert AsyncSessionLocal is not None, "DATABASE_URL does not use an async driver"
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+get_db = get_async_db if ASYNC_MODE else get_sync_db
+
+
+def convert_result(result: Any, as_model: Optional[Any]) -> Any:
+    """crud 関数の戻り値（ORM オブジェクト・そのリスト・Page）を as_model の Pydantic モデルに変換します"""
+    if as_model is None or result is None:
+        return result
+    if isinstance(result, Page):
+        return Page(convert_result(result.items, as_model), result.next_cursor)
+    if isinstance(result, list):
+        return [as_model.model_validate(r) for r in result]
+    return as_model.model_validate(result)
+
+
+async def run_db(db: DbSession, fn: Callable[..., Any], *args: Any, as_model: Optional[Any] = None) -> Any:
+    """crud 関数をイベントループをブロックせずに実行します
+
+    同期モードではスレッドプールで、非同期モードでは AsyncSession.run_sync で fn(session, *args) を呼び出します。
+    as_model を指定すると、遅延ロードが発生しうる ORM オブジェクトをセッションの中で Pydantic モデルに変換して返します。
+    """
+    def call(session: Session) -> Any:
+        return convert_result(fn(session, *args), as_model)
+
+    if isinstance(db, Session):
+        return await run_in_threadpool(call, db)
+    return await db.run_sync(call)
+
+
+_sync_sessionmakers: Dict[str, sessionmaker[Session]] = {SYNC_DATABASE_URL.render_as_string(hide_password=False): SessionLocal}
+_sync_sessionmakers_lock = threading.Lock()
+
+
+def _sync_sessionmaker(db: AsyncSession) -> sessionmaker[Session]:
+    url = _sync_url(db.get_bind().engine.url)
+    key = url.render_as_string(hide_password=False)
+    with _sync_sessionmakers_lock:
+        factory = _sync_sessionmakers.get(key)
+        if factory is None:
+            factory = sessionmaker(autocommit=False, autoflush=False, bind=make_engine(url))
+            _sync_sessionmakers[key] = factory
+    return factory
+
+
+def background_sessionmaker(db: DbSession) -> sessionmaker[Session]:
+    """リクエストの終了後も続く処理のために、同じ接続先の同期セッションを作るファクトリーを返します"""
+    if isinstance(db, Session):
+        return sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind())
+    return _sync_sessionmaker(db)
+
+
+@contextmanager
+def sync_session(db: DbSession) -> Iterator[Session]:
+    """ワーカースレッドで使う同期セッションを返します
+
+    同期モードではリクエストのセッションをそのまま使い、非同期モードでは同じデータベースに
+    同期ドライバーで接続した新しいセッションを開きます（AsyncSession は別スレッドから使えないため）。
+    """
+    if isinstance(db, Session):
+        yield db
+        return
+    with _sync_sessionmaker(db)() as session:
+        yield session
+
+
+_STREAM_END = object()
+
+
+def stream_db(db: DbSession, gen_fn: Callable[..., Iterator[T]], *args: Any) -> Union[Iterator[T], AsyncIterator[T]]:
+    """gen_fn(session, *args) が返すジェネレーターを StreamingResponse に渡せる形で返します
+
+    同期モードではそのまま返し（Starlette がスレッドプールで読み進めます）、非同期モードでは
+    1 要素ずつ AsyncSession.run_sync の中で読み進める非同期イテレーターに変換します。
+    """
+    if isinstance(db, Session):
+        return gen_fn(db, *args)
+
+    async def iterate() -> AsyncIterator[T]:
+        it = await db.run_sync(gen_fn, *args)
+        while True:
+            item = await db.run_sync(lambda _session: next(it, _STREAM_END))
+            if item is _STREAM_END:
+                return
+            yield cast(T, item)
+
+    return iterate()
@@ -0,0 +1,338 @@
+"""CSVのストリーミングインポート
+
+アップロードされたファイルを少しずつ読み進め、IMPORT_CHUNK_ROWS 行ごとに 1 トランザクションで
+一括登録します。ピーク時のメモリ使用量はファイルサイズではなくチャンクサイズで決まります。
+
+CSV の解析とデータベースへの書き込みは import_pool のワーカースレッドで実行し、イベントループを
+ブロックしません。同時に実行できるインポートの数と待ち行列の長さには上限があり、
+それを超えた場合は ImportBusyError になります。
+"""
+import asyncio
+import contextvars
+import csv
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from . import crud, metrics, schemas
+from .database import DbSession, sync_session
+
+# 1 トランザクションで登録する行数
+IMPORT_CHUNK_ROWS = 1000
+# レスポンスに含めるエラーメッセージの最大件数
+MAX_REPORTED_ERRORS = 20
+# 同時に実行するインポートの数と、実行待ちにできるインポートの数
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "2"))
+IMPORT_QUEUE_SIZE = int(os.getenv("IMPORT_QUEUE_SIZE", "4"))
+
+
+class ImportMappingError(ValueError):
+    """インポート設定（列名マッピング）が不正な場合のエラー"""
+
+
+class ImportBusyError(RuntimeError):
+    """実行中・実行待ちのインポートが上限に達している場合のエラー"""
+
+
+class ImportPool:
+    """インポートを専用のスレッドプールで実行し、同時実行数と待ち行列の長さを制限します"""
+
+    def __init__(self, workers: int, queue_size: int) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="osaifill-import")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> "Future[Any]":
+        """fn(*args) をワーカースレッドで実行する Future を返します（空きがなければ待たずに ImportBusyError）"""
+        if not self._slots.acquire(blocking=False):
+            raise ImportBusyError("Too many imports in progress")
+        try:
+            return self._executor.submit(self._call, fn, args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def run(self, db: DbSession, fn: Callable[..., Any], *args: Any) -> Any:
+        """fn(session, *args) をワーカースレッドで実行し、完了を待って結果を返します"""
+        # クライアントが切断しても実行中の処理は止まらないため、枠の解放はワーカー側で行います
+        # （SQL の実行数をリクエストのメトリクスに含めるため、コンテキストを引き継ぎます）
+        context = contextvars.copy_context()
+        return await asyncio.wrap_future(self.submit(context.run, _with_session, db, fn, *args))
+
+    def _call(self, fn: Callable[..., Any], args: Any) -> Any:
+        try:
+            return fn(*args)
+        finally:
+            self._slots.release()
+
+
+def _with_session(db: DbSession, fn: Callable[..., Any], *args: Any) -> Any:
+    with sync_session(db) as session:
+        return fn(session, *args)
+
+
+import_pool = ImportPool(IMPORT_WORKERS, IMPORT_QUEUE_SIZE)
+
+
+@dataclass
+class ImportResult:
+    inserted: int = 0
+    skipped: int = 0
+    failed: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    def add_error(self, message: str) -> None:
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+    @property
+    def message(self) -> str:
+        return "Import completed with errors" if self.failed else "Import successful"
+
+
+@dataclass
+class PurchaseColumnMapping:
+    item_name: str
+    amount: str
+    member_name: Optional[str] = None
+    category: Optional[str] = None
+    priority: Optional[str] = None
+    note: Optional[str] = None
+    status: Optional[str] = None
+    budget_id: Optional[str] = None
+    asgn_amount: Optional[str] = None
+
+    @classmethod
+    def from_json(cls, mapping_json: str) -> "PurchaseColumnMapping":
+        mapping = json.loads(mapping_json)
+        if not mapping.get("item_name") or not mapping.get("amount"):
+            raise ImportMappingError("Item name and amount columns are required in mapping")
+        return cls(**{k: mapping.get(k) for k in cls.__dataclass_fields__})
+
+
+def normalize_category(val: str) -> str:
+    if not val: return "その他"
+    v = val.strip().lower()
+    if v in ["旅費", "travel", "travel cost", "travel_cost"]:
+        return "旅費"
+    if v in ["固定費", "fixed", "fixed cost", "fixed_cost"]:
+        return "固定費"
+    return "その他"
+
+
+def normalize_status(val: str) -> str:
+    if not val: return "書いただけ"
+    v = val.strip().lower()
+    # 内部値: 書いただけ, 見積済み, 買い物中, 購入済み, 購入しない
+    if v in ["書いただけ", "提案", "proposal", "written", "draft"]: return "書いただけ"
+    if v in ["見積済み", "estimated", "見積済", "estimate"]: return "見積済み"
+    if v in ["買い物中", "shopping", "in_progress", "買い物", "shop"]: return "買い物中"
+    if v in ["購入済み", "purchased", "done", "購入済", "complete"]: return "購入済み"
+    if v in ["購入しない", "not purchasing", "not_purchasing", "skip", "cancel"]: return "購入しない"
+    return "書いただけ"
+
+
+def normalize_priority(val: Any) -> int:
+    if val is None: return 3
+    v = str(val).strip().lower()
+    # 数値ならそのまま返す
+    if v.isdigit():
+        return int(v)
+    # 日本語・英語のマッピング
+    mapping = {
+        "最高": 5, "highest": 5, "最優先": 5,
+        "高": 4, "high": 4,
+        "中": 3, "medium": 3, "normal": 3,
+        "低": 2, "low": 2,
+        "最低": 1, "lowest": 1
+    }
+    return mapping.get(v, 3)
+
+
+def parse_purchase_row(row: Dict[str, Any], cols: PurchaseColumnMapping, dataset_id: str) -> Optional[schemas.PurchaseCreate]:
+    """CSVの 1 行を PurchaseCreate に変換します（アイテム名が空の行は None を返してスキップします）"""
+    item_name = row.get(cols.item_name)
+    if not item_name: return None
+
+    amount_val = 0.0
+    try:
+        raw_amount = str(row.get(cols.amount, "0")).replace(",", "")
+        amount_val = float(raw_amount)
+    except ValueError: pass
+
+    priority_val = 3
+    if cols.priority:
+        priority_val = normalize_priority(row.get(cols.priority))
+
+    category_val = "その他"
+    if cols.category:
+        category_val = normalize_category(str(row.get(cols.category, "")))
+
+    status_val = "書いただけ"
+    if cols.status:
+        status_val = normalize_status(str(row.get(cols.status, "")))
+
+    p_data = schemas.PurchaseCreate(
+        dataset_id=dataset_id,
+        member_name=str(row.get(cols.member_name)).strip() if cols.member_name and row.get(cols.member_name) else None,
+        category=category_val,
+        item_name=str(item_name).strip(),
+        amount=amount_val,
+        unit="JPY",
+        status=status_val,
+        priority=priority_val,
+        note=str(row.get(cols.note)).strip() if cols.note and row.get(cols.note) else None,
+        assignments=[]
+    )
+
+    b_id = row.get(cols.budget_id) if cols.budget_id else None
+    as_amount_raw = row.get(cols.asgn_amount) if cols.asgn_amount else None
+    if b_id and as_amount_raw:
+        try:
+            as_amount = float(str(as_amount_raw).replace(",", ""))
+        except ValueError:
+            return p_data
+        # 数値として読めても範囲外の金額は ValidationError として行ごとのエラーにします
+        p_data.assignments.append(schemas.BudgetAssignmentCreate(budget_id=str(b_id), amount=as_amount))
+    return p_data
+
+
+def iter_csv_records(binary_file: IO[bytes]) -> Iterator[Dict[str, Any]]:
+    """バイナリファイルを UTF-8 (BOM付き可) として 1 行ずつ辞書で返します"""
+    text = io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+    try:
+        # ヘッダーの前後空白やBOMを完全に除去
+        raw_reader = csv.reader(text)
+        headers = [h.strip().replace('\ufeff', '') for h in next(raw_reader, [])]
+        # DictReaderで正規化したヘッダーを使用し、データ行から開始します
+        yield from csv.DictReader(text, fieldnames=headers)
+    finally:
+        # アップロードファイル自体は呼び出し元が閉じるため切り離します
+        text.detach()
+
+
+def import_purchases_csv(
+    db: Session,
+    dataset_id: str,
+    binary_file: IO[bytes],
+    cols: PurchaseColumnMapping,
+    overwrite: bool = False,
+    chunk_size: Optional[int] = None,
+    on_chunk: Optional[Callable[[ImportResult, int, bool], None]] = None,
+) -> ImportResult:
+    """購入予定CSVをチャンク単位のトランザクションで登録し、登録・スキップ・失敗の件数を返します
+
+    データセットにない予算への割り当てを含む行は、チャンクに加えずにその行だけを失敗として数えます。
+    あるチャンクの登録に失敗した場合はそのチャンクだけをロールバックし、残りのチャンクの処理を続けます。
+    overwrite の既存データの削除は最初に登録できたチャンクと同じトランザクションで行うため、
+    ファイルを読めない（文字コードが不正など）場合や中断した場合に、登録前のデータが消えることはありません。
+    on_chunk を指定すると、続きの行があるチャンクを処理するたびに (途中経過, 読み込んだ行数, False) で、
+    すべての行を処理した後に (結果, 読み込んだ行数, True) で呼び出します
+    （False の呼び出しで例外を送出すると残りの行を読まずに中断します）。
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_ROWS
+    result = ImportResult()
+    started = time.perf_counter()
+
+    # 既存データの削除がまだの場合 True（最初に登録できたチャンクと一緒に削除します）
+    clear_pending = overwrite
+    chunk_failed = False
+    budget_ids = crud.get_budget_ids(db, dataset_id)
+    chunk: List[schemas.PurchaseCreate] = []
+    # 登録したチャンクの進捗の報告を、続きの行を読むまで遅らせる場合 True
+    report_pending = False
+    row_no = 0
+    for row_no, row in enumerate(iter_csv_records(binary_file), start=1):
+        if report_pending and on_chunk:
+            on_chunk(result, row_no - 1, False)
+        report_pending = False
+        try:
+            p_data = parse_purchase_row(row, cols, dataset_id)
+        except ValidationError as e:
+            result.failed += 1
+            result.add_error(f"Row {row_no}: {e.errors()[0]['msg']}")
+            continue
+        if p_data is None:
+            result.skipped += 1
+            continue
+        missing = [a.budget_id for a in p_data.assignments if a.budget_id not in budget_ids]
+        if missing:
+            # 外部キー違反でチャンク全体が失敗しないよう、登録前にこの行だけを除きます
+            result.failed += 1
+            result.add_error(f"Row {row_no}: budget '{missing[0]}' not found")
+            continue
+        chunk.append(p_data)
+        if len(chunk) >= chunk_size:
+            if _insert_chunk(db, dataset_id, chunk, result, row_no, clear_pending):
+                clear_pending = False
+            else:
+                chunk_failed = True
+            chunk = []
+            report_pending = True
+    if chunk:
+        if _insert_chunk(db, dataset_id, chunk, result, row_no, clear_pending):
+            clear_pending = False
+        else:
+            chunk_failed = True
+    if clear_pending and not chunk_failed:
+        # 登録する行のないファイルを最後まで読めた場合は、既存データの削除だけを行います
+        crud.clear_all_purchases(db, dataset_id)
+        db.commit()
+        db.expire_all()
+    if on_chunk:
+        on_chunk(result, row_no, True)
+    metrics.record_rows("import", "purchases", row_no, started)
+    return result
+
+
+def _insert_chunk(
+    db: Session, dataset_id: str, chunk: List[schemas.PurchaseCreate], result: ImportResult, last_row_no: int, clear: bool = False,
+) -> bool:
+    """チャンクを 1 トランザクションで登録し、成功したかを返します（clear=True の場合は既存の購入アイテムも削除します）"""
+    try:
+        if clear:
+            crud.clear_all_purchases(db, dataset_id)
+        crud.insert_purchases_bulk(db, dataset_id, chunk)
+        result.inserted += len(chunk)
+    except SQLAlchemyError as e:
+        db.rollback()
+        result.failed += len(chunk)
+        result.add_error(f"Chunk ending at row {last_row_no}: {getattr(e, 'orig', None) or e}")
+        return False
+    if clear:
+        # セッションに読み込み済みの購入アイテムは、データベースではすでに削除されています
+        db.expire_all()
+    return True
+
+
+def actual_expense_columns(mapping_json: str) -> Tuple[str, str]:
+    """実績CSVのマッピングからアイテム名と金額の列名を返します"""
+    mapping = json.loads(mapping_json)
+    name_col, amount_col = mapping.get("item_name"), mapping.get("amount")
+    if not name_col or not amount_col:
+        raise ImportMappingError("Invalid mapping")
+    return name_col, amount_col
+
+
+def import_actual_expenses_csv(db: Session, budget_id: str, binary_file: IO[bytes], mapping_json: str, overwrite: bool = False) -> int:
+    """実績CSVを読み込んで予算に登録し、登録した件数を返します"""
+    name_col, amount_col = actual_expense_columns(mapping_json)
+    started = time.perf_counter()
+
+    expenses = []
+    for row in iter_csv_records(binary_file):
+        item_name, amount_str = row.get(name_col), row.get(amount_col)
+        if item_name and amount_str:
+            expenses.append(schemas.ActualExpenseCreate(budget_id=budget_id, item_name=str(item_name), amount=float(str(amount_str).replace(",", "")), unit="JPY"))
+
+    crud.create_actual_expenses(db, budget_id, expenses, overwrite=overwrite)
+    metrics.record_rows("import", "actual_expenses", len(expenses), started)
+    return len(expenses)
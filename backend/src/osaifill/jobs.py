@@ -0,0 +1,242 @@
+"""CSV インポートのバックグラウンドジョブ
+
+アップロードされたファイルを IMPORT_SPOOL_DIR に保存して import_jobs に登録し、すぐにジョブ ID を返します。
+実際の取り込みは importers.import_pool のワーカースレッドが行い、チャンクごとに進捗（読み込んだ行数・
+登録・スキップ・失敗の件数とエラー）を import_jobs に書き込みます。ジョブの状態はデータベースだけで
+管理するため、外部のキューやブローカーは必要ありません。
+
+キャンセルは次のチャンクの区切りで反映されます。それまでに登録したチャンクはそのまま残ります。
+ジョブには受け付けたプロセス（WORKER_ID）を記録します。サーバーの再起動で中断されたジョブは、
+同じホストで次に起動したプロセスが失敗として記録します（実行中の別のワーカーのジョブには触れません）。
+"""
+import os
+import shutil
+import socket
+import tempfile
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import IO, Any, Dict, List, Optional, cast
+
+from sqlalchemy import ColumnElement
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from . import importers, models, schemas
+from .database import DbSession, background_sessionmaker, run_db
+
+# アップロードされたファイルをジョブの完了まで置いておくディレクトリ
+IMPORT_SPOOL_DIR = os.getenv("IMPORT_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "osaifill-imports")
+# 一覧で返すジョブの最大件数
+MAX_LISTED_JOBS = 50
+
+ACTIVE_STATUSES = ("queued", "running")
+# このプロセスを表す import_jobs.worker の値
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_futures: Dict[str, "Future[Any]"] = {}
+_futures_lock = threading.Lock()
+
+
+class ImportCancelled(Exception):
+    """ジョブのキャンセルが要求されたため取り込みを中断します"""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def spool_upload(upload: IO[bytes]) -> str:
+    """アップロードされたファイルをスプールディレクトリにコピーし、そのパスを返します"""
+    os.makedirs(IMPORT_SPOOL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=IMPORT_SPOOL_DIR, suffix=".csv")
+    with os.fdopen(fd, "wb") as out:
+        shutil.copyfileobj(upload, out)
+    return path
+
+
+def _remove_spool_file(path: Optional[str]) -> None:
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+# --- ジョブの登録・参照（リクエストのセッションで実行） ---
+
+def create_import_job(
+    db: Session, kind: str, dataset_id: str, budget_id: Optional[str], mapping_json: str, overwrite: bool, file_path: str
+) -> models.ImportJob:
+    job = models.ImportJob(
+        kind=kind, dataset_id=dataset_id, budget_id=budget_id,
+        mapping_json=mapping_json, overwrite=overwrite, file_path=file_path, worker=WORKER_ID,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def delete_import_job(db: Session, job_id: str) -> None:
+    job = db.get(models.ImportJob, job_id)
+    if job:
+        _remove_spool_file(cast(Optional[str], job.file_path))
+        db.delete(job)
+        db.commit()
+
+
+def get_import_job(db: Session, job_id: str) -> Optional[models.ImportJob]:
+    return db.get(models.ImportJob, job_id)
+
+
+def get_import_jobs(db: Session, dataset_id: str) -> List[models.ImportJob]:
+    return (
+        db.query(models.ImportJob)
+        .filter(models.ImportJob.dataset_id == dataset_id)
+        .order_by(models.ImportJob.created_at.desc(), models.ImportJob.id.desc())
+        .limit(MAX_LISTED_JOBS)
+        .all()
+    )
+
+
+def cancel_import_job(db: Session, job_id: str) -> Optional[models.ImportJob]:
+    """キャンセルを要求します（実行待ちのジョブはその場でキャンセル済みになります）"""
+    status: ColumnElement[str] = models.ImportJob.status
+    jobs = db.query(models.ImportJob).filter(models.ImportJob.id == job_id)
+    jobs.filter(status.in_(ACTIVE_STATUSES)).update({"cancel_requested": True}, synchronize_session=False)
+    jobs.filter(models.ImportJob.status == "queued").update(
+        {"status": "cancelled", "finished_at": _now(), "message": "Cancelled before start"}, synchronize_session=False
+    )
+    db.commit()
+    return db.get(models.ImportJob, job_id, populate_existing=True)
+
+
+def _worker_stopped(worker: Optional[str]) -> bool:
+    """ジョブを受け付けたプロセスが終了しているかを返します（別のホストのプロセスは確認できないため False）"""
+    if worker is None:
+        # worker を記録する前のバージョンで登録されたジョブ
+        return True
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname():
+        return False
+    if worker == WORKER_ID:
+        # 起動したばかりのこのプロセスにジョブはないため、同じプロセスIDの以前のプロセスのものです
+        return True
+    if os.name == "nt":
+        # Windows の os.kill はプロセスを終了させてしまうため、確認しません
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, ValueError):
+        return False
+    return False
+
+
+def fail_interrupted_jobs(db: Session) -> int:
+    """終了したプロセスの実行待ち・実行中のまま残ったジョブを失敗として記録します
+
+    同じデータベースを使う他のワーカープロセスが実行中のジョブ（とそのアップロードファイル）はそのまま残します。
+    """
+    status: ColumnElement[str] = models.ImportJob.status
+    jobs = [
+        job for job in db.query(models.ImportJob).filter(status.in_(ACTIVE_STATUSES)).all()
+        if _worker_stopped(cast(Optional[str], job.worker))
+    ]
+    for job in jobs:
+        _remove_spool_file(cast(Optional[str], job.file_path))
+        _update_job(db, cast(str, job.id), status="failed", message="Interrupted by a server restart", finished_at=_now())
+    return len(jobs)
+
+
+async def submit(
+    db: DbSession, kind: str, dataset_id: str, budget_id: Optional[str], mapping_json: str, overwrite: bool, upload: IO[bytes]
+) -> schemas.ImportJob:
+    """ファイルを保存してジョブを登録し、ワーカーに渡します（空きがなければ ImportBusyError）"""
+    file_path = await run_in_threadpool(spool_upload, upload)
+    job = cast(schemas.ImportJob, await run_db(
+        db, create_import_job, kind, dataset_id, budget_id, mapping_json, overwrite, file_path, as_model=schemas.ImportJob
+    ))
+    try:
+        future = importers.import_pool.submit(run_import_job, background_sessionmaker(db), job.id)
+    except importers.ImportBusyError:
+        await run_db(db, delete_import_job, job.id)
+        raise
+    with _futures_lock:
+        _futures[job.id] = future
+    future.add_done_callback(lambda _: _forget(job.id))
+    return job
+
+
+def _forget(job_id: str) -> None:
+    with _futures_lock:
+        _futures.pop(job_id, None)
+
+
+def wait(job_id: str, timeout: Optional[float] = None) -> None:
+    """このプロセスで実行中のジョブの完了を待ちます（テストや CLI 向け）"""
+    with _futures_lock:
+        future = _futures.get(job_id)
+    if future is not None:
+        future.result(timeout)
+
+
+# --- ジョブの実行（ワーカースレッドで実行） ---
+
+def _update_job(db: Session, job_id: str, **values: Any) -> int:
+    changes: Dict[Any, Any] = values
+    count = db.query(models.ImportJob).filter(models.ImportJob.id == job_id).update(changes, synchronize_session=False)
+    db.commit()
+    return count
+
+
+def _report_progress(db: Session, job_id: str, result: importers.ImportResult, rows_processed: int, final: bool) -> None:
+    _update_job(
+        db, job_id, rows_processed=rows_processed, inserted=result.inserted,
+        skipped=result.skipped, failed=result.failed, errors=list(result.errors),
+    )
+    # すべての行を登録し終えた後のキャンセル要求は間に合わなかったものとして、ジョブを完了させます
+    if final:
+        return
+    if db.query(models.ImportJob.cancel_requested).filter(models.ImportJob.id == job_id).scalar():
+        raise ImportCancelled()
+
+
+def run_import_job(session_factory: "sessionmaker[Session]", job_id: str) -> None:
+    with session_factory() as db:
+        job = db.get(models.ImportJob, job_id)
+        if job is None:
+            return
+        file_path = cast(str, job.file_path)
+        try:
+            # キャンセル済みのジョブは実行しません
+            started = db.query(models.ImportJob).filter(
+                models.ImportJob.id == job_id, models.ImportJob.status == "queued"
+            ).update({"status": "running", "started_at": _now()}, synchronize_session=False)
+            db.commit()
+            if not started:
+                return
+            kind, dataset_id, budget_id = job.kind, job.dataset_id, job.budget_id
+            mapping_json, overwrite = cast(str, job.mapping_json), bool(job.overwrite)
+
+            message = "Import successful"
+            with open(file_path, "rb") as f:
+                if kind == "purchases":
+                    cols = importers.PurchaseColumnMapping.from_json(mapping_json)
+                    message = importers.import_purchases_csv(
+                        db, cast(str, dataset_id), f, cols, overwrite,
+                        on_chunk=lambda result, rows, final: _report_progress(db, job_id, result, rows, final),
+                    ).message
+                else:
+                    # 実績は 1 トランザクションで登録するため、途中経過やキャンセルはありません
+                    count = importers.import_actual_expenses_csv(db, cast(str, budget_id), f, mapping_json, overwrite)
+                    _update_job(db, job_id, rows_processed=count, inserted=count)
+        except ImportCancelled:
+            _update_job(db, job_id, status="cancelled", finished_at=_now(), message="Cancelled")
+        except Exception as e:
+            db.rollback()
+            _update_job(db, job_id, status="failed", finished_at=_now(), message=f"Import failed: {e}")
+        else:
+            _update_job(db, job_id, status="succeeded", finished_at=_now(), message=message)
+        finally:
+            _remove_spool_file(file_path)
+            _update_job(db, job_id, file_path=None)
@@ -1,24 +1,33 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status, UploadFile, File, Form
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List, Optional, Any, Dict, cast
+from typing import Annotated, Awaitable, Callable, Hashable, Iterator, List, Optional, Any, Dict, Tuple, cast
 import csv
 import io
-import json
 import os
+import time
+from dataclasses import asdict
 from dotenv import load_dotenv
+from pydantic import TypeAdapter
 
-from . import models, schemas, database, crud
+from . import models, schemas, database, crud, importers, jobs, metrics, migrations, querylog, search, versions
+from .cache import CachedResponse, response_cache
 
 # .envファイルを親ディレクトリまで遡って検索
 from dotenv import load_dotenv, find_dotenv
 load_dotenv(find_dotenv())
 
-from .database import engine, get_db
+from .database import DbSession, engine, get_db, run_db, stream_db
+from .pagination import InvalidCursorError, Page
+from .writer import run_write
 from fastapi.middleware.cors import CORSMiddleware
 
-# テーブルの作成
-models.Base.metadata.create_all(bind=engine)
+# スキーマの作成・アップグレード
+migrations.upgrade(engine)
+# 前回のプロセスで中断されたインポートジョブを失敗として記録
+with database.SessionLocal() as _session:
+    jobs.fail_interrupted_jobs(_session)
 
 app = FastAPI(
     title="Osaifill API",
@@ -26,6 +35,9 @@ app = FastAPI(
     version="0.2.0",
 )
 
+# 一覧 API の次ページのカーソルを返すレスポンスヘッダー
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
 # CORSの設定
 allow_origins = os.getenv("CORS_ALLOW_ORIGINS", "http://localhost:5173").split(",")
 app.add_middleware(
@@ -34,7 +46,105 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "X-Query-Count"],
 )
+if metrics.METRICS_ENABLED:
+    metrics.install_sql_events()
+    app.add_middleware(metrics.MetricsMiddleware)
+if querylog.QUERY_LOG:
+    # 開発用: リクエストごとの SQL を記録し、N+1 の疑いを警告します
+    querylog.install()
+    app.add_middleware(querylog.QueryLogMiddleware)
+
+
+@app.exception_handler(InvalidCursorError)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursorError) -> JSONResponse:
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+@app.exception_handler(IntegrityError)
+async def integrity_error_handler(request: Request, exc: IntegrityError) -> JSONResponse:
+    # 外部キー制約（存在しないデータセット・予算への参照）や主キーの重複
+    return JSONResponse(status_code=409, content={"detail": "The request references a missing record or conflicts with existing data"})
+
+
+class NotModified(Exception):
+    def __init__(self, etag: str) -> None:
+        self.etag = etag
+
+
+@app.exception_handler(NotModified)
+async def not_modified_handler(request: Request, exc: NotModified) -> Response:
+    return Response(status_code=304, headers={"ETag": exc.etag, "Cache-Control": "no-cache"})
+
+
+def check_etag(request: Request, response: Response, dataset_id: Optional[str], version: Optional[int]) -> None:
+    """データセットのバージョンから ETag を作り、If-None-Match と一致すれば 304 を返します"""
+    if dataset_id is None or version is None:
+        # 存在しないデータセット・予算はルート側で通常どおり処理します
+        return
+    etag = f'W/"{dataset_id}-{version}"'
+    if_none_match = request.headers.get("if-none-match", "")
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if "*" in candidates or etag.removeprefix("W/") in candidates:
+        raise NotModified(etag)
+    response.headers["ETag"] = etag
+    # ブラウザーに毎回 If-None-Match で再検証させます
+    response.headers["Cache-Control"] = "no-cache"
+
+
+async def dataset_etag(dataset_id: str, request: Request, response: Response, db: DbSession = Depends(get_db)) -> Optional[int]:
+    version = await run_db(db, versions.get_version, dataset_id)
+    check_etag(request, response, dataset_id, version)
+    return cast(Optional[int], version)
+
+
+async def budget_etag(budget_id: str, request: Request, response: Response, db: DbSession = Depends(get_db)) -> None:
+    found = await run_db(db, versions.get_budget_version, budget_id)
+    check_etag(request, response, *(found or (None, None)))
+
+
+def page_items(page: Page[Any], response: Response) -> List[Any]:
+    # 一覧の続きがある場合は、次のページのカーソルをヘッダーで返します（本文は従来どおり配列です）
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    return page.items
+
+
+async def cached_json(
+    response: Response,
+    dataset_id: str,
+    version: Optional[int],
+    key: Hashable,
+    adapter: TypeAdapter[Any],
+    compute: Callable[[], Awaitable[Tuple[Any, Dict[str, str]]]],
+    exclude_unset: bool = False,
+) -> Response:
+    """シリアライズ済みのレスポンスをキャッシュから返し、なければ compute() で作って保持します
+
+    キーにはデータセットのバージョンを含めるため、書き込み後のリクエストは必ず新しい内容を読みます。
+    compute() は (レスポンスの値, 追加のヘッダー) を返します。
+    """
+    use_cache = version is not None and response_cache.enabled
+    cache_key = (key, version)
+    entry = response_cache.get(dataset_id, cache_key) if use_cache else None
+    if entry is None:
+        value, headers = await compute()
+        entry = CachedResponse(adapter.dump_json(value, exclude_unset=exclude_unset), headers)
+        if use_cache:
+            response_cache.put(dataset_id, cache_key, entry)
+    # Response を直接返す場合は、依存関係で設定した ETag を引き継ぎます
+    return Response(entry.body, media_type="application/json", headers={**response.headers, **entry.headers})
+
+
+def page_result(page: Page[Any]) -> Tuple[List[Any], Dict[str, str]]:
+    return page.items, ({NEXT_CURSOR_HEADER: page.next_cursor} if page.next_cursor else {})
+
+
+DASHBOARD_ADAPTER: TypeAdapter[schemas.DashboardSummary] = TypeAdapter(schemas.DashboardSummary)
+BUDGET_LIST_ADAPTER: TypeAdapter[List[schemas.Budget]] = TypeAdapter(List[schemas.Budget])
+PURCHASE_LIST_ADAPTER: TypeAdapter[List[schemas.Purchase]] = TypeAdapter(List[schemas.Purchase])
+ACTUAL_EXPENSE_LIST_ADAPTER: TypeAdapter[List[schemas.ActualExpense]] = TypeAdapter(List[schemas.ActualExpense])
 
 
 @app.get("/")
@@ -47,62 +157,74 @@ def health_check() -> Dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/api/cache/stats")
+def cache_stats() -> Dict[str, int]:
+    # キャッシュの大きさを調整するためのヒット・ミス・追い出しの件数
+    return asdict(response_cache.stats())
+
+
+@app.get("/api/metrics")
+def read_metrics() -> Response:
+    # Prometheus のテキスト形式（ルートごとのレイテンシ、SQL の実行数、接続の待ち時間、CSV の行数）
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 # --- Datasets ---
 
 @app.get("/api/datasets", response_model=List[schemas.Dataset])
-def read_datasets(db: Session = Depends(get_db)):
-    return crud.get_datasets(db)
+async def read_datasets(db: DbSession = Depends(get_db)):
+    return await run_db(db, crud.get_datasets, as_model=schemas.Dataset)
 
 
 @app.post("/api/datasets", response_model=schemas.Dataset)
-def create_dataset(dataset: schemas.DatasetCreate, db: Session = Depends(get_db)):
-    return crud.create_dataset(db, dataset)
+async def create_dataset(dataset: schemas.DatasetCreate, db: DbSession = Depends(get_db)):
+    return await run_write(db, crud.create_dataset, dataset, as_model=schemas.Dataset)
 
 
 @app.put("/api/datasets/{dataset_id}", response_model=schemas.Dataset)
-def update_dataset(dataset_id: str, dataset: schemas.DatasetUpdate, db: Session = Depends(get_db)):
-    db_ds = crud.update_dataset(db, dataset_id, dataset)
+async def update_dataset(dataset_id: str, dataset: schemas.DatasetUpdate, db: DbSession = Depends(get_db)):
+    db_ds = await run_write(db, crud.update_dataset, dataset_id, dataset, as_model=schemas.Dataset)
     if not db_ds:
         raise HTTPException(status_code=404, detail="Dataset not found")
     return db_ds
 
 
 @app.delete("/api/datasets/{dataset_id}")
-def delete_dataset(dataset_id: str, db: Session = Depends(get_db)):
-    success = crud.delete_dataset(db, dataset_id)
+async def delete_dataset(dataset_id: str, db: DbSession = Depends(get_db)):
+    success = await run_write(db, crud.delete_dataset, dataset_id)
     if not success:
         raise HTTPException(status_code=404, detail="Dataset not found")
     return {"message": "Dataset deleted"}
 
 
 @app.post("/api/datasets/rollover", response_model=schemas.Dataset)
-def rollover_dataset(rollover: schemas.DatasetRollover, db: Session = Depends(get_db)):
-    return crud.rollover_dataset(db, rollover)
+async def rollover_dataset(rollover: schemas.DatasetRollover, db: DbSession = Depends(get_db)):
+    return await run_write(db, crud.rollover_dataset, rollover, as_model=schemas.Dataset)
 
 
 # --- Members ---
 
-@app.get("/api/members", response_model=List[schemas.Member])
-def read_members(dataset_id: str, db: Session = Depends(get_db)):
-    return crud.get_members(db, dataset_id)
+@app.get("/api/members", response_model=List[schemas.Member], dependencies=[Depends(dataset_etag)])
+async def read_members(dataset_id: str, db: DbSession = Depends(get_db)):
+    return await run_db(db, crud.get_members, dataset_id, as_model=schemas.Member)
 
 
 @app.post("/api/members", response_model=schemas.Member)
-def create_member(member: schemas.MemberCreate, db: Session = Depends(get_db)):
-    return crud.create_member(db=db, member=member)
+async def create_member(member: schemas.MemberCreate, db: DbSession = Depends(get_db)):
+    return await run_write(db, crud.create_member, member, as_model=schemas.Member)
 
 
 @app.put("/api/members/{member_id}", response_model=schemas.Member)
-def update_member(member_id: int, member: schemas.MemberUpdate, db: Session = Depends(get_db)):
-    db_member = crud.update_member(db, member_id, member)
+async def update_member(member_id: int, member: schemas.MemberUpdate, db: DbSession = Depends(get_db)):
+    db_member = await run_write(db, crud.update_member, member_id, member, as_model=schemas.Member)
     if not db_member:
         raise HTTPException(status_code=404, detail="Member not found")
     return db_member
 
 
 @app.delete("/api/members/{member_id}")
-def delete_member(member_id: int, db: Session = Depends(get_db)):
-    success = crud.delete_member(db, member_id)
+async def delete_member(member_id: int, db: DbSession = Depends(get_db)):
+    success = await run_write(db, crud.delete_member, member_id)
     if not success:
         raise HTTPException(status_code=404, detail="Member not found")
     return {"message": "Member deleted"}
@@ -110,82 +232,119 @@ def delete_member(member_id: int, db: Session = Depends(get_db)):
 
 # --- Dashboard ---
 @app.get("/api/dashboard", response_model=schemas.DashboardSummary)
-def get_dashboard(dataset_id: str, db: Session = Depends(get_db)):
-    return crud.get_dashboard_summary(db, dataset_id)
+async def get_dashboard(dataset_id: str, response: Response, version: Optional[int] = Depends(dataset_etag), db: DbSession = Depends(get_db)):
+    async def compute() -> Tuple[Any, Dict[str, str]]:
+        return await run_db(db, crud.get_dashboard_summary, dataset_id), {}
+    return await cached_json(response, dataset_id, version, "dashboard", DASHBOARD_ADAPTER, compute)
 
 
 # --- Budgets ---
 
-@app.get("/api/budgets", response_model=List[schemas.Budget])
-def read_budgets(dataset_id: str, db: Session = Depends(get_db)):
-    return crud.get_budgets(db, dataset_id)
+@app.get("/api/budgets", response_model=List[schemas.Budget], response_model_exclude_unset=True)
+async def read_budgets(params: Annotated[schemas.BudgetListQuery, Query()], response: Response, version: Optional[int] = Depends(dataset_etag), db: DbSession = Depends(get_db)):
+    async def compute() -> Tuple[Any, Dict[str, str]]:
+        return page_result(await run_db(db, crud.get_budgets, params.dataset_id, params))
+    # 含めなかった子要素は未設定のフィールドとしてレスポンスから省略されます
+    key = ("budgets", params.model_dump_json())
+    return await cached_json(response, params.dataset_id, version, key, BUDGET_LIST_ADAPTER, compute, exclude_unset=True)
 
 
 @app.post("/api/budgets", response_model=schemas.Budget)
-def create_budget(budget: schemas.BudgetCreate, db: Session = Depends(get_db)):
-    return crud.create_budget(db=db, budget=budget)
+async def create_budget(budget: schemas.BudgetCreate, db: DbSession = Depends(get_db)):
+    return await run_write(db, crud.create_budget, budget, as_model=schemas.Budget)
 
 
 @app.put("/api/budgets/{budget_id}", response_model=schemas.Budget)
-def update_budget(budget_id: str, budget: schemas.BudgetUpdate, db: Session = Depends(get_db)):
-    db_budget = crud.update_budget(db, budget_id, budget)
+async def update_budget(budget_id: str, budget: schemas.BudgetUpdate, db: DbSession = Depends(get_db)):
+    db_budget = await run_write(db, crud.update_budget, budget_id, budget, as_model=schemas.Budget)
     if not db_budget:
         raise HTTPException(status_code=404, detail="Budget not found")
     return db_budget
 
 
 @app.delete("/api/budgets/{budget_id}")
-def delete_budget(budget_id: str, db: Session = Depends(get_db)):
-    success = crud.delete_budget(db, budget_id)
+async def delete_budget(budget_id: str, db: DbSession = Depends(get_db)):
+    success = await run_write(db, crud.delete_budget, budget_id)
     if not success:
         raise HTTPException(status_code=404, detail="Budget not found")
     return {"message": "Budget deleted"}
 
 
 @app.post("/api/budgets/merge", response_model=schemas.Budget)
-def merge_budgets(merge_data: schemas.BudgetMerge, db: Session = Depends(get_db)):
-    db_budget = crud.merge_budgets(db, merge_data)
+async def merge_budgets(merge_data: schemas.BudgetMerge, db: DbSession = Depends(get_db)):
+    db_budget = await run_write(db, crud.merge_budgets, merge_data, as_model=schemas.Budget)
     if not db_budget:
         raise HTTPException(status_code=404, detail="One or both budgets not found, or they belong to different datasets")
     return db_budget
 
 
+@app.post("/api/budgets/merge-many", response_model=schemas.Budget)
+async def merge_many_budgets(merge_data: schemas.BudgetMergeMany, db: DbSession = Depends(get_db)):
+    # 複数の予算を 1 つのトランザクションでまとめて統合します
+    if merge_data.target_budget_id in merge_data.source_budget_ids:
+        raise HTTPException(status_code=400, detail="The target budget cannot also be a source")
+    db_budget = await run_write(db, crud.merge_budgets_into, merge_data.target_budget_id, merge_data.source_budget_ids, as_model=schemas.Budget)
+    if not db_budget:
+        raise HTTPException(status_code=404, detail="One or more budgets not found, or they belong to different datasets")
+    return db_budget
+
+
 # --- Purchases ---
 
 @app.get("/api/purchases", response_model=List[schemas.Purchase])
-def read_purchases(dataset_id: str, db: Session = Depends(get_db)):
-    return crud.get_purchases(db, dataset_id)
+async def read_purchases(params: Annotated[schemas.PurchaseListQuery, Query()], response: Response, version: Optional[int] = Depends(dataset_etag), db: DbSession = Depends(get_db)):
+    async def compute() -> Tuple[Any, Dict[str, str]]:
+        return page_result(await run_db(db, crud.get_purchases, params.dataset_id, params, as_model=schemas.Purchase))
+    key = ("purchases", params.model_dump_json())
+    return await cached_json(response, params.dataset_id, version, key, PURCHASE_LIST_ADAPTER, compute)
+
+
+@app.get("/api/purchases/search", response_model=List[schemas.Purchase])
+async def search_purchases(params: Annotated[schemas.SearchQuery, Query()], response: Response, version: Optional[int] = Depends(dataset_etag), db: DbSession = Depends(get_db)):
+    async def compute() -> Tuple[Any, Dict[str, str]]:
+        return page_result(await run_db(db, search.search_purchases, params, as_model=schemas.Purchase))
+    key = ("purchase-search", params.model_dump_json())
+    return await cached_json(response, params.dataset_id, version, key, PURCHASE_LIST_ADAPTER, compute)
 
 
 @app.post("/api/purchases", response_model=schemas.Purchase)
-def create_purchase(purchase: schemas.PurchaseCreate, db: Session = Depends(get_db)):
-    return crud.create_purchase(db=db, purchase=purchase)
+async def create_purchase(purchase: schemas.PurchaseCreate, db: DbSession = Depends(get_db)):
+    return await run_write(db, crud.create_purchase, purchase, as_model=schemas.Purchase)
 
 
 @app.post("/api/purchases/import", response_model=List[schemas.Purchase])
-def import_purchases(dataset_id: str, purchases: List[schemas.PurchaseCreate], db: Session = Depends(get_db)):
-    return crud.create_purchases_bulk(db, dataset_id, purchases)
+async def import_purchases(dataset_id: str, purchases: List[schemas.PurchaseCreate], db: DbSession = Depends(get_db)):
+    return await run_write(db, crud.create_purchases_bulk, dataset_id, purchases, as_model=schemas.Purchase)
 
 
 @app.put("/api/purchases/{purchase_id}", response_model=schemas.Purchase)
-def update_purchase(purchase_id: int, purchase: schemas.PurchaseUpdate, db: Session = Depends(get_db)):
-    db_purchase = crud.update_purchase(db, purchase_id, purchase)
+async def update_purchase(purchase_id: int, purchase: schemas.PurchaseUpdate, db: DbSession = Depends(get_db)):
+    db_purchase = await run_write(db, crud.update_purchase, purchase_id, purchase, as_model=schemas.Purchase)
     if not db_purchase:
         raise HTTPException(status_code=404, detail="Purchase not found")
     return db_purchase
 
 
 @app.patch("/api/purchases/{purchase_id}/status", response_model=schemas.Purchase)
-def update_purchase_status(purchase_id: int, status: str, db: Session = Depends(get_db)):
-    db_purchase = crud.update_purchase_status(db, purchase_id, status)
+async def update_purchase_status(purchase_id: int, status: str, db: DbSession = Depends(get_db)):
+    db_purchase = await run_write(db, crud.update_purchase_status, purchase_id, status, as_model=schemas.Purchase)
     if not db_purchase:
         raise HTTPException(status_code=404, detail="Purchase not found")
     return db_purchase
 
 
+@app.patch("/api/purchases/batch", response_model=schemas.PurchaseBatchResult)
+async def update_purchases_batch(batch: schemas.PurchaseBatchUpdate, db: DbSession = Depends(get_db)):
+    if (batch.ids is None) == (batch.filter is None):
+        raise HTTPException(status_code=400, detail="Specify exactly one of ids or filter")
+    if not batch.patch.model_fields_set:
+        raise HTTPException(status_code=400, detail="The patch has no fields to update")
+    return await run_write(db, crud.update_purchases_batch, batch)
+
+
 @app.delete("/api/purchases/{purchase_id}")
-def delete_purchase(purchase_id: int, db: Session = Depends(get_db)):
-    success = crud.delete_purchase(db, purchase_id)
+async def delete_purchase(purchase_id: int, db: DbSession = Depends(get_db)):
+    success = await run_write(db, crud.delete_purchase, purchase_id)
     if not success:
         raise HTTPException(status_code=404, detail="Purchase not found")
     return {"message": "Purchase deleted"}
@@ -193,226 +352,188 @@ def delete_purchase(purchase_id: int, db: Session = Depends(get_db)):
 
 # --- Purchase CSV Export/Import & Settings ---
 
-@app.get("/api/datasets/{dataset_id}/purchase-import-setting", response_model=Optional[schemas.PurchaseImportSetting])
-def get_purchase_import_setting(dataset_id: str, db: Session = Depends(get_db)):
-    return crud.get_purchase_import_setting(db, dataset_id)
+@app.get("/api/datasets/{dataset_id}/purchase-import-setting", response_model=Optional[schemas.PurchaseImportSetting], dependencies=[Depends(dataset_etag)])
+async def get_purchase_import_setting(dataset_id: str, db: DbSession = Depends(get_db)):
+    return await run_db(db, crud.get_purchase_import_setting, dataset_id, as_model=schemas.PurchaseImportSetting)
 
 
 @app.post("/api/datasets/{dataset_id}/purchase-import-setting")
-def save_purchase_import_setting(dataset_id: str, setting: schemas.PurchaseImportSettingBase, db: Session = Depends(get_db)):
-    return crud.save_purchase_import_setting(db, dataset_id, setting.mapping_json)
+async def save_purchase_import_setting(dataset_id: str, setting: schemas.PurchaseImportSettingBase, db: DbSession = Depends(get_db)):
+    return await run_write(db, crud.save_purchase_import_setting, dataset_id, setting.mapping_json, as_model=schemas.PurchaseImportSetting)
+
+
+# エクスポートはこの行数ごとにエンコードして送信します（メモリ使用量は行数に依存しません）
+EXPORT_CHUNK_ROWS = 1000
+PURCHASE_CSV_HEADER = ["担当者", "区分", "アイテム名", "金額", "単位", "ステータス", "優先度", "備考", "対応お財布ID", "割当金額"]
+
 
+def stream_purchases_csv(db: Session, dataset_id: str) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow(PURCHASE_CSV_HEADER)
 
-@app.get("/api/purchases/export-csv")
-def export_purchases_csv(dataset_id: str, db: Session = Depends(get_db)):
-    purchases = crud.get_purchases(db, dataset_id)
-    output = io.StringIO()
-    output.write("\ufeff")
-    writer = csv.writer(output)
-    writer.writerow(["担当者", "区分", "アイテム名", "金額", "単位", "ステータス", "優先度", "備考", "対応お財布ID", "割当金額"])
+    started, i = time.perf_counter(), 0
+    for i, row in enumerate(crud.iter_purchase_export_rows(db, dataset_id, EXPORT_CHUNK_ROWS), start=1):
+        writer.writerow(row)
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+    metrics.record_rows("export", "purchases", i, started)
 
-    for p in purchases:
-        if not p.assignments:
-            writer.writerow([p.member_name, p.category, p.item_name, p.amount, p.unit, p.status, p.priority, p.note, "", ""])
-        else:
-            for asgn in p.assignments:
-                writer.writerow([p.member_name, p.category, p.item_name, p.amount, p.unit, p.status, p.priority, p.note, asgn.budget_id, asgn.amount])
 
-    output.seek(0)
-    return StreamingResponse(iter([output.getvalue()]), media_type="text/csv", headers={"Content-Disposition": f"attachment; filename=purchases_{dataset_id}.csv"})
+@app.get("/api/purchases/export-csv", dependencies=[Depends(dataset_etag)])
+async def export_purchases_csv(dataset_id: str, response: Response, db: DbSession = Depends(get_db)):
+    return StreamingResponse(
+        stream_db(db, stream_purchases_csv, dataset_id),
+        media_type="text/csv",
+        # Response を直接返す場合は、依存関係で設定した ETag を引き継ぎます
+        headers={**response.headers, "Content-Disposition": f"attachment; filename=purchases_{dataset_id}.csv"},
+    )
 
 
 @app.post("/api/purchases/import-csv")
-async def import_purchases_csv(dataset_id: str, file: UploadFile = File(...), overwrite: bool = Form(False), db: Session = Depends(get_db)):
-    setting = crud.get_purchase_import_setting(db, dataset_id)
+async def import_purchases_csv(dataset_id: str, file: UploadFile = File(...), overwrite: bool = Form(False), db: DbSession = Depends(get_db)):
+    setting = await run_db(db, crud.get_purchase_import_setting, dataset_id, as_model=schemas.PurchaseImportSetting)
     if not setting:
         raise HTTPException(status_code=400, detail="Import setting not found for this dataset")
 
     try:
-        mapping = json.loads(str(setting.mapping_json))
         # マッピング情報を事前にすべて取得します
-        col_item_name = mapping.get("item_name")
-        col_amount = mapping.get("amount")
-        col_member = mapping.get("member_name")
-        col_category = mapping.get("category")
-        col_priority = mapping.get("priority")
-        col_note = mapping.get("note")
-        col_status = mapping.get("status")
-        col_budget_id = mapping.get("budget_id")
-        col_asgn_amount = mapping.get("asgn_amount")
-
-        if not col_item_name or not col_amount:
-            raise HTTPException(status_code=400, detail="Item name and amount columns are required in mapping")
-
-        contents = await file.read()
-        decoded_contents = contents.decode("utf-8-sig")
-        df = io.StringIO(decoded_contents)
-        
-        # ヘッダーの前後空白やBOMを完全に除去
-        raw_reader = csv.reader(df)
-        headers = [h.strip().replace('\ufeff', '') for h in next(raw_reader)]
-        # DictReaderで正規化したヘッダーを使用し、データ行から開始します
-        reader = csv.DictReader(df, fieldnames=headers)
-
-        if overwrite:
-            crud.clear_all_purchases(db, dataset_id)
-            # 既存データの削除を確定させ、セッションをクリーンにします
-            db.commit()
-            db.expire_all()
-
-        def normalize_category(val: str) -> str:
-            if not val: return "その他"
-            v = val.strip().lower()
-            if v in ["旅費", "travel", "travel cost", "travel_cost"]:
-                return "旅費"
-            if v in ["固定費", "fixed", "fixed cost", "fixed_cost"]:
-                return "固定費"
-            return "その他"
-
-        def normalize_status(val: str) -> str:
-            if not val: return "書いただけ"
-            v = val.strip().lower()
-            # 内部値: 書いただけ, 見積済み, 買い物中, 購入済み, 購入しない
-            if v in ["書いただけ", "提案", "proposal", "written", "draft"]: return "書いただけ"
-            if v in ["見積済み", "estimated", "見積済", "estimate"]: return "見積済み"
-            if v in ["買い物中", "shopping", "in_progress", "買い物", "shop"]: return "買い物中"
-            if v in ["購入済み", "purchased", "done", "購入済", "complete"]: return "購入済み"
-            if v in ["購入しない", "not purchasing", "not_purchasing", "skip", "cancel"]: return "購入しない"
-            return "書いただけ"
-
-        def normalize_priority(val: Any) -> int:
-            if val is None: return 3
-            v = str(val).strip().lower()
-            # 数値ならそのまま返す
-            if v.isdigit():
-                return int(v)
-            # 日本語・英語のマッピング
-            mapping = {
-                "最高": 5, "highest": 5, "最優先": 5,
-                "高": 4, "high": 4,
-                "中": 3, "medium": 3, "normal": 3,
-                "低": 2, "low": 2,
-                "最低": 1, "lowest": 1
-            }
-            return mapping.get(v, 3)
-
-        new_purchases = []
-        for row in reader:
-            item_name = row.get(col_item_name)
-            if not item_name: continue
-            
-            amount_val = 0.0
-            try:
-                raw_amount = str(row.get(col_amount, "0")).replace(",", "")
-                amount_val = float(raw_amount)
-            except ValueError: pass
-
-            priority_val = 3
-            if col_priority:
-                priority_val = normalize_priority(row.get(col_priority))
-
-            category_val = "その他"
-            if col_category:
-                category_val = normalize_category(str(row.get(col_category, "")))
-
-            status_val = "書いただけ"
-            if col_status:
-                status_val = normalize_status(str(row.get(col_status, "")))
-
-            p_data = schemas.PurchaseCreate(
-                dataset_id=dataset_id,
-                member_name=str(row.get(col_member)).strip() if col_member and row.get(col_member) else None,
-                category=category_val,
-                item_name=str(item_name).strip(),
-                amount=amount_val,
-                unit="JPY", 
-                status=status_val,
-                priority=priority_val,
-                note=str(row.get(col_note)).strip() if col_note and row.get(col_note) else None,
-                assignments=[]
-            )
-            
-            b_id = row.get(col_budget_id) if col_budget_id else None
-            as_amount_raw = row.get(col_asgn_amount) if col_asgn_amount else None
-            if b_id and as_amount_raw:
-                try:
-                    p_data.assignments.append(schemas.BudgetAssignmentCreate(
-                        budget_id=str(b_id), 
-                        amount=float(str(as_amount_raw).replace(",", ""))
-                    ))
-                except ValueError: pass
-            new_purchases.append(p_data)
-
-        crud.create_purchases_bulk(db, dataset_id, new_purchases)
-        return {"count": len(new_purchases), "message": "Import successful"}
+        cols = importers.PurchaseColumnMapping.from_json(str(setting.mapping_json))
+        # アップロードファイルをワーカースレッドで少しずつ読み、チャンク単位で登録します
+        result = await importers.import_pool.run(db, importers.import_purchases_csv, dataset_id, file.file, cols, overwrite)
+        return {"count": result.inserted, **asdict(result), "message": result.message}
+    except importers.ImportMappingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except importers.ImportBusyError as e:
+        raise import_busy(e)
     except Exception as e:
         if isinstance(e, HTTPException): raise e
         raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
 
 
+# インポートが混み合っている場合に Retry-After で返す秒数
+IMPORT_RETRY_AFTER_SECONDS = 5
+
+
+def import_busy(e: importers.ImportBusyError) -> HTTPException:
+    # 同時に受け付けられるインポート数を超えた場合は、しばらく後の再送を促します
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(IMPORT_RETRY_AFTER_SECONDS)})
+
+
+# --- Import Jobs ---
+# ファイルを受け付けたらすぐにジョブを返し、取り込みはバックグラウンドで行います（進捗は GET で確認します）
+
+@app.post("/api/purchases/import-jobs", response_model=schemas.ImportJob, status_code=status.HTTP_202_ACCEPTED)
+async def submit_purchase_import_job(dataset_id: str, file: UploadFile = File(...), overwrite: bool = Form(False), db: DbSession = Depends(get_db)):
+    setting = await run_db(db, crud.get_purchase_import_setting, dataset_id, as_model=schemas.PurchaseImportSetting)
+    if not setting:
+        raise HTTPException(status_code=400, detail="Import setting not found for this dataset")
+    try:
+        importers.PurchaseColumnMapping.from_json(str(setting.mapping_json))
+        return await jobs.submit(db, "purchases", dataset_id, None, str(setting.mapping_json), overwrite, file.file)
+    except importers.ImportMappingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except importers.ImportBusyError as e:
+        raise import_busy(e)
+
+
+@app.post("/api/budgets/{budget_id}/import-jobs", response_model=schemas.ImportJob, status_code=status.HTTP_202_ACCEPTED)
+async def submit_actual_expense_import_job(budget_id: str, file: UploadFile = File(...), overwrite: bool = Form(False), db: DbSession = Depends(get_db)):
+    found = await run_db(db, versions.get_budget_version, budget_id)
+    if not found:
+        raise HTTPException(status_code=404, detail="Budget not found")
+    setting = await run_db(db, crud.get_import_setting, budget_id, as_model=schemas.ImportSetting)
+    if not setting:
+        raise HTTPException(status_code=400, detail="Import setting not found")
+    try:
+        importers.actual_expense_columns(str(setting.mapping_json))
+        return await jobs.submit(db, "actual_expenses", found[0], budget_id, str(setting.mapping_json), overwrite, file.file)
+    except importers.ImportMappingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except importers.ImportBusyError as e:
+        raise import_busy(e)
+
+
+@app.get("/api/import-jobs", response_model=List[schemas.ImportJob])
+async def read_import_jobs(dataset_id: str, db: DbSession = Depends(get_db)):
+    return await run_db(db, jobs.get_import_jobs, dataset_id, as_model=schemas.ImportJob)
+
+
+@app.get("/api/import-jobs/{job_id}", response_model=schemas.ImportJob)
+async def read_import_job(job_id: str, db: DbSession = Depends(get_db)):
+    job = await run_db(db, jobs.get_import_job, job_id, as_model=schemas.ImportJob)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job
+
+
+@app.post("/api/import-jobs/{job_id}/cancel", response_model=schemas.ImportJob)
+async def cancel_import_job(job_id: str, db: DbSession = Depends(get_db)):
+    job = await run_db(db, jobs.cancel_import_job, job_id, as_model=schemas.ImportJob)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job
+
+
 # --- Import & Actual Expenses ---
 
-@app.get("/api/budgets/{budget_id}/import-setting", response_model=Optional[schemas.ImportSetting])
-def get_import_setting(budget_id: str, db: Session = Depends(get_db)):
-    return crud.get_import_setting(db, budget_id)
+@app.get("/api/budgets/{budget_id}/import-setting", response_model=Optional[schemas.ImportSetting], dependencies=[Depends(budget_etag)])
+async def get_import_setting(budget_id: str, db: DbSession = Depends(get_db)):
+    return await run_db(db, crud.get_import_setting, budget_id, as_model=schemas.ImportSetting)
 
 
 @app.post("/api/budgets/{budget_id}/import-setting")
-def save_import_setting(budget_id: str, setting: schemas.ImportSettingBase, db: Session = Depends(get_db)):
-    return crud.save_import_setting(db, budget_id, setting.mapping_json)
+async def save_import_setting(budget_id: str, setting: schemas.ImportSettingBase, db: DbSession = Depends(get_db)):
+    return await run_write(db, crud.save_import_setting, budget_id, setting.mapping_json, as_model=schemas.ImportSetting)
 
 
 @app.post("/api/budgets/{budget_id}/import-csv")
-async def import_csv(budget_id: str, file: UploadFile = File(...), overwrite: bool = Form(False), db: Session = Depends(get_db)):
-    setting = crud.get_import_setting(db, budget_id)
+async def import_csv(budget_id: str, file: UploadFile = File(...), overwrite: bool = Form(False), db: DbSession = Depends(get_db)):
+    setting = await run_db(db, crud.get_import_setting, budget_id, as_model=schemas.ImportSetting)
     if not setting: raise HTTPException(status_code=400, detail="Import setting not found")
 
     try:
-        mapping = json.loads(str(setting.mapping_json))
-        name_col, amount_col = mapping.get("item_name"), mapping.get("amount")
-        if not name_col or not amount_col: raise HTTPException(status_code=400, detail="Invalid mapping")
-
-        contents = await file.read()
-        decoded_contents = contents.decode("utf-8-sig")
-        df = io.StringIO(decoded_contents)
-        reader = csv.DictReader(df)
-
-        expenses = []
-        for row in reader:
-            item_name, amount_str = row.get(name_col), row.get(amount_col)
-            if item_name and amount_str:
-                expenses.append(schemas.ActualExpenseCreate(budget_id=budget_id, item_name=str(item_name), amount=float(str(amount_str).replace(",", "")), unit="JPY"))
-
-        crud.create_actual_expenses(db, budget_id, expenses, overwrite=overwrite)
-        return {"count": len(expenses), "message": "Import successful"}
+        count = await importers.import_pool.run(db, importers.import_actual_expenses_csv, budget_id, file.file, str(setting.mapping_json), overwrite)
+        return {"count": count, "message": "Import successful"}
+    except importers.ImportMappingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except importers.ImportBusyError as e:
+        raise import_busy(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
 
 
-@app.get("/api/budgets/{budget_id}/actual-expenses", response_model=List[schemas.ActualExpense])
-def get_actual_expenses(budget_id: str, db: Session = Depends(get_db)):
-    return crud.get_actual_expenses(db, budget_id)
+@app.get("/api/budgets/{budget_id}/actual-expenses", response_model=List[schemas.ActualExpense], dependencies=[Depends(budget_etag)])
+async def get_actual_expenses(budget_id: str, response: Response, params: Annotated[schemas.ActualExpenseListQuery, Query()], db: DbSession = Depends(get_db)):
+    page = await run_db(db, crud.get_actual_expenses, budget_id, params, as_model=schemas.ActualExpense)
+    return page_items(page, response)
+
+
+@app.get("/api/actual-expenses/search", response_model=List[schemas.ActualExpense])
+async def search_actual_expenses(params: Annotated[schemas.ActualExpenseSearchQuery, Query()], response: Response, version: Optional[int] = Depends(dataset_etag), db: DbSession = Depends(get_db)):
+    async def compute() -> Tuple[Any, Dict[str, str]]:
+        return page_result(await run_db(db, search.search_actual_expenses, params, as_model=schemas.ActualExpense))
+    key = ("actual-expense-search", params.model_dump_json())
+    return await cached_json(response, params.dataset_id, version, key, ACTUAL_EXPENSE_LIST_ADAPTER, compute)
 
 
 @app.post("/api/budgets/{budget_id}/actual-expenses", response_model=schemas.ActualExpense)
-def create_actual_expense(budget_id: str, expense: schemas.ActualExpenseCreate, db: Session = Depends(get_db)):
-    expense_data = expense.model_dump()
-    expense_data["budget_id"] = budget_id
-    db_exp = models.ActualExpense(**expense_data)
-    db.add(db_exp)
-    db.commit()
-    db.refresh(db_exp)
-    return db_exp
+async def create_actual_expense(budget_id: str, expense: schemas.ActualExpenseCreate, db: DbSession = Depends(get_db)):
+    return await run_write(db, crud.create_actual_expense, budget_id, expense, as_model=schemas.ActualExpense)
 
 
 @app.put("/api/actual-expenses/{expense_id}", response_model=schemas.ActualExpense)
-def update_actual_expense(expense_id: int, expense: schemas.ActualExpenseCreate, db: Session = Depends(get_db)):
-    db_exp = crud.update_actual_expense(db, expense_id, expense)
+async def update_actual_expense(expense_id: int, expense: schemas.ActualExpenseCreate, db: DbSession = Depends(get_db)):
+    db_exp = await run_write(db, crud.update_actual_expense, expense_id, expense, as_model=schemas.ActualExpense)
     if not db_exp: raise HTTPException(status_code=404, detail="Actual expense not found")
     return db_exp
 
 
 @app.delete("/api/actual-expenses/{expense_id}")
-def delete_actual_expense(expense_id: int, db: Session = Depends(get_db)):
-    if not crud.delete_actual_expense(db, expense_id): raise HTTPException(status_code=404, detail="Actual expense not found")
+async def delete_actual_expense(expense_id: int, db: DbSession = Depends(get_db)):
+    if not await run_write(db, crud.delete_actual_expense, expense_id): raise HTTPException(status_code=404, detail="Actual expense not found")
     return {"message": "Actual expense deleted"}
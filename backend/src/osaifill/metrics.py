@@ -0,0 +1,293 @@
+"""プロセス内で集計するメトリクス（Prometheus のテキスト形式で GET /api/metrics から返します）
+
+- ルートごとのリクエスト数とレイテンシのヒストグラム（MetricsMiddleware）
+- リクエストごとの SQL の実行数と DB の時間（SQLAlchemy のエンジンイベント）
+- 接続プールから接続を取得するまでの待ち時間（timed_pool() で作るプールクラス）
+- CSV インポート・エクスポートの行数と時間（rate(rows) / rate(seconds) でスループットになります）
+
+値はロック付きの辞書に加算するだけなので、1 回の記録のコストはマイクロ秒未満です。
+METRICS_ENABLED=0 で記録を止められます。
+"""
+import os
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values: str) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(self.labels, k)} {_format_value(v)}" for k, v in items)
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+@dataclass
+class _HistogramValue:
+    buckets: List[int]
+    count: int = 0
+    sum: float = 0.0
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float], labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.bounds = tuple(buckets)
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, _HistogramValue] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = _HistogramValue([0] * len(self.bounds))
+            for i, bound in enumerate(self.bounds):
+                if value <= bound:
+                    entry.buckets[i] += 1
+                    break
+            entry.count += 1
+            entry.sum += value
+
+    def count(self, *label_values: str) -> int:
+        with self._lock:
+            entry = self._values.get(label_values)
+            return entry.count if entry else 0
+
+    def sum(self, *label_values: str) -> float:
+        with self._lock:
+            entry = self._values.get(label_values)
+            return entry.sum if entry else 0.0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, _HistogramValue(list(v.buckets), v.count, v.sum)) for k, v in self._values.items())
+        for key, entry in items:
+            # バケットは「その値以下」の累積で出力します
+            cumulative = 0
+            for bound, n in zip(self.bounds, entry.buckets):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels + ('le',), key + (_format_value(bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels + ('le',), key + ('+Inf',))} {entry.count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(entry.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {entry.count}")
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+HTTP_REQUESTS = Counter("osaifill_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_DURATION = Histogram("osaifill_http_request_duration_seconds", "HTTP request latency.", LATENCY_BUCKETS, ("method", "route"))
+HTTP_DB_QUERIES = Histogram("osaifill_http_request_db_queries", "SQL statements executed per HTTP request.", QUERY_COUNT_BUCKETS, ("method", "route"))
+HTTP_DB_SECONDS = Histogram("osaifill_http_request_db_seconds", "Time spent executing SQL per HTTP request.", LATENCY_BUCKETS, ("method", "route"))
+DB_QUERIES = Counter("osaifill_db_queries_total", "SQL statements executed, including background work.")
+DB_SECONDS = Counter("osaifill_db_query_seconds_total", "Time spent executing SQL, including background work.")
+POOL_CHECKOUT_WAIT = Histogram("osaifill_db_pool_checkout_wait_seconds", "Time to check out a connection from the pool.", WAIT_BUCKETS)
+ROWS = Counter("osaifill_rows_total", "Rows processed by CSV imports and exports.", ("direction", "kind"))
+ROW_SECONDS = Counter("osaifill_row_seconds_total", "Time spent in CSV imports and exports.", ("direction", "kind"))
+
+REGISTRY: List[Any] = [
+    HTTP_REQUESTS, HTTP_DURATION, HTTP_DB_QUERIES, HTTP_DB_SECONDS,
+    DB_QUERIES, DB_SECONDS, POOL_CHECKOUT_WAIT, ROWS, ROW_SECONDS,
+]
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    for metric in REGISTRY:
+        metric.clear()
+
+
+# --- SQL ---
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+
+
+# 処理中のリクエストの集計（run_in_threadpool などのワーカースレッドにもコンテキストごと引き継がれます）
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("osaifill_request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+def _before_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+    conn.info.setdefault("osaifill_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+    starts = conn.info.get("osaifill_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    DB_QUERIES.inc()
+    DB_SECONDS.inc(elapsed)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+
+def _handle_error(exception_context: Any) -> None:
+    # 失敗した文も 1 回の実行として数え、開始時刻を残さないようにします
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("osaifill_query_start"):
+        _after_cursor_execute(conn, None, "", None, None, False)
+
+
+_sql_events_lock = threading.Lock()
+_sql_events_installed = False
+
+
+def install_sql_events() -> None:
+    """すべてのエンジン（テスト用・バックグラウンド用を含む）で SQL の実行数と時間を記録します"""
+    global _sql_events_installed
+    with _sql_events_lock:
+        if _sql_events_installed:
+            return
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+        _sql_events_installed = True
+
+
+# --- Connection pool ---
+
+_timed_pools: Dict[Type[Pool], Type[Pool]] = {}
+
+
+def timed_pool(base: Type[Pool]) -> Type[Pool]:
+    """connect() の待ち時間を POOL_CHECKOUT_WAIT に記録する base のサブクラスを返します"""
+    if not METRICS_ENABLED:
+        return base
+    timed = _timed_pools.get(base)
+    if timed is None:
+        def connect(self: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return base.connect(self)
+            finally:
+                POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+        timed = _timed_pools[base] = type(f"Timed{base.__name__}", (base,), {"connect": connect})
+    return timed
+
+
+# --- Import / export ---
+
+def record_rows(direction: str, kind: str, rows: int, started: float) -> None:
+    """インポート（direction="import"）・エクスポートの行数と、started（time.perf_counter()）からの時間を記録します"""
+    if not METRICS_ENABLED:
+        return
+    ROWS.inc(rows, direction, kind)
+    ROW_SECONDS.inc(time.perf_counter() - started, direction, kind)
+
+
+# --- HTTP ---
+
+ASGIApp = Callable[[Dict[str, Any], Callable[[], Awaitable[Any]], Callable[[Any], Awaitable[None]]], Awaitable[None]]
+
+
+def _route_label(scope: Dict[str, Any]) -> str:
+    # パスパラメーターを含む実際のパスではなく、ルートのテンプレートで集計します
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """ルートごとのリクエスト数・レイテンシと、リクエストごとの SQL の実行数・DB の時間を記録します"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[[], Awaitable[Any]], send: Callable[[Any], Awaitable[None]]) -> None:
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status_code = 500
+
+        async def send_with_status(message: Any) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_stats.reset(token)
+            method, route = scope["method"], _route_label(scope)
+            HTTP_REQUESTS.inc(1, method, route, str(status_code))
+            HTTP_DURATION.observe(elapsed, method, route)
+            HTTP_DB_QUERIES.observe(stats.queries, method, route)
+            HTTP_DB_SECONDS.observe(stats.db_seconds, method, route)
@@ -0,0 +1,641 @@
+"""SQLite データベースのバージョン管理付きスキーママイグレーション
+
+適用済みのバージョンは schema_migrations テーブルに記録し、未適用のものだけを順番に実行します。
+各マイグレーションはそれぞれ 1 つのトランザクションで実行されるため、失敗した場合はそのバージョンの
+変更がすべて取り消されます。既存の SQLite ファイルはその場でアップグレードされます::
+
+    python -m osaifill.migrations status
+    python -m osaifill.migrations upgrade
+
+新しいマイグレーションを追加するときは、models.py の定義と同じ結果になるように記述してください
+（tests/test_migrations.py で新規作成したデータベースと models.py の一致を確認しています）。
+
+SQLite は外部キーを ALTER TABLE で変更できないため、テーブルを作り直すマイグレーションは
+disable_foreign_keys=True で登録します。実行中は外部キー制約を無効にし、コミット前に
+PRAGMA foreign_key_check で違反がないことを確認します。
+"""
+import argparse
+import logging
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from .money import to_minor
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+    # テーブルを作り直す（DROP / RENAME する）マイグレーションでは外部キー制約を無効にして実行します
+    disable_foreign_keys: bool = False
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str, disable_foreign_keys: bool = False) -> Callable[[Callable[[Connection], None]], Callable[[Connection], None]]:
+    def register(fn: Callable[[Connection], None]) -> Callable[[Connection], None]:
+        assert not MIGRATIONS or MIGRATIONS[-1].version < version, "migrations must be declared in order"
+        MIGRATIONS.append(Migration(version, name, fn, disable_foreign_keys))
+        return fn
+    return register
+
+
+def _execute_script(conn: Connection, script: str) -> None:
+    for statement in script.split(";"):
+        if statement.strip():
+            conn.exec_driver_sql(statement)
+
+
+def _rebuild_table(conn: Connection, table: str, create_sql: str, keep: str, indexes: str = "") -> None:
+    """create_sql（テーブル名は {table}）でテーブルを作り直し、keep を満たす行だけを移します
+
+    SQLite の推奨手順どおり、新しいテーブルを作って行を移し、元のテーブルを削除してから名前を変えます。
+    インデックスは元のテーブルと一緒に削除されるため、indexes で作り直します。
+    """
+    conn.exec_driver_sql(create_sql.format(table=f"{table}__new"))
+    conn.exec_driver_sql(f"INSERT INTO {table}__new SELECT * FROM {table} WHERE {keep}")
+    conn.exec_driver_sql(f"DROP TABLE {table}")
+    conn.exec_driver_sql(f"ALTER TABLE {table}__new RENAME TO {table}")
+    _execute_script(conn, indexes)
+
+
+# --- マイグレーション定義（一度リリースしたものは書き換えないでください） ---
+
+@migration(1, "initial")
+def _initial(conn: Connection) -> None:
+    # マイグレーション導入前に create_all で作成されたデータベースにも適用できるよう IF NOT EXISTS を付けます
+    _execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS datasets (
+            id VARCHAR NOT NULL,
+            name VARCHAR NOT NULL,
+            created_at DATETIME,
+            PRIMARY KEY (id)
+        );
+        CREATE TABLE IF NOT EXISTS budgets (
+            id VARCHAR NOT NULL,
+            dataset_id VARCHAR NOT NULL,
+            name VARCHAR NOT NULL,
+            total_amount FLOAT NOT NULL,
+            unit VARCHAR,
+            description TEXT,
+            PRIMARY KEY (id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id)
+        );
+        CREATE TABLE IF NOT EXISTS members (
+            id INTEGER NOT NULL,
+            dataset_id VARCHAR NOT NULL,
+            name VARCHAR NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id)
+        );
+        CREATE INDEX IF NOT EXISTS ix_members_id ON members (id);
+        CREATE TABLE IF NOT EXISTS purchase_import_settings (
+            dataset_id VARCHAR NOT NULL,
+            mapping_json TEXT,
+            PRIMARY KEY (dataset_id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id)
+        );
+        CREATE TABLE IF NOT EXISTS purchases (
+            id INTEGER NOT NULL,
+            dataset_id VARCHAR NOT NULL,
+            member_name VARCHAR,
+            category VARCHAR,
+            item_name VARCHAR NOT NULL,
+            amount FLOAT NOT NULL,
+            unit VARCHAR,
+            status VARCHAR,
+            priority INTEGER,
+            note TEXT,
+            PRIMARY KEY (id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id)
+        );
+        CREATE INDEX IF NOT EXISTS ix_purchases_id ON purchases (id);
+        CREATE TABLE IF NOT EXISTS actual_expenses (
+            id INTEGER NOT NULL,
+            budget_id VARCHAR NOT NULL,
+            item_name VARCHAR,
+            amount FLOAT NOT NULL,
+            unit VARCHAR,
+            PRIMARY KEY (id),
+            FOREIGN KEY(budget_id) REFERENCES budgets (id)
+        );
+        CREATE INDEX IF NOT EXISTS ix_actual_expenses_id ON actual_expenses (id);
+        CREATE TABLE IF NOT EXISTS budget_assignments (
+            id INTEGER NOT NULL,
+            purchase_id INTEGER NOT NULL,
+            budget_id VARCHAR NOT NULL,
+            amount FLOAT NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(purchase_id) REFERENCES purchases (id),
+            FOREIGN KEY(budget_id) REFERENCES budgets (id)
+        );
+        CREATE INDEX IF NOT EXISTS ix_budget_assignments_id ON budget_assignments (id);
+        CREATE TABLE IF NOT EXISTS import_settings (
+            budget_id VARCHAR NOT NULL,
+            mapping_json TEXT,
+            PRIMARY KEY (budget_id),
+            FOREIGN KEY(budget_id) REFERENCES budgets (id)
+        );
+    """)
+
+
+@migration(2, "dashboard_rollups")
+def _dashboard_rollups(conn: Connection) -> None:
+    # 既存データの集計値は初回のダッシュボード表示時に rollup.ensure_dataset が補完します
+    _execute_script(conn, """
+        CREATE TABLE IF NOT EXISTS dataset_rollups (
+            dataset_id VARCHAR NOT NULL,
+            fixed_cost_planned_total FLOAT NOT NULL,
+            travel_planned_total FLOAT NOT NULL,
+            other_planned_total FLOAT NOT NULL,
+            unassigned_planned_total FLOAT NOT NULL,
+            fixed_cost_total FLOAT NOT NULL,
+            travel_cost_total FLOAT NOT NULL,
+            PRIMARY KEY (dataset_id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id)
+        );
+        CREATE TABLE IF NOT EXISTS budget_rollups (
+            budget_id VARCHAR NOT NULL,
+            actual_total FLOAT NOT NULL,
+            planned_total FLOAT NOT NULL,
+            PRIMARY KEY (budget_id),
+            FOREIGN KEY(budget_id) REFERENCES budgets (id)
+        );
+    """)
+
+
+@migration(3, "query_indexes")
+def _query_indexes(conn: Connection) -> None:
+    # crud.py の実際の絞り込み条件に合わせたインデックスです
+    _execute_script(conn, """
+        CREATE INDEX IF NOT EXISTS ix_members_dataset_id ON members (dataset_id);
+        CREATE INDEX IF NOT EXISTS ix_budgets_dataset_id ON budgets (dataset_id);
+        CREATE INDEX IF NOT EXISTS ix_purchases_dataset_status_category ON purchases (dataset_id, status, category);
+        CREATE INDEX IF NOT EXISTS ix_budget_assignments_budget_purchase ON budget_assignments (budget_id, purchase_id);
+        CREATE INDEX IF NOT EXISTS ix_budget_assignments_purchase_id ON budget_assignments (purchase_id);
+        CREATE INDEX IF NOT EXISTS ix_actual_expenses_budget_id ON actual_expenses (budget_id);
+    """)
+
+
+@migration(4, "list_sort_indexes")
+def _list_sort_indexes(conn: Connection) -> None:
+    # 一覧 API のキーセットページネーションで使う並び順のインデックスです
+    _execute_script(conn, """
+        DROP INDEX IF EXISTS ix_budgets_dataset_id;
+        CREATE INDEX IF NOT EXISTS ix_budgets_dataset_id_id ON budgets (dataset_id, id);
+        CREATE INDEX IF NOT EXISTS ix_budgets_dataset_name ON budgets (dataset_id, name);
+        CREATE INDEX IF NOT EXISTS ix_purchases_dataset_id ON purchases (dataset_id);
+        CREATE INDEX IF NOT EXISTS ix_purchases_dataset_amount ON purchases (dataset_id, amount);
+        CREATE INDEX IF NOT EXISTS ix_purchases_dataset_priority ON purchases (dataset_id, priority);
+        CREATE INDEX IF NOT EXISTS ix_purchases_dataset_category ON purchases (dataset_id, category);
+        CREATE INDEX IF NOT EXISTS ix_actual_expenses_budget_amount ON actual_expenses (budget_id, amount);
+    """)
+
+
+@migration(5, "dataset_versions")
+def _dataset_versions(conn: Connection) -> None:
+    conn.exec_driver_sql("ALTER TABLE datasets ADD COLUMN version INTEGER DEFAULT '0' NOT NULL")
+
+
+@migration(6, "import_jobs")
+def _import_jobs(conn: Connection) -> None:
+    _execute_script(conn, """
+        CREATE TABLE import_jobs (
+            id VARCHAR NOT NULL,
+            dataset_id VARCHAR NOT NULL,
+            budget_id VARCHAR,
+            kind VARCHAR NOT NULL,
+            status VARCHAR NOT NULL,
+            overwrite BOOLEAN NOT NULL,
+            mapping_json TEXT NOT NULL,
+            file_path VARCHAR,
+            rows_processed INTEGER NOT NULL,
+            inserted INTEGER NOT NULL,
+            skipped INTEGER NOT NULL,
+            failed INTEGER NOT NULL,
+            errors JSON NOT NULL,
+            message TEXT,
+            cancel_requested BOOLEAN NOT NULL,
+            created_at DATETIME,
+            started_at DATETIME,
+            finished_at DATETIME,
+            worker VARCHAR,
+            PRIMARY KEY (id)
+        );
+        CREATE INDEX ix_import_jobs_dataset_created ON import_jobs (dataset_id, created_at);
+    """)
+
+
+@migration(7, "cascade_foreign_keys", disable_foreign_keys=True)
+def _cascade_foreign_keys(conn: Connection) -> None:
+    # すべての外部キーに ON DELETE CASCADE を付け、データセット・購入アイテムの削除を 1 回の DELETE で済ませます。
+    # 外部キー制約が無効だった頃に残った親のない行（アプリからは参照できない行）はここで取り除きます。
+    # 親のテーブルから順に作り直すため、子の keep は作り直した後の親を参照します。
+    in_datasets = "dataset_id IN (SELECT id FROM datasets)"
+    in_budgets = "budget_id IN (SELECT id FROM budgets)"
+    _rebuild_table(conn, "members", """
+        CREATE TABLE {table} (
+            id INTEGER NOT NULL,
+            dataset_id VARCHAR NOT NULL,
+            name VARCHAR NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id) ON DELETE CASCADE
+        )
+    """, in_datasets, """
+        CREATE INDEX ix_members_id ON members (id);
+        CREATE INDEX ix_members_dataset_id ON members (dataset_id);
+    """)
+    _rebuild_table(conn, "budgets", """
+        CREATE TABLE {table} (
+            id VARCHAR NOT NULL,
+            dataset_id VARCHAR NOT NULL,
+            name VARCHAR NOT NULL,
+            total_amount FLOAT NOT NULL,
+            unit VARCHAR,
+            description TEXT,
+            PRIMARY KEY (id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id) ON DELETE CASCADE
+        )
+    """, in_datasets, """
+        CREATE INDEX ix_budgets_dataset_id_id ON budgets (dataset_id, id);
+        CREATE INDEX ix_budgets_dataset_name ON budgets (dataset_id, name);
+    """)
+    _rebuild_table(conn, "purchases", """
+        CREATE TABLE {table} (
+            id INTEGER NOT NULL,
+            dataset_id VARCHAR NOT NULL,
+            member_name VARCHAR,
+            category VARCHAR,
+            item_name VARCHAR NOT NULL,
+            amount FLOAT NOT NULL,
+            unit VARCHAR,
+            status VARCHAR,
+            priority INTEGER,
+            note TEXT,
+            PRIMARY KEY (id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id) ON DELETE CASCADE
+        )
+    """, in_datasets, """
+        CREATE INDEX ix_purchases_id ON purchases (id);
+        CREATE INDEX ix_purchases_dataset_status_category ON purchases (dataset_id, status, category);
+        CREATE INDEX ix_purchases_dataset_id ON purchases (dataset_id);
+        CREATE INDEX ix_purchases_dataset_amount ON purchases (dataset_id, amount);
+        CREATE INDEX ix_purchases_dataset_priority ON purchases (dataset_id, priority);
+        CREATE INDEX ix_purchases_dataset_category ON purchases (dataset_id, category);
+    """)
+    _rebuild_table(conn, "purchase_import_settings", """
+        CREATE TABLE {table} (
+            dataset_id VARCHAR NOT NULL,
+            mapping_json TEXT,
+            PRIMARY KEY (dataset_id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id) ON DELETE CASCADE
+        )
+    """, in_datasets)
+    _rebuild_table(conn, "dataset_rollups", """
+        CREATE TABLE {table} (
+            dataset_id VARCHAR NOT NULL,
+            fixed_cost_planned_total FLOAT NOT NULL,
+            travel_planned_total FLOAT NOT NULL,
+            other_planned_total FLOAT NOT NULL,
+            unassigned_planned_total FLOAT NOT NULL,
+            fixed_cost_total FLOAT NOT NULL,
+            travel_cost_total FLOAT NOT NULL,
+            PRIMARY KEY (dataset_id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id) ON DELETE CASCADE
+        )
+    """, in_datasets)
+    _rebuild_table(conn, "budget_assignments", """
+        CREATE TABLE {table} (
+            id INTEGER NOT NULL,
+            purchase_id INTEGER NOT NULL,
+            budget_id VARCHAR NOT NULL,
+            amount FLOAT NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(purchase_id) REFERENCES purchases (id) ON DELETE CASCADE,
+            FOREIGN KEY(budget_id) REFERENCES budgets (id) ON DELETE CASCADE
+        )
+    """, f"purchase_id IN (SELECT id FROM purchases) AND {in_budgets}", """
+        CREATE INDEX ix_budget_assignments_id ON budget_assignments (id);
+        CREATE INDEX ix_budget_assignments_budget_purchase ON budget_assignments (budget_id, purchase_id);
+        CREATE INDEX ix_budget_assignments_purchase_id ON budget_assignments (purchase_id);
+    """)
+    _rebuild_table(conn, "actual_expenses", """
+        CREATE TABLE {table} (
+            id INTEGER NOT NULL,
+            budget_id VARCHAR NOT NULL,
+            item_name VARCHAR,
+            amount FLOAT NOT NULL,
+            unit VARCHAR,
+            PRIMARY KEY (id),
+            FOREIGN KEY(budget_id) REFERENCES budgets (id) ON DELETE CASCADE
+        )
+    """, in_budgets, """
+        CREATE INDEX ix_actual_expenses_id ON actual_expenses (id);
+        CREATE INDEX ix_actual_expenses_budget_id ON actual_expenses (budget_id);
+        CREATE INDEX ix_actual_expenses_budget_amount ON actual_expenses (budget_id, amount);
+    """)
+    _rebuild_table(conn, "import_settings", """
+        CREATE TABLE {table} (
+            budget_id VARCHAR NOT NULL,
+            mapping_json TEXT,
+            PRIMARY KEY (budget_id),
+            FOREIGN KEY(budget_id) REFERENCES budgets (id) ON DELETE CASCADE
+        )
+    """, in_budgets)
+    _rebuild_table(conn, "budget_rollups", """
+        CREATE TABLE {table} (
+            budget_id VARCHAR NOT NULL,
+            actual_total FLOAT NOT NULL,
+            planned_total FLOAT NOT NULL,
+            PRIMARY KEY (budget_id),
+            FOREIGN KEY(budget_id) REFERENCES budgets (id) ON DELETE CASCADE
+        )
+    """, in_budgets)
+
+
+def _create_search_triggers(conn: Connection) -> None:
+    """全文検索の索引を元のテーブルと同期するトリガーを作成します（トリガーは元のテーブルと一緒に削除されます）"""
+    conn.exec_driver_sql("""
+        CREATE TRIGGER purchases_fts_ai AFTER INSERT ON purchases BEGIN
+            INSERT INTO purchases_fts(rowid, item_name, note, member_name) VALUES (new.id, new.item_name, new.note, new.member_name);
+        END
+    """)
+    conn.exec_driver_sql("""
+        CREATE TRIGGER purchases_fts_ad AFTER DELETE ON purchases BEGIN
+            INSERT INTO purchases_fts(purchases_fts, rowid, item_name, note, member_name) VALUES ('delete', old.id, old.item_name, old.note, old.member_name);
+        END
+    """)
+    conn.exec_driver_sql("""
+        CREATE TRIGGER purchases_fts_au AFTER UPDATE OF item_name, note, member_name ON purchases BEGIN
+            INSERT INTO purchases_fts(purchases_fts, rowid, item_name, note, member_name) VALUES ('delete', old.id, old.item_name, old.note, old.member_name);
+            INSERT INTO purchases_fts(rowid, item_name, note, member_name) VALUES (new.id, new.item_name, new.note, new.member_name);
+        END
+    """)
+    conn.exec_driver_sql("""
+        CREATE TRIGGER actual_expenses_fts_ai AFTER INSERT ON actual_expenses BEGIN
+            INSERT INTO actual_expenses_fts(rowid, item_name) VALUES (new.id, new.item_name);
+        END
+    """)
+    conn.exec_driver_sql("""
+        CREATE TRIGGER actual_expenses_fts_ad AFTER DELETE ON actual_expenses BEGIN
+            INSERT INTO actual_expenses_fts(actual_expenses_fts, rowid, item_name) VALUES ('delete', old.id, old.item_name);
+        END
+    """)
+    conn.exec_driver_sql("""
+        CREATE TRIGGER actual_expenses_fts_au AFTER UPDATE OF item_name ON actual_expenses BEGIN
+            INSERT INTO actual_expenses_fts(actual_expenses_fts, rowid, item_name) VALUES ('delete', old.id, old.item_name);
+            INSERT INTO actual_expenses_fts(rowid, item_name) VALUES (new.id, new.item_name);
+        END
+    """)
+
+
+@migration(8, "search_index")
+def _search_index(conn: Connection) -> None:
+    # 購入アイテムと実績の全文検索の索引（search.py を参照）。トリガーの本文は ; を含むため 1 文ずつ実行します
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE purchases_fts USING fts5(item_name, note, member_name, "
+        "content='purchases', content_rowid='id', tokenize='trigram')"
+    )
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE actual_expenses_fts USING fts5(item_name, "
+        "content='actual_expenses', content_rowid='id', tokenize='trigram')"
+    )
+    _create_search_triggers(conn)
+    # 既存の行を索引に登録します
+    conn.exec_driver_sql("INSERT INTO purchases_fts(purchases_fts) VALUES ('rebuild')")
+    conn.exec_driver_sql("INSERT INTO actual_expenses_fts(actual_expenses_fts) VALUES ('rebuild')")
+
+
+# 金額の列（テーブル名: 列名）
+MONEY_COLUMNS = {
+    "budgets": ("total_amount",),
+    "purchases": ("amount",),
+    "budget_assignments": ("amount",),
+    "actual_expenses": ("amount",),
+    "dataset_rollups": (
+        "fixed_cost_planned_total", "travel_planned_total", "other_planned_total",
+        "unassigned_planned_total", "fixed_cost_total", "travel_cost_total",
+    ),
+    "budget_rollups": ("actual_total", "planned_total"),
+}
+
+
+def _to_minor_or_null(value: Any) -> Optional[int]:
+    return None if value is None else to_minor(value)
+
+
+@migration(9, "integer_money", disable_foreign_keys=True)
+def _integer_money(conn: Connection) -> None:
+    # 金額を 1/100 単位の整数（money.py の SCALE）に変換し、列の型を INTEGER に作り直します。
+    # FLOAT の列には整数も実数として保存されるため、値の変換だけでなくテーブルの作り直しが必要です。
+    # 変換はアプリと同じ to_minor で行います（SQL の ROUND(1.005 * 100) は 101 ではなく 100 になります）
+    driver = conn.connection.driver_connection
+    assert driver is not None
+    driver.create_function("to_minor", 1, _to_minor_or_null, deterministic=True)
+    for table, columns in MONEY_COLUMNS.items():
+        assignments = ", ".join(f"{c} = to_minor({c})" for c in columns)
+        conn.exec_driver_sql(f"UPDATE {table} SET {assignments}")
+    _rebuild_table(conn, "budgets", """
+        CREATE TABLE {table} (
+            id VARCHAR NOT NULL,
+            dataset_id VARCHAR NOT NULL,
+            name VARCHAR NOT NULL,
+            total_amount INTEGER NOT NULL,
+            unit VARCHAR,
+            description TEXT,
+            PRIMARY KEY (id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id) ON DELETE CASCADE
+        )
+    """, "1", """
+        CREATE INDEX ix_budgets_dataset_id_id ON budgets (dataset_id, id);
+        CREATE INDEX ix_budgets_dataset_name ON budgets (dataset_id, name);
+    """)
+    _rebuild_table(conn, "purchases", """
+        CREATE TABLE {table} (
+            id INTEGER NOT NULL,
+            dataset_id VARCHAR NOT NULL,
+            member_name VARCHAR,
+            category VARCHAR,
+            item_name VARCHAR NOT NULL,
+            amount INTEGER NOT NULL,
+            unit VARCHAR,
+            status VARCHAR,
+            priority INTEGER,
+            note TEXT,
+            PRIMARY KEY (id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id) ON DELETE CASCADE
+        )
+    """, "1", """
+        CREATE INDEX ix_purchases_id ON purchases (id);
+        CREATE INDEX ix_purchases_dataset_status_category ON purchases (dataset_id, status, category);
+        CREATE INDEX ix_purchases_dataset_id ON purchases (dataset_id);
+        CREATE INDEX ix_purchases_dataset_amount ON purchases (dataset_id, amount);
+        CREATE INDEX ix_purchases_dataset_priority ON purchases (dataset_id, priority);
+        CREATE INDEX ix_purchases_dataset_category ON purchases (dataset_id, category);
+    """)
+    _rebuild_table(conn, "budget_assignments", """
+        CREATE TABLE {table} (
+            id INTEGER NOT NULL,
+            purchase_id INTEGER NOT NULL,
+            budget_id VARCHAR NOT NULL,
+            amount INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(purchase_id) REFERENCES purchases (id) ON DELETE CASCADE,
+            FOREIGN KEY(budget_id) REFERENCES budgets (id) ON DELETE CASCADE
+        )
+    """, "1", """
+        CREATE INDEX ix_budget_assignments_id ON budget_assignments (id);
+        CREATE INDEX ix_budget_assignments_budget_purchase ON budget_assignments (budget_id, purchase_id);
+        CREATE INDEX ix_budget_assignments_purchase_id ON budget_assignments (purchase_id);
+    """)
+    _rebuild_table(conn, "actual_expenses", """
+        CREATE TABLE {table} (
+            id INTEGER NOT NULL,
+            budget_id VARCHAR NOT NULL,
+            item_name VARCHAR,
+            amount INTEGER NOT NULL,
+            unit VARCHAR,
+            PRIMARY KEY (id),
+            FOREIGN KEY(budget_id) REFERENCES budgets (id) ON DELETE CASCADE
+        )
+    """, "1", """
+        CREATE INDEX ix_actual_expenses_id ON actual_expenses (id);
+        CREATE INDEX ix_actual_expenses_budget_id ON actual_expenses (budget_id);
+        CREATE INDEX ix_actual_expenses_budget_amount ON actual_expenses (budget_id, amount);
+    """)
+    _rebuild_table(conn, "dataset_rollups", """
+        CREATE TABLE {table} (
+            dataset_id VARCHAR NOT NULL,
+            fixed_cost_planned_total INTEGER NOT NULL,
+            travel_planned_total INTEGER NOT NULL,
+            other_planned_total INTEGER NOT NULL,
+            unassigned_planned_total INTEGER NOT NULL,
+            fixed_cost_total INTEGER NOT NULL,
+            travel_cost_total INTEGER NOT NULL,
+            PRIMARY KEY (dataset_id),
+            FOREIGN KEY(dataset_id) REFERENCES datasets (id) ON DELETE CASCADE
+        )
+    """, "1")
+    _rebuild_table(conn, "budget_rollups", """
+        CREATE TABLE {table} (
+            budget_id VARCHAR NOT NULL,
+            actual_total INTEGER NOT NULL,
+            planned_total INTEGER NOT NULL,
+            PRIMARY KEY (budget_id),
+            FOREIGN KEY(budget_id) REFERENCES budgets (id) ON DELETE CASCADE
+        )
+    """, "1")
+    # 全文検索の索引は同じ rowid の行を参照し続けるため、作り直した元のテーブルにトリガーだけを付け直します
+    _create_search_triggers(conn)
+
+
+# --- 実行 ---
+
+def _ensure_version_table(conn: Connection) -> None:
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER NOT NULL PRIMARY KEY, name VARCHAR NOT NULL, applied_at DATETIME NOT NULL)"
+    )
+
+
+def _applied_versions(conn: Connection) -> Set[int]:
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def current_version(engine: Engine) -> int:
+    with engine.connect() as conn:
+        _ensure_version_table(conn)
+        conn.commit()
+        return max(_applied_versions(conn), default=0)
+
+
+def pending_migrations(engine: Engine) -> List[Migration]:
+    with engine.connect() as conn:
+        _ensure_version_table(conn)
+        conn.commit()
+        applied = _applied_versions(conn)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def _apply(engine: Engine, m: Migration) -> bool:
+    # pysqlite は DDL の前にトランザクションを開始しないため、自動コミットモードで BEGIN を明示します。
+    # IMMEDIATE で書き込みロックを先に取り、複数プロセスの同時起動でも二重に適用されないようにします。
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # PRAGMA foreign_keys はトランザクションの中では変更できないため、BEGIN の前に切り替えます
+        foreign_keys = conn.exec_driver_sql("PRAGMA foreign_keys").scalar()
+        if m.disable_foreign_keys:
+            conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            if m.version in _applied_versions(conn):
+                conn.exec_driver_sql("ROLLBACK")
+                return False
+            m.upgrade(conn)
+            if m.disable_foreign_keys:
+                violations = conn.exec_driver_sql("PRAGMA foreign_key_check").fetchall()
+                if violations:
+                    raise RuntimeError(f"Migration {m.version:04d}_{m.name} left foreign key violations: {violations[:5]}")
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": m.version, "n": m.name, "t": datetime.now(timezone.utc).isoformat(sep=" ")},
+            )
+            conn.exec_driver_sql("COMMIT")
+            return True
+        except BaseException:
+            # SQLite がエラー時に自動でロールバック済みの場合もあります
+            if getattr(conn.connection.driver_connection, "in_transaction", False):
+                conn.exec_driver_sql("ROLLBACK")
+            raise
+        finally:
+            if m.disable_foreign_keys:
+                conn.exec_driver_sql(f"PRAGMA foreign_keys={'ON' if foreign_keys else 'OFF'}")
+
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> List[Migration]:
+    """未適用のマイグレーションを target（省略時は最新）まで順番に適用し、適用したものを返します"""
+    if engine.dialect.name != "sqlite":
+        # マイグレーションは SQLite 向けに記述しています。その他のデータベースでは従来どおり create_all を使用します
+        from .database import Base
+        from . import models  # noqa: F401  (テーブル定義の登録)
+        Base.metadata.create_all(bind=engine)
+        return []
+
+    applied: List[Migration] = []
+    for m in pending_migrations(engine):
+        if target is not None and m.version > target:
+            break
+        if _apply(engine, m):
+            logger.info("Applied migration %04d_%s", m.version, m.name)
+            applied.append(m)
+    return applied
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .database import engine
+
+    parser = argparse.ArgumentParser(prog="python -m osaifill.migrations", description="Manage the database schema version")
+    parser.add_argument("command", choices=["status", "upgrade"])
+    parser.add_argument("--target", type=int, help="Upgrade only up to this version")
+    args = parser.parse_args(argv)
+
+    if args.command == "upgrade":
+        for m in upgrade(engine, args.target):
+            print(f"applied {m.version:04d}_{m.name}")
+
+    pending = {m.version for m in pending_migrations(engine)}
+    for m in MIGRATIONS:
+        print(f"{m.version:04d}_{m.name}: {'pending' if m.version in pending else 'applied'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
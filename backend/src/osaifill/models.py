@@ -1,23 +1,28 @@
 import uuid
-from sqlalchemy import Column, String, Float, ForeignKey, Text, Integer, DateTime
+from sqlalchemy import JSON, Boolean, Column, String, ForeignKey, Text, Integer, DateTime, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from .database import Base
+from .money import Money
 
 class Dataset(Base):
     __tablename__ = "datasets"
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String, nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    # 書き込みのコミットごとに増えるバージョン番号（versions.py を参照）
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     
-    members = relationship("Member", back_populates="dataset", cascade="all, delete-orphan")
-    budgets = relationship("Budget", back_populates="dataset", cascade="all, delete-orphan")
-    purchases = relationship("Purchase", back_populates="dataset", cascade="all, delete-orphan")
-    purchase_import_setting = relationship("PurchaseImportSetting", back_populates="dataset", uselist=False, cascade="all, delete-orphan")
+    # 子の行はデータベースの ON DELETE CASCADE で削除します（passive_deletes で ORM は子を読み込みません）
+    members = relationship("Member", back_populates="dataset", cascade="all, delete-orphan", passive_deletes=True)
+    budgets = relationship("Budget", back_populates="dataset", cascade="all, delete-orphan", passive_deletes=True)
+    purchases = relationship("Purchase", back_populates="dataset", cascade="all, delete-orphan", passive_deletes=True)
+    purchase_import_setting = relationship("PurchaseImportSetting", back_populates="dataset", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+    rollup = relationship("DatasetRollup", back_populates="dataset", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
 
 class PurchaseImportSetting(Base):
     __tablename__ = "purchase_import_settings"
-    dataset_id = Column(String, ForeignKey("datasets.id"), primary_key=True)
+    dataset_id = Column(String, ForeignKey("datasets.id", ondelete="CASCADE"), primary_key=True)
     mapping_json = Column(Text) # 列名マッピング保存用
     
     dataset = relationship("Dataset", back_populates="purchase_import_setting")
@@ -25,64 +30,135 @@ class PurchaseImportSetting(Base):
 class Member(Base):
     __tablename__ = "members"
     id = Column(Integer, primary_key=True, index=True)
-    dataset_id = Column(String, ForeignKey("datasets.id"), nullable=False)
+    dataset_id = Column(String, ForeignKey("datasets.id", ondelete="CASCADE"), nullable=False, index=True)
     name = Column(String, nullable=False)
     
     dataset = relationship("Dataset", back_populates="members")
 
 class Budget(Base):
     __tablename__ = "budgets"
+    __table_args__ = (
+        # 一覧の並び順 (id / name) に対応
+        Index("ix_budgets_dataset_id_id", "dataset_id", "id"),
+        Index("ix_budgets_dataset_name", "dataset_id", "name"),
+    )
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    dataset_id = Column(String, ForeignKey("datasets.id"), nullable=False)
+    dataset_id = Column(String, ForeignKey("datasets.id", ondelete="CASCADE"), nullable=False)
     name = Column(String, nullable=False)
-    total_amount = Column(Float, nullable=False)
+    total_amount = Column(Money, nullable=False) # 金額は 1/100 単位の整数で保存します（money.py）
     unit = Column(String, default="JPY")
     description = Column(Text)
     
     dataset = relationship("Dataset", back_populates="budgets")
-    assignments = relationship("BudgetAssignment", back_populates="budget", cascade="all, delete-orphan")
-    actual_expenses = relationship("ActualExpense", back_populates="budget", cascade="all, delete-orphan")
-    import_setting = relationship("ImportSetting", back_populates="budget", uselist=False, cascade="all, delete-orphan")
+    assignments = relationship("BudgetAssignment", back_populates="budget", cascade="all, delete-orphan", passive_deletes=True)
+    actual_expenses = relationship("ActualExpense", back_populates="budget", cascade="all, delete-orphan", passive_deletes=True)
+    import_setting = relationship("ImportSetting", back_populates="budget", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+    rollup = relationship("BudgetRollup", back_populates="budget", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
 
 class Purchase(Base):
     __tablename__ = "purchases"
+    __table_args__ = (
+        # 一覧・ダッシュボードの絞り込み (dataset_id, status, category) に対応
+        Index("ix_purchases_dataset_status_category", "dataset_id", "status", "category"),
+        # 一覧の並び順 (id / amount / priority / category) に対応（末尾の rowid が id の順になります）
+        Index("ix_purchases_dataset_id", "dataset_id"),
+        Index("ix_purchases_dataset_amount", "dataset_id", "amount"),
+        Index("ix_purchases_dataset_priority", "dataset_id", "priority"),
+        Index("ix_purchases_dataset_category", "dataset_id", "category"),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    dataset_id = Column(String, ForeignKey("datasets.id"), nullable=False)
+    dataset_id = Column(String, ForeignKey("datasets.id", ondelete="CASCADE"), nullable=False)
     member_name = Column(String)
     category = Column(String) # 固定費, 旅費, その他
     item_name = Column(String, nullable=False)
-    amount = Column(Float, nullable=False)
+    amount = Column(Money, nullable=False)
     unit = Column(String, default="JPY")
     status = Column(String) # 書いただけ, 見積済み, 買い物中, 購入済み, 保留
     priority = Column(Integer, default=3)
     note = Column(Text)
     
     dataset = relationship("Dataset", back_populates="purchases")
-    assignments = relationship("BudgetAssignment", back_populates="purchase", cascade="all, delete-orphan")
+    assignments = relationship("BudgetAssignment", back_populates="purchase", cascade="all, delete-orphan", passive_deletes=True)
 
 class BudgetAssignment(Base):
     __tablename__ = "budget_assignments"
+    __table_args__ = (
+        Index("ix_budget_assignments_budget_purchase", "budget_id", "purchase_id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    purchase_id = Column(Integer, ForeignKey("purchases.id"), nullable=False)
-    budget_id = Column(String, ForeignKey("budgets.id"), nullable=False)
-    amount = Column(Float, nullable=False)
+    purchase_id = Column(Integer, ForeignKey("purchases.id", ondelete="CASCADE"), nullable=False, index=True)
+    budget_id = Column(String, ForeignKey("budgets.id", ondelete="CASCADE"), nullable=False)
+    amount = Column(Money, nullable=False)
     
     purchase = relationship("Purchase", back_populates="assignments")
     budget = relationship("Budget", back_populates="assignments")
 
 class ActualExpense(Base):
     __tablename__ = "actual_expenses"
+    __table_args__ = (
+        Index("ix_actual_expenses_budget_amount", "budget_id", "amount"),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    budget_id = Column(String, ForeignKey("budgets.id"), nullable=False)
+    budget_id = Column(String, ForeignKey("budgets.id", ondelete="CASCADE"), nullable=False, index=True)
     item_name = Column(String)
-    amount = Column(Float, nullable=False)
+    amount = Column(Money, nullable=False)
     unit = Column(String, default="JPY")
     
     budget = relationship("Budget", back_populates="actual_expenses")
 
 class ImportSetting(Base):
     __tablename__ = "import_settings"
-    budget_id = Column(String, ForeignKey("budgets.id"), primary_key=True)
+    budget_id = Column(String, ForeignKey("budgets.id", ondelete="CASCADE"), primary_key=True)
     mapping_json = Column(Text) # 列名マッピング保存用
     
     budget = relationship("Budget", back_populates="import_setting")
+
+class DatasetRollup(Base):
+    """ダッシュボード用のデータセット単位の集計値（書き込みと同じトランザクションで更新）"""
+    __tablename__ = "dataset_rollups"
+    dataset_id = Column(String, ForeignKey("datasets.id", ondelete="CASCADE"), primary_key=True)
+    fixed_cost_planned_total = Column(Money, nullable=False, default=0)
+    travel_planned_total = Column(Money, nullable=False, default=0)
+    other_planned_total = Column(Money, nullable=False, default=0)
+    unassigned_planned_total = Column(Money, nullable=False, default=0)
+    fixed_cost_total = Column(Money, nullable=False, default=0)
+    travel_cost_total = Column(Money, nullable=False, default=0)
+
+    dataset = relationship("Dataset", back_populates="rollup")
+
+class BudgetRollup(Base):
+    """ダッシュボード用の予算単位の集計値（書き込みと同じトランザクションで更新）"""
+    __tablename__ = "budget_rollups"
+    budget_id = Column(String, ForeignKey("budgets.id", ondelete="CASCADE"), primary_key=True)
+    actual_total = Column(Money, nullable=False, default=0)
+    planned_total = Column(Money, nullable=False, default=0)
+
+    budget = relationship("Budget", back_populates="rollup")
+
+class ImportJob(Base):
+    """バックグラウンドで実行する CSV インポートの状態と進捗（jobs.py を参照）"""
+    __tablename__ = "import_jobs"
+    __table_args__ = (
+        Index("ix_import_jobs_dataset_created", "dataset_id", "created_at"),
+    )
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    # ジョブの記録はデータセットの削除後も残すため、外部キーにはしません
+    dataset_id = Column(String, nullable=False)
+    budget_id = Column(String)
+    kind = Column(String, nullable=False) # purchases, actual_expenses
+    status = Column(String, nullable=False, default="queued") # queued, running, succeeded, failed, cancelled
+    overwrite = Column(Boolean, nullable=False, default=False)
+    mapping_json = Column(Text, nullable=False)
+    file_path = Column(String)
+    rows_processed = Column(Integer, nullable=False, default=0)
+    inserted = Column(Integer, nullable=False, default=0)
+    skipped = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    errors = Column(JSON, nullable=False, default=list)
+    message = Column(Text)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    # ジョブを受け付けて実行するプロセス（"ホスト名:プロセスID"）
+    worker = Column(String)
@@ -0,0 +1,50 @@
+"""金額の固定小数点表現
+
+金額の列は 1/100 単位（SCALE）の整数でデータベースに保存し、Python 側と API では従来どおり
+小数の金額として扱います。SUM や差し引きはデータベースの整数演算で行うため、件数が増えても
+浮動小数点の丸め誤差が積み重なりません。
+
+集計の途中で最小単位の整数のまま計算したい場合は minor() で列や式を整数として扱います::
+
+    db.query(func.sum(money.minor(models.Purchase.amount)))  # 最小単位の整数の合計
+"""
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Optional
+
+from sqlalchemy import Integer, type_coerce
+from sqlalchemy.types import TypeDecorator
+
+# 1 単位あたりの最小単位の数（小数第 2 位まで保持します）
+SCALE = 100
+# API やインポートで受け付ける金額の絶対値の上限
+# 最小単位の整数が SQLite の INTEGER（64 ビット）に余裕を持って収まり、多くの行を合計しても溢れない大きさです
+MAX_AMOUNT = 10 ** 12
+
+
+def to_minor(value: Any) -> int:
+    """金額を最小単位の整数に変換します（第 3 位以下は四捨五入します）"""
+    if isinstance(value, int):
+        return value * SCALE
+    # float は表示どおりの 10 進数として扱います（0.1 * 100 が 10.000000000000002 にならないように）
+    return int((Decimal(str(value)) * SCALE).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(value: int) -> float:
+    return value / SCALE
+
+
+class Money(TypeDecorator):
+    """最小単位の整数で保存し、小数の金額として読み書きする列の型"""
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value: Any, dialect: Any) -> Optional[int]:
+        return None if value is None else to_minor(value)
+
+    def process_result_value(self, value: Any, dialect: Any) -> Optional[float]:
+        return None if value is None else from_minor(value)
+
+
+def minor(expr: Any) -> Any:
+    """金額の列・式を最小単位の整数のまま扱う式を返します（結果も変換しません）"""
+    return type_coerce(expr, Integer)
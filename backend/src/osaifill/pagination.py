@@ -0,0 +1,88 @@
+"""一覧 API のキーセット（カーソル）ページネーション
+
+ORDER BY <ソート列>, id の並びで limit + 1 件を読み、続きがあれば最後の行の (ソート列の値, id) を
+カーソルとして返します。OFFSET を使わないため、何ページ目でも読み出す行数はページサイズ分だけです。
+ソート列にはインデックスのある列を指定してください（SQLite のインデックスは末尾に rowid = id を含みます）。
+"""
+import base64
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Generic, List, Optional, Tuple, TypeVar, cast
+
+from sqlalchemy import ColumnElement, and_, or_
+from sqlalchemy.orm import Query
+
+T = TypeVar("T")
+
+
+class InvalidCursorError(ValueError):
+    """カーソルの形式が不正な場合のエラー"""
+
+
+@dataclass
+class Page(Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
+
+
+def encode_cursor(value: Any, last_id: Any) -> str:
+    raw = json.dumps([value, last_id], ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, last_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError("Invalid cursor") from e
+    return value, last_id
+
+
+def _after(sort_column: ColumnElement[Any], id_column: ColumnElement[Any], value: Any, last_id: Any, descending: bool) -> ColumnElement[bool]:
+    # SQLite では NULL は昇順で先頭、降順で末尾に並ぶため、NULL の位置も含めて「この行より後」を表します
+    if value is None:
+        if descending:
+            return and_(sort_column.is_(None), id_column < last_id)
+        return or_(and_(sort_column.is_(None), id_column > last_id), sort_column.is_not(None))
+    if descending:
+        return or_(sort_column < value, and_(sort_column == value, id_column < last_id), sort_column.is_(None))
+    return or_(sort_column > value, and_(sort_column == value, id_column > last_id))
+
+
+def keyset_page(
+    query: "Query[Any]",
+    sort_column: ColumnElement[Any],
+    id_column: ColumnElement[Any],
+    descending: bool = False,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    cursor_values: Optional[Callable[[Any], Tuple[Any, Any]]] = None,
+) -> "Page[Any]":
+    """query を (sort_column, id_column) の順に並べ、cursor の続きから最大 limit 件を返します
+
+    limit を省略した場合は従来どおり一致するすべての行を返します。
+    行が (エンティティ, 式の値) のような組の場合は、cursor_values で行から (ソート値, id) を取り出してください。
+    """
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        query = query.filter(_after(sort_column, id_column, value, last_id, descending))
+
+    if sort_column is id_column:
+        order_by = [id_column.desc() if descending else id_column.asc()]
+    else:
+        order_by = [c.desc() if descending else c.asc() for c in (sort_column, id_column)]
+    query = query.order_by(*order_by)
+
+    if limit is None:
+        return Page(query.all())
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return Page(rows)
+    last = rows[limit - 1]
+    if cursor_values:
+        value, last_id = cursor_values(last)
+    else:
+        value, last_id = getattr(last, cast(str, sort_column.key)), getattr(last, cast(str, id_column.key))
+    return Page(rows[:limit], encode_cursor(value, last_id))
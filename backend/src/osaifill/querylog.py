@@ -0,0 +1,144 @@
+"""開発・テスト用の SQL 記録（N+1 の検出とクエリ数の上限）
+
+QUERY_LOG=1 で起動すると、リクエストごとに実行した SQL をすべて記録し、パラメーターだけが違う
+同じ文が QUERY_REPEAT_THRESHOLD 回以上実行されたリクエストを N+1 の疑いとしてログに警告します。
+レスポンスには X-Query-Count（実行した文の数）を付けます。
+
+テストでは capture() や assert_max_queries() で、ブロックの中で実行された文を数えられます
+（TestClient はリクエストを別スレッドで処理するため、capture() はスレッドを問わず記録します）。
+"""
+import logging
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUERY_LOG = os.getenv("QUERY_LOG", "").lower() in ("1", "true", "yes")
+# パラメーターだけが違う同じ文をこの回数以上実行したら N+1 の疑いとします
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Query:
+    statement: str
+    parameters: Any
+
+
+@dataclass
+class QueryLog:
+    queries: List[Query] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, statement: str, parameters: Any) -> None:
+        with self._lock:
+            self.queries.append(Query(statement, parameters))
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    def repeated(self, threshold: int = QUERY_REPEAT_THRESHOLD) -> List[Tuple[str, int]]:
+        """threshold 回以上実行された文と回数を、回数の多い順に返します"""
+        counts = Counter(q.statement for q in self.queries)
+        return [(s, n) for s, n in counts.most_common() if n >= threshold]
+
+    def report(self) -> str:
+        return "\n".join(f"[{i}] {' '.join(q.statement.split())}" for i, q in enumerate(self.queries, start=1))
+
+
+class QueryBudgetExceeded(AssertionError):
+    """ブロックの中で実行した文の数が上限を超えた、または同じ文を繰り返し実行した場合のエラー"""
+
+
+# リクエスト単位の記録（QUERY_LOG=1 のときのミドルウェアが設定します）と、capture() の記録
+_request_log: ContextVar[Optional[QueryLog]] = ContextVar("osaifill_query_log", default=None)
+_captures: List[QueryLog] = []
+_captures_lock = threading.Lock()
+_installed = False
+
+
+def _before_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+    request_log = _request_log.get()
+    if request_log is not None:
+        request_log.add(statement, parameters)
+    if _captures:
+        with _captures_lock:
+            logs = list(_captures)
+        for log in logs:
+            log.add(statement, parameters)
+
+
+def install() -> None:
+    """すべてのエンジンで実行した SQL を記録できるようにします"""
+    global _installed
+    with _captures_lock:
+        if not _installed:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            _installed = True
+
+
+@contextmanager
+def capture() -> Iterator[QueryLog]:
+    """ブロックの中で（どのスレッドからでも）実行された SQL を記録します"""
+    install()
+    log = QueryLog()
+    with _captures_lock:
+        _captures.append(log)
+    try:
+        yield log
+    finally:
+        with _captures_lock:
+            _captures.remove(log)
+
+
+@contextmanager
+def assert_max_queries(limit: int, repeat_threshold: Optional[int] = QUERY_REPEAT_THRESHOLD) -> Iterator[QueryLog]:
+    """ブロックの中の SQL が limit 件を超えるか、同じ文を repeat_threshold 回以上実行したら QueryBudgetExceeded"""
+    with capture() as log:
+        yield log
+    if log.count > limit:
+        raise QueryBudgetExceeded(f"{log.count} queries executed, expected at most {limit}:\n{log.report()}")
+    repeated = log.repeated(repeat_threshold) if repeat_threshold else []
+    if repeated:
+        statement, n = repeated[0]
+        raise QueryBudgetExceeded(f"Statement executed {n} times (possible N+1): {' '.join(statement.split())}")
+
+
+class QueryLogMiddleware:
+    """リクエストごとに SQL を記録し、N+1 の疑いを警告して X-Query-Count を付けます"""
+
+    def __init__(self, app: Callable[..., Awaitable[None]], repeat_threshold: int = QUERY_REPEAT_THRESHOLD) -> None:
+        self.app = app
+        self.repeat_threshold = repeat_threshold
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable[[], Awaitable[Any]], send: Callable[[Any], Awaitable[None]]) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        log = QueryLog()
+        token = _request_log.set(log)
+
+        async def send_with_count(message: Any) -> None:
+            if message["type"] == "http.response.start":
+                # ストリーミングのレスポンスでは、本文を送る前までの文の数になります
+                message["headers"] = list(message.get("headers", [])) + [(b"x-query-count", str(log.count).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_count)
+        finally:
+            _request_log.reset(token)
+            for statement, n in log.repeated(self.repeat_threshold):
+                logger.warning(
+                    "%s %s executed the same statement %d times (possible N+1): %s",
+                    scope["method"], scope["path"], n, " ".join(statement.split()),
+                )
@@ -0,0 +1,351 @@
+"""ダッシュボード用集計値（ロールアップ）の計算・差分更新・再構築
+
+予算ごとの実績・予定額（budget_rollups）と、データセットごとのカテゴリー別予定額や
+未割当額（dataset_rollups）を保持します。crud.py の書き込み処理は同じトランザクション内で
+ここにある関数を呼び出して差分を反映するため、ダッシュボードの読み取りは予算数にのみ比例します。
+集計と差分の加算はすべて最小単位の整数（money.py）で行うため、保存値と再計算結果は完全に一致します。
+
+ずれが疑われる場合は次のコマンドで検証・再構築できます::
+
+    python -m osaifill.rollup verify [--dataset-id ID] [--fix]
+    python -m osaifill.rollup rebuild [--dataset-id ID]
+"""
+import argparse
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple, cast
+
+from sqlalchemy import ColumnElement, and_, case, func, or_, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal
+from .money import from_minor, minor, to_minor
+
+# 運用思想：ステータスが「書いただけ」「見積済み」のものを純粋な「予定」とみなします
+PLANNED_STATUSES = ["書いただけ", "見積済み"]
+NOT_PURCHASING_STATUS = "購入しない"
+FIXED_COST_CATEGORY = "固定費"
+TRAVEL_CATEGORY = "旅費"
+
+DATASET_FIELDS = (
+    "fixed_cost_planned_total",
+    "travel_planned_total",
+    "other_planned_total",
+    "unassigned_planned_total",
+    "fixed_cost_total",
+    "travel_cost_total",
+)
+
+
+@dataclass
+class Contribution:
+    """購入アイテム群がロールアップに与える寄与（データセット別・予算別、最小単位の整数）"""
+    datasets: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    budgets: Dict[str, int] = field(default_factory=dict)  # 予算別の予定額
+
+    def __sub__(self, other: "Contribution") -> "Contribution":
+        datasets: Dict[str, Dict[str, int]] = {}
+        for dataset_id in set(self.datasets) | set(other.datasets):
+            mine = self.datasets.get(dataset_id, {})
+            theirs = other.datasets.get(dataset_id, {})
+            datasets[dataset_id] = {f: mine.get(f, 0) - theirs.get(f, 0) for f in DATASET_FIELDS}
+        budgets = {
+            budget_id: self.budgets.get(budget_id, 0) - other.budgets.get(budget_id, 0)
+            for budget_id in set(self.budgets) | set(other.budgets)
+        }
+        return Contribution(datasets=datasets, budgets=budgets)
+
+
+def _sum_if(condition: Any, value: Any) -> Any:
+    """条件に一致する行だけを合計する集計式（一致なしは 0）"""
+    return func.coalesce(func.sum(case((condition, value), else_=0)), 0)
+
+
+def is_planned() -> Any:
+    return models.Purchase.status.in_(PLANNED_STATUSES)
+
+
+def is_purchasing() -> Any:
+    # NULL のステータスは「購入しない」以外として扱います
+    return or_(models.Purchase.status.is_(None), models.Purchase.status != NOT_PURCHASING_STATUS)
+
+
+def is_travel() -> Any:
+    return models.Purchase.category == TRAVEL_CATEGORY
+
+
+def purchase_contribution(db: Session, purchase_filter: Any, assignment_filter: Any = None) -> Contribution:
+    """purchase_filter に一致する購入アイテムの寄与を集計クエリで求めます
+
+    assignment_filter を指定すると、その条件に一致する割当だけが存在するものとして計算します。
+    """
+    asgn_conditions = [purchase_filter]
+    if assignment_filter is not None:
+        asgn_conditions.append(assignment_filter)
+
+    # 購入アイテムごとの割当済み合計（未割当額の算出用）
+    purchase_id: ColumnElement[int] = models.BudgetAssignment.purchase_id
+    assigned = (
+        select(
+            purchase_id.label("purchase_id"),
+            func.sum(minor(models.BudgetAssignment.amount)).label("assigned_total"),
+        )
+        .join(models.Purchase, models.Purchase.id == purchase_id)
+        .where(*asgn_conditions)
+        .group_by(purchase_id)
+        .subquery()
+    )
+    amount = minor(models.Purchase.amount)
+    unassigned_amount = amount - func.coalesce(assigned.c.assigned_total, 0)
+
+    # NULL のカテゴリーは「その他」として扱います
+    category: ColumnElement[Optional[str]] = models.Purchase.category
+    is_fixed = category == FIXED_COST_CATEGORY
+    is_other = or_(category.is_(None), category.notin_([FIXED_COST_CATEGORY, TRAVEL_CATEGORY]))
+
+    rows = (
+        db.query(
+            models.Purchase.dataset_id,
+            # 各カテゴリー別の予定額計算（未払分のみ）
+            _sum_if(and_(is_fixed, is_planned()), amount),
+            _sum_if(and_(is_travel(), is_planned()), amount),
+            _sum_if(and_(is_other, is_planned()), amount),
+            # 未割当の予定額計算
+            _sum_if(and_(is_planned(), unassigned_amount > 0), unassigned_amount),
+            # 固定費・旅費分析用の総額（ステータスに関わらず、ただし「購入しない」は除外）
+            _sum_if(and_(is_fixed, is_purchasing()), amount),
+            _sum_if(and_(is_travel(), is_purchasing()), amount),
+        )
+        .outerjoin(assigned, assigned.c.purchase_id == models.Purchase.id)
+        .filter(purchase_filter)
+        .group_by(models.Purchase.dataset_id)
+        .all()
+    )
+    datasets = {
+        row[0]: dict(zip(DATASET_FIELDS, row[1:]))
+        for row in rows
+    }
+
+    # 予算別の予定額（未払の予定のみを抽出）
+    budgets = dict(
+        db.query(models.BudgetAssignment.budget_id, func.sum(minor(models.BudgetAssignment.amount)))
+        .join(models.Purchase, models.Purchase.id == models.BudgetAssignment.purchase_id)
+        .filter(*asgn_conditions, is_planned())
+        .group_by(models.BudgetAssignment.budget_id)
+        .all()
+    )
+    return Contribution(datasets=datasets, budgets=budgets)
+
+
+def apply_contribution(db: Session, delta: Contribution) -> None:
+    """寄与の差分をロールアップ行に加算します（行が未作成の場合は再構築時に補完されます）"""
+    for dataset_id, values in delta.datasets.items():
+        changes = {
+            getattr(models.DatasetRollup, f): minor(getattr(models.DatasetRollup, f)) + v
+            for f, v in values.items()
+            if v
+        }
+        if changes:
+            db.query(models.DatasetRollup).filter(models.DatasetRollup.dataset_id == dataset_id).update(changes)
+    for budget_id, planned in delta.budgets.items():
+        if planned:
+            add_budget_totals(db, budget_id, planned=planned)
+
+
+def add_purchases(db: Session, purchase_filter: Any) -> None:
+    """新規に追加された購入アイテムの寄与を加算します"""
+    db.flush()
+    apply_contribution(db, purchase_contribution(db, purchase_filter))
+
+
+@contextmanager
+def track_purchases(db: Session, purchase_filter: Any) -> Iterator[None]:
+    """ブロック内での購入アイテム（と割当）の変更前後の差分をロールアップへ反映します"""
+    db.flush()
+    before = purchase_contribution(db, purchase_filter)
+    yield
+    db.flush()
+    after = purchase_contribution(db, purchase_filter)
+    apply_contribution(db, after - before)
+
+
+def add_budget_totals(db: Session, budget_id: str, actual: int = 0, planned: int = 0) -> None:
+    """予算の実績・予定額に最小単位の整数の差分を加算します"""
+    changes: Dict[Any, Any] = {}
+    if actual:
+        changes[models.BudgetRollup.actual_total] = minor(models.BudgetRollup.actual_total) + actual
+    if planned:
+        changes[models.BudgetRollup.planned_total] = minor(models.BudgetRollup.planned_total) + planned
+    if changes:
+        db.query(models.BudgetRollup).filter(models.BudgetRollup.budget_id == budget_id).update(changes)
+
+
+def refresh_budget_actual(db: Session, budget_id: str) -> None:
+    """予算の実績額を実績の行からデータベース上で合計し直します（一括インポート後に使います）"""
+    db.flush()
+    spent = (
+        select(func.coalesce(func.sum(minor(models.ActualExpense.amount)), 0))
+        .where(models.ActualExpense.budget_id == budget_id)
+        .scalar_subquery()
+    )
+    db.query(models.BudgetRollup).filter(models.BudgetRollup.budget_id == budget_id).update(
+        {models.BudgetRollup.actual_total: spent}, synchronize_session=False
+    )
+
+
+# --- 再構築・検証 ---
+def compute_dataset_totals(db: Session, dataset_id: str) -> Dict[str, int]:
+    contribution = purchase_contribution(db, models.Purchase.dataset_id == dataset_id)
+    return contribution.datasets.get(dataset_id, {f: 0 for f in DATASET_FIELDS})
+
+
+def compute_budget_totals(db: Session, dataset_id: str) -> Dict[str, Dict[str, int]]:
+    rows: List[Tuple[str]] = db.query(models.Budget.id).filter(models.Budget.dataset_id == dataset_id).all()
+    budget_ids = [b_id for (b_id,) in rows]
+
+    # 予算別の実績支払額（CSV等からインポートされた確定支出）
+    actual_by_budget: Dict[str, int] = dict(
+        db.query(models.ActualExpense.budget_id, func.sum(minor(models.ActualExpense.amount)))
+        .join(models.Budget, models.Budget.id == models.ActualExpense.budget_id)
+        .filter(models.Budget.dataset_id == dataset_id)
+        .group_by(models.ActualExpense.budget_id)
+        .all()
+    )
+    # 予算別の予定額（未払の予定のみを抽出）
+    planned_by_budget: Dict[str, int] = dict(
+        db.query(models.BudgetAssignment.budget_id, func.sum(minor(models.BudgetAssignment.amount)))
+        .join(models.Budget, models.Budget.id == models.BudgetAssignment.budget_id)
+        .join(models.Purchase, models.Purchase.id == models.BudgetAssignment.purchase_id)
+        .filter(models.Budget.dataset_id == dataset_id, is_planned())
+        .group_by(models.BudgetAssignment.budget_id)
+        .all()
+    )
+    return {
+        b_id: {
+            "actual_total": actual_by_budget.get(b_id) or 0,
+            "planned_total": planned_by_budget.get(b_id) or 0,
+        }
+        for b_id in budget_ids
+    }
+
+
+def rebuild_dataset(db: Session, dataset_id: str) -> None:
+    """データセットのロールアップを実データから作り直します（コミットは呼び出し側で行います）"""
+    db.flush()
+    totals = {f: from_minor(v) for f, v in compute_dataset_totals(db, dataset_id).items()}
+    db.merge(models.DatasetRollup(dataset_id=dataset_id, **totals))
+    for budget_id, budget_totals in compute_budget_totals(db, dataset_id).items():
+        db.merge(models.BudgetRollup(budget_id=budget_id, **{f: from_minor(v) for f, v in budget_totals.items()}))
+    db.flush()
+
+
+def ensure_dataset(db: Session, dataset_id: str) -> Optional[models.DatasetRollup]:
+    """ロールアップ行が欠けている（旧バージョンで作成された）データセットを再構築して返します"""
+    ds_rollup = db.get(models.DatasetRollup, dataset_id)
+    rollup_budget_id: ColumnElement[Optional[str]] = models.BudgetRollup.budget_id
+    missing_budget = (
+        db.query(models.Budget.id)
+        .outerjoin(models.BudgetRollup, rollup_budget_id == models.Budget.id)
+        .filter(models.Budget.dataset_id == dataset_id, rollup_budget_id.is_(None))
+        .first()
+    )
+    if ds_rollup is not None and missing_budget is None:
+        return ds_rollup
+
+    if db.get(models.Dataset, dataset_id) is None:
+        return None
+    rebuild_dataset(db, dataset_id)
+    db.commit()
+    return db.get(models.DatasetRollup, dataset_id)
+
+
+@dataclass
+class Drift:
+    dataset_id: str
+    budget_id: Optional[str]
+    field: str
+    stored: Optional[float]
+    expected: float
+
+    def __str__(self) -> str:
+        target = f"budget {self.budget_id}" if self.budget_id else "dataset"
+        return f"[{self.dataset_id}] {target} {self.field}: stored={self.stored} expected={self.expected}"
+
+
+def _drifted(stored: Optional[float], expected: int) -> bool:
+    # 保存値も最小単位の整数のため、完全に一致しないものはずれとして扱います
+    return stored is None or to_minor(stored) != expected
+
+
+def verify_dataset(db: Session, dataset_id: str) -> List[Drift]:
+    """保存されているロールアップと実データからの再計算結果を比較し、ずれを返します"""
+    drifts: List[Drift] = []
+
+    ds_rollup = db.get(models.DatasetRollup, dataset_id)
+    for f, expected in compute_dataset_totals(db, dataset_id).items():
+        stored = getattr(ds_rollup, f) if ds_rollup is not None else None
+        if _drifted(stored, expected):
+            drifts.append(Drift(dataset_id, None, f, stored, from_minor(expected)))
+
+    stored_budgets: Dict[str, models.BudgetRollup] = {
+        cast(str, r.budget_id): r
+        for r in db.query(models.BudgetRollup)
+        .join(models.Budget, models.Budget.id == models.BudgetRollup.budget_id)
+        .filter(models.Budget.dataset_id == dataset_id)
+        .all()
+    }
+    for budget_id, totals in compute_budget_totals(db, dataset_id).items():
+        b_rollup = stored_budgets.get(budget_id)
+        for f, expected in totals.items():
+            stored = getattr(b_rollup, f) if b_rollup is not None else None
+            if _drifted(stored, expected):
+                drifts.append(Drift(dataset_id, budget_id, f, stored, from_minor(expected)))
+    return drifts
+
+
+def _dataset_ids(db: Session, dataset_id: Optional[str]) -> List[str]:
+    if dataset_id:
+        return [dataset_id]
+    rows: List[Tuple[str]] = db.query(models.Dataset.id).order_by(models.Dataset.created_at).all()
+    return [ds_id for (ds_id,) in rows]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m osaifill.rollup", description="Verify or rebuild dashboard rollups")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    parser.add_argument("--dataset-id", help="Only process this dataset")
+    parser.add_argument("--fix", action="store_true", help="Rebuild datasets where drift is detected (verify only)")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        drifted: List[Tuple[str, List[Drift]]] = []
+        for ds_id in _dataset_ids(db, args.dataset_id):
+            if args.command == "rebuild":
+                rebuild_dataset(db, ds_id)
+                db.commit()
+                print(f"rebuilt {ds_id}")
+                continue
+            drifts = verify_dataset(db, ds_id)
+            if drifts:
+                drifted.append((ds_id, drifts))
+                for d in drifts:
+                    print(d)
+                if args.fix:
+                    rebuild_dataset(db, ds_id)
+                    db.commit()
+                    print(f"rebuilt {ds_id}")
+
+        if args.command == "verify":
+            print(f"{len(drifted)} dataset(s) with drift")
+            if drifted and not args.fix:
+                return 1
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
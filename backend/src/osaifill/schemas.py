@@ -1,6 +1,11 @@
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, StringConstraints
+from typing import Annotated, List, Literal, Optional, Set
 from datetime import datetime
+from .money import MAX_AMOUNT
+
+
+# 金額の項目（範囲外や inf / NaN は 422 になります）
+Amount = Annotated[float, Field(allow_inf_nan=False, ge=-MAX_AMOUNT, le=MAX_AMOUNT)]
 
 
 # --- Dataset ---
@@ -29,6 +34,8 @@ class DatasetRollover(BaseModel):
     carry_over_budget: bool = True
     carry_over_members: bool = True
     carry_over_settings: bool = True
+    # merged: 余りを「前年度繰越」の一つの予算に合算、per_budget: 予算ごとに同じ名前で引き継ぎます
+    budget_carry_over: Literal["merged", "per_budget"] = "merged"
 
 
 # --- Member ---
@@ -54,7 +61,7 @@ class Member(MemberBase):
 # --- BudgetAssignment ---
 class BudgetAssignmentBase(BaseModel):
     budget_id: str
-    amount: float
+    amount: Amount
 
 
 class BudgetAssignmentCreate(BudgetAssignmentBase):
@@ -73,7 +80,7 @@ class PurchaseBase(BaseModel):
     member_name: Optional[str] = None
     category: Optional[str] = None
     item_name: str
-    amount: float
+    amount: Amount
     unit: Optional[str] = "JPY"
     status: Optional[str] = "書いただけ"
     priority: Optional[int] = 3
@@ -89,7 +96,7 @@ class PurchaseUpdate(BaseModel):
     member_name: Optional[str] = None
     category: Optional[str] = None
     item_name: Optional[str] = None
-    amount: Optional[float] = None
+    amount: Optional[Amount] = None
     unit: Optional[str] = None
     status: Optional[str] = None
     priority: Optional[int] = None
@@ -104,11 +111,43 @@ class Purchase(PurchaseBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class PurchasePatch(BaseModel):
+    """一括更新で全件に同じ値を設定する項目（指定した項目だけを更新します）"""
+    member_name: Optional[str] = None
+    category: Optional[str] = None
+    unit: Optional[str] = None
+    status: Optional[str] = None
+    priority: Optional[int] = None
+    note: Optional[str] = None
+
+
+class PurchaseBatchFilter(BaseModel):
+    """一括更新の対象の条件（空の場合はデータセットのすべての購入アイテム）"""
+    status: List[str] = []
+    category: List[str] = []
+    member_name: Optional[str] = None
+
+
+class PurchaseBatchUpdate(BaseModel):
+    dataset_id: str
+    # ids と filter のどちらか一方で対象を指定します
+    ids: Optional[List[int]] = Field(None, min_length=1)
+    filter: Optional[PurchaseBatchFilter] = None
+    patch: PurchasePatch
+    # true の場合は更新後の購入アイテムも返します
+    return_rows: bool = False
+
+
+class PurchaseBatchResult(BaseModel):
+    updated: int
+    purchases: Optional[List[Purchase]] = None
+
+
 # --- ActualExpense ---
 class ActualExpenseBase(BaseModel):
     budget_id: Optional[str] = None
     item_name: Optional[str] = None
-    amount: float
+    amount: Amount
     unit: Optional[str] = "JPY"
 
 
@@ -149,12 +188,36 @@ class PurchaseImportSetting(PurchaseImportSettingBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+# --- Import Job ---
+ImportJobStatus = Literal["queued", "running", "succeeded", "failed", "cancelled"]
+
+
+class ImportJob(BaseModel):
+    id: str
+    dataset_id: str
+    budget_id: Optional[str] = None
+    kind: Literal["purchases", "actual_expenses"]
+    status: ImportJobStatus
+    overwrite: bool
+    rows_processed: int
+    inserted: int
+    skipped: int
+    failed: int
+    errors: List[str]
+    message: Optional[str] = None
+    cancel_requested: bool
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    model_config = ConfigDict(from_attributes=True)
+
+
 # --- Budget ---
 class BudgetBase(BaseModel):
     id: Optional[str] = None
     dataset_id: Optional[str] = None
     name: str
-    total_amount: float
+    total_amount: Amount
     unit: Optional[str] = "JPY"
     description: Optional[str] = None
 
@@ -165,7 +228,7 @@ class BudgetCreate(BudgetBase):
 
 class BudgetUpdate(BaseModel):
     name: Optional[str] = None
-    total_amount: Optional[float] = None
+    total_amount: Optional[Amount] = None
     unit: Optional[str] = None
     description: Optional[str] = None
 
@@ -175,6 +238,11 @@ class BudgetMerge(BaseModel):
     target_budget_id: str
 
 
+class BudgetMergeMany(BaseModel):
+    source_budget_ids: List[str] = Field(min_length=1)
+    target_budget_id: str
+
+
 class Budget(BudgetBase):
     id: str
     dataset_id: str
@@ -208,3 +276,63 @@ class DashboardSummary(BaseModel):
     travel_cost_total: float
     budgets: List[BudgetSummary]
     travel_items: List[Purchase]
+
+
+# --- List Queries ---
+# 一覧 API で 1 ページに返す最大件数
+MAX_PAGE_SIZE = 500
+
+
+class ListQuery(BaseModel):
+    """一覧 API 共通の並び順とページネーション（limit 省略時は全件）"""
+    order: Literal["asc", "desc"] = "asc"
+    limit: Optional[int] = Field(None, ge=1, le=MAX_PAGE_SIZE)
+    cursor: Optional[str] = None
+
+
+class PurchaseListQuery(ListQuery):
+    dataset_id: str
+    status: List[str] = []
+    category: List[str] = []
+    member_name: Optional[str] = None
+    priority_min: Optional[int] = None
+    priority_max: Optional[int] = None
+    budget_id: Optional[str] = None
+    sort: Literal["id", "amount", "priority", "category"] = "id"
+
+
+BudgetRelation = Literal["assignments", "actual_expenses", "import_setting"]
+BUDGET_RELATIONS: List[BudgetRelation] = ["assignments", "actual_expenses", "import_setting"]
+
+
+class BudgetListQuery(ListQuery):
+    dataset_id: str
+    sort: Literal["id", "name"] = "id"
+    # 埋め込む子要素（lightweight=true の場合は予算本体のみを返します）
+    include: List[BudgetRelation] = BUDGET_RELATIONS
+    lightweight: bool = False
+
+    def included_relations(self) -> Set[str]:
+        return set() if self.lightweight else set(self.include)
+
+
+class ActualExpenseListQuery(ListQuery):
+    sort: Literal["id", "amount"] = "id"
+
+
+# --- Search ---
+# 検索 API で limit を省略した場合の件数
+SEARCH_PAGE_SIZE = 50
+
+
+class SearchQuery(BaseModel):
+    """全文検索の条件（q は空白区切りの語をすべて含むものを、関連度の高い順に返します）"""
+    dataset_id: str
+    # 空白だけの q は、語のない（すべてに一致する）検索にならないよう 422 にします
+    q: Annotated[str, StringConstraints(strip_whitespace=True, min_length=1)]
+    limit: int = Field(SEARCH_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+    cursor: Optional[str] = None
+
+
+class ActualExpenseSearchQuery(SearchQuery):
+    budget_id: Optional[str] = None
@@ -0,0 +1,151 @@
+"""購入アイテムと実績の全文検索（SQLite FTS5）
+
+purchases_fts（item_name / note / member_name）と actual_expenses_fts（item_name）は元のテーブルを
+content に持つ外部コンテンツの FTS5 テーブルで、INSERT / UPDATE / DELETE のトリガーで同期します。
+ORM の書き込み、CSV インポートの一括 INSERT、ON DELETE CASCADE による削除のどれでも索引が追従します。
+
+日本語は単語の区切りがないため、trigram トークナイザーで 3 文字ずつの索引を作り、部分一致
+（前方一致を含む）で検索して bm25 の関連度順に返します。3 文字未満の語は索引を使えないため LIKE で絞り込みます。
+
+既存のデータベースの索引は次のコマンドで作り直せます::
+
+    python -m osaifill.search rebuild
+"""
+import argparse
+import sys
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import DDL, ColumnElement, Select, column, event, literal_column, or_, select, table, text
+from sqlalchemy.orm import Session, selectinload
+
+from . import models, schemas
+from .database import Base, SessionLocal
+from .pagination import Page, keyset_page
+
+# trigram トークナイザーの索引で検索できる語の最小の文字数
+MIN_INDEXED_LENGTH = 3
+
+FTS_TABLES = {
+    "purchases_fts": ("purchases", ("item_name", "note", "member_name")),
+    "actual_expenses_fts": ("actual_expenses", ("item_name",)),
+}
+
+
+def _fts_ddl(fts_name: str, content: str, columns: Sequence[str]) -> List[str]:
+    cols = ", ".join(columns)
+    new_values = ", ".join(f"new.{c}" for c in columns)
+    old_values = ", ".join(f"old.{c}" for c in columns)
+    delete_old = f"INSERT INTO {fts_name}({fts_name}, rowid, {cols}) VALUES ('delete', old.id, {old_values});"
+    insert_new = f"INSERT INTO {fts_name}(rowid, {cols}) VALUES (new.id, {new_values});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_name} USING fts5({cols}, content='{content}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_name}_ai AFTER INSERT ON {content} BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_name}_ad AFTER DELETE ON {content} BEGIN {delete_old} END",
+        # 検索対象の列が変わった場合だけ索引を更新します（ステータスの一括変更などでは動きません）
+        f"CREATE TRIGGER IF NOT EXISTS {fts_name}_au AFTER UPDATE OF {cols} ON {content} BEGIN {delete_old} {insert_new} END",
+    ]
+
+
+# create_all / drop_all（テストのデータベース）でも索引とトリガーを作成・削除します。
+# SQLite のデータベースファイルには migrations.py の同じ定義が適用されます
+for _fts_name, (_content, _columns) in FTS_TABLES.items():
+    for _statement in _fts_ddl(_fts_name, _content, _columns):
+        event.listen(Base.metadata, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+    event.listen(Base.metadata, "before_drop", DDL(f"DROP TABLE IF EXISTS {_fts_name}").execute_if(dialect="sqlite"))
+
+
+def _match_expression(terms: Sequence[str]) -> str:
+    # 各語を FTS5 のフレーズとして引用し、すべてを含む行に一致させます
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _contains(col: Any, term: str) -> Any:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return col.like(f"%{escaped}%", escape="\\")
+
+
+def _search(
+    db: Session,
+    model: Any,
+    fts_name: str,
+    query: Any,
+    q: str,
+    limit: int,
+    cursor: Optional[str],
+) -> Page[Any]:
+    terms = q.split()
+    use_fts = db.get_bind().dialect.name == "sqlite"
+    indexed = [t for t in terms if use_fts and len(t) >= MIN_INDEXED_LENGTH]
+    columns = [getattr(model, c) for c in FTS_TABLES[fts_name][1]]
+    for term in terms:
+        if term not in indexed:
+            query = query.filter(or_(*(_contains(c, term) for c in columns)))
+
+    if not indexed:
+        return keyset_page(query, model.id, model.id, limit=limit, cursor=cursor)
+
+    fts = table(fts_name, column("rowid"), column("rank"))
+    matches = (
+        select(fts.c.rowid.label("id"), fts.c.rank.label("rank"))
+        .where(literal_column(fts_name).match(_match_expression(indexed)))
+        .subquery()
+    )
+    # rank（bm25）は小さいほど関連度が高いため、昇順に並べます
+    query = query.add_columns(matches.c.rank).join(matches, matches.c.id == model.id)
+    page = keyset_page(query, matches.c.rank, model.id, limit=limit, cursor=cursor, cursor_values=lambda row: (row.rank, row[0].id))
+    return Page([row[0] for row in page.items], page.next_cursor)
+
+
+def search_purchases(db: Session, params: schemas.SearchQuery) -> Page[models.Purchase]:
+    """品名・メモ・担当者に q のすべての語を含む購入アイテムを、関連度の高い順に返します"""
+    query = (
+        db.query(models.Purchase)
+        .options(selectinload(models.Purchase.assignments))
+        .filter(models.Purchase.dataset_id == params.dataset_id)
+    )
+    return _search(db, models.Purchase, "purchases_fts", query, params.q, params.limit, params.cursor)
+
+
+def search_actual_expenses(db: Session, params: schemas.ActualExpenseSearchQuery) -> Page[models.ActualExpense]:
+    """内容に q のすべての語を含むデータセット（budget_id を指定した場合はその予算）の実績を返します"""
+    budget_ids: Select[Tuple[str]] = select(models.Budget.id).where(models.Budget.dataset_id == params.dataset_id)
+    budget_id: ColumnElement[str] = models.ActualExpense.budget_id
+    query = db.query(models.ActualExpense).filter(budget_id.in_(budget_ids))
+    if params.budget_id is not None:
+        query = query.filter(models.ActualExpense.budget_id == params.budget_id)
+    return _search(db, models.ActualExpense, "actual_expenses_fts", query, params.q, params.limit, params.cursor)
+
+
+def rebuild(db: Session) -> None:
+    """元のテーブルの内容から検索索引を作り直します"""
+    for fts_name in FTS_TABLES:
+        db.execute(text(f"INSERT INTO {fts_name}({fts_name}) VALUES ('rebuild')"))
+    db.commit()
+
+
+def optimize(db: Session) -> None:
+    """書き込みで増えた索引のセグメントを 1 つにまとめます"""
+    for fts_name in FTS_TABLES:
+        db.execute(text(f"INSERT INTO {fts_name}({fts_name}) VALUES ('optimize')"))
+    db.commit()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m osaifill.search", description="Maintain the full-text search index")
+    parser.add_argument("command", choices=["rebuild", "optimize"])
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if db.get_bind().dialect.name != "sqlite":
+            print("full-text index is only used with SQLite")
+            return 0
+        {"rebuild": rebuild, "optimize": optimize}[args.command](db)
+        print(f"{args.command}: {', '.join(FTS_TABLES)}")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
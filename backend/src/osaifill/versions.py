@@ -0,0 +1,118 @@
+"""データセットごとのバージョン番号
+
+datasets.version はそのデータセットに関わる書き込みがコミットされるたびに 1 ずつ増えます。
+GET API はこの値を ETag として返し、If-None-Match が一致すれば重いテーブルを読まずに 304 を返します。
+
+ORM の unit of work を通る変更（add / 属性の更新 / delete）は before_flush で自動的に検出し、
+コミット直前に 1 回の UPDATE でまとめて番号を進めます。Query.update() / delete() や
+insert() の一括実行は検出できないため、それらを使う書き込みでは touch() を呼んでください。
+
+on_commit() で登録した関数は、バージョンを進めたデータセットの ID を受け取ってコミット後に呼ばれます
+（レスポンスキャッシュの破棄などに使います）。
+"""
+from itertools import chain
+from typing import Any, Callable, Iterable, List, Optional, Set, Tuple, cast
+
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from . import models
+
+_TOUCHED_KEY = "osaifill_touched_datasets"
+_COMMITTING_KEY = "osaifill_committing_datasets"
+
+CommitListener = Callable[[Set[str]], None]
+_commit_listeners: List[CommitListener] = []
+
+
+def on_commit(listener: CommitListener) -> CommitListener:
+    """バージョンを進めたトランザクションのコミット後に listener(dataset_ids) を呼び出します"""
+    _commit_listeners.append(listener)
+    return listener
+
+
+def touch(db: Session, dataset_id: Optional[str]) -> None:
+    """このトランザクションのコミット時に dataset_id のバージョンを進めます"""
+    if dataset_id:
+        db.info.setdefault(_TOUCHED_KEY, set()).add(dataset_id)
+
+
+def touch_budget(db: Session, budget_id: str) -> None:
+    """予算の子要素だけを一括更新した場合に、その予算が属するデータセットのバージョンを進めます"""
+    touch(db, db.query(models.Budget.dataset_id).filter(models.Budget.id == budget_id).scalar())
+
+
+def get_version(db: Session, dataset_id: str) -> Optional[int]:
+    """データセットの現在のバージョン（存在しない場合は None）を主キーの検索 1 回で返します"""
+    return cast(Optional[int], db.query(models.Dataset.version).filter(models.Dataset.id == dataset_id).scalar())
+
+
+def get_budget_version(db: Session, budget_id: str) -> Optional[Tuple[str, int]]:
+    """予算が属するデータセットの ID と現在のバージョンを返します"""
+    row: Optional[Tuple[Any, Any]] = (
+        db.query(models.Dataset.id, models.Dataset.version)
+        .join(models.Budget, models.Budget.dataset_id == models.Dataset.id)
+        .filter(models.Budget.id == budget_id)
+        .first()
+    )
+    return (cast(str, row[0]), cast(int, row[1])) if row else None
+
+
+def _dataset_of(session: Session, obj: Any) -> Optional[str]:
+    if isinstance(obj, models.Dataset):
+        return cast(Optional[str], obj.id)
+    if isinstance(obj, (models.DatasetRollup, models.BudgetRollup, models.ImportJob)):
+        # ロールアップは他の行から導出される値、インポートジョブは進捗の記録なので、バージョンを進めません
+        return None
+    # Member, Budget, Purchase, PurchaseImportSetting
+    dataset_id = getattr(obj, "dataset_id", None)
+    if dataset_id:
+        return cast(str, dataset_id)
+    # BudgetAssignment は購入アイテム、ActualExpense / ImportSetting は予算を経由します
+    for relation, parent_model, foreign_key in (
+        ("purchase", models.Purchase, "purchase_id"),
+        ("budget", models.Budget, "budget_id"),
+    ):
+        parent = getattr(obj, relation, None)
+        if parent is None and getattr(obj, foreign_key, None) is not None:
+            # 外部キーだけを設定した新規の行は、関連がまだ読み込まれていません
+            parent = session.get(parent_model, getattr(obj, foreign_key))
+        if parent is not None and parent.dataset_id:
+            return cast(str, parent.dataset_id)
+    return None
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_touched(session: Session, flush_context: Any, instances: Optional[Iterable[Any]]) -> None:
+    for obj in chain(session.new, session.deleted, session.dirty):
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        touch(session, _dataset_of(session, obj))
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_versions(session: Session) -> None:
+    # コミット時の flush で検出される変更も含めるため、先に flush してから番号を進めます
+    session.flush()
+    touched: Set[str] = session.info.pop(_TOUCHED_KEY, set())
+    if touched:
+        session.connection().execute(
+            update(models.Dataset.__table__)
+            .where(models.Dataset.__table__.c.id.in_(sorted(touched)))
+            .values(version=models.Dataset.__table__.c.version + 1)
+        )
+        session.info[_COMMITTING_KEY] = touched
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_committed(session: Session) -> None:
+    committed: Optional[Set[str]] = session.info.pop(_COMMITTING_KEY, None)
+    if committed:
+        for listener in _commit_listeners:
+            listener(committed)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_touched(session: Session, previous_transaction: Any) -> None:
+    session.info.pop(_TOUCHED_KEY, None)
+    session.info.pop(_COMMITTING_KEY, None)
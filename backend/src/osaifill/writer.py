@@ -0,0 +1,153 @@
+"""書き込みを 1 本の書き込みスレッドに集め、まとめてコミットする（グループコミット）
+
+SQLite は同時に 1 つの接続しか書き込めないため、各リクエストがそれぞれ commit すると、
+ロック待ちと fsync が書き込みの数だけ直列に並びます。WRITE_COORDINATOR=1 を設定すると、
+書き込み系の API は run_write() を通じて WriteCoordinator に処理を渡します。
+
+書き込みスレッドはキューに溜まった書き込みを最大 WRITE_BATCH_MAX 件まとめ、1 つのトランザクション
+（SQLite では BEGIN IMMEDIATE）の中でそれぞれを SAVEPOINT で区切って実行します。crud 関数の
+db.commit() は SAVEPOINT の解放になり、例外が発生した書き込みだけがその SAVEPOINT まで
+取り消されます。最後に 1 回 COMMIT してから、各呼び出し元に結果（または例外）を返します。
+"""
+import asyncio
+import contextvars
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .database import SYNC_DATABASE_URL, DbSession, convert_result, make_engine, run_db
+
+# 有効にすると、書き込み系の API を 1 本の書き込みスレッドでまとめてコミットします
+WRITE_COORDINATOR = os.getenv("WRITE_COORDINATOR", "").lower() in ("1", "true", "yes")
+# 1 回のコミットにまとめる書き込みの最大数と、後続の書き込みを待つ最大時間
+# （0 の場合は待たず、前のバッチを実行している間に溜まった書き込みだけをまとめます）
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "64"))
+WRITE_BATCH_DELAY_MS = float(os.getenv("WRITE_BATCH_DELAY_MS", "0"))
+
+
+@dataclass
+class _Write:
+    fn: Callable[..., Any]
+    args: Tuple[Any, ...]
+    as_model: Optional[Any]
+    future: "Future[Any]" = field(default_factory=Future)
+    # 呼び出し元のコンテキスト（SQL の実行数を呼び出し元のリクエストのメトリクスに含めます）
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+
+def make_writer_engine(url: Any) -> Engine:
+    """書き込みスレッド専用のエンジン（接続は 1 本、SQLite ではトランザクション開始時に書き込みロックを取得）"""
+    writer_engine = make_engine(url, pool_options={"pool_size": 1, "max_overflow": 0})
+    if writer_engine.url.get_backend_name() == "sqlite":
+        # pysqlite の暗黙の BEGIN を止め、SAVEPOINT を外側のトランザクションの中で使えるようにします
+        @event.listens_for(writer_engine, "connect")
+        def _disable_implicit_begin(dbapi_connection: Any, connection_record: Any) -> None:
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(writer_engine, "begin")
+        def _begin_immediate(conn: Any) -> None:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+    return writer_engine
+
+
+class WriteCoordinator:
+    """書き込みを 1 本のスレッドで順に実行し、まとめてコミットします"""
+
+    def __init__(self, engine: Engine, max_batch: int = WRITE_BATCH_MAX, max_delay: float = WRITE_BATCH_DELAY_MS / 1000) -> None:
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.writes = 0
+        self._queue: "queue.Queue[Optional[_Write]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="osaifill-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable[..., Any], *args: Any, as_model: Optional[Any] = None) -> "Future[Any]":
+        """fn(session, *args) を書き込みスレッドで実行し、コミット後に結果が設定される Future を返します"""
+        write = _Write(fn, args, as_model)
+        self._queue.put(write)
+        return write.future
+
+    async def run(self, fn: Callable[..., Any], *args: Any, as_model: Optional[Any] = None) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args, as_model=as_model))
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        self.engine.dispose()
+
+    def _loop(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._run_batch(batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch: List[_Write]) -> None:
+        outcomes: List[Tuple[_Write, Any, Optional[BaseException]]] = []
+        try:
+            with self.engine.connect() as conn, conn.begin():
+                for write in batch:
+                    if not write.future.set_running_or_notify_cancel():
+                        continue
+                    outcomes.append((write, *self._run_one(conn, write)))
+        except Exception as e:
+            # まとめたコミットに失敗した場合は、同じバッチのすべての書き込みが取り消されています
+            for write in batch:
+                if not write.future.done():
+                    write.future.set_exception(e)
+            return
+        self.batches += 1
+        self.writes += len(outcomes)
+        for write, value, error in outcomes:
+            if error is None:
+                write.future.set_result(value)
+            else:
+                write.future.set_exception(error)
+
+    @staticmethod
+    def _run_one(conn: Any, write: _Write) -> Tuple[Any, Optional[BaseException]]:
+        # セッションの commit() / rollback() は、この書き込み用の SAVEPOINT の解放・取り消しになります
+        session = Session(bind=conn, autoflush=False, join_transaction_mode="create_savepoint")
+        try:
+            return write.context.run(lambda: convert_result(write.fn(session, *write.args), write.as_model)), None
+        except Exception as e:
+            session.rollback()
+            return None, e
+        finally:
+            session.close()
+
+
+write_coordinator: Optional[WriteCoordinator] = (
+    WriteCoordinator(make_writer_engine(SYNC_DATABASE_URL)) if WRITE_COORDINATOR else None
+)
+
+
+async def run_write(db: DbSession, fn: Callable[..., Any], *args: Any, as_model: Optional[Any] = None) -> Any:
+    """書き込み系の crud 関数を実行します（書き込みスレッドが有効ならそちらでまとめてコミットします）"""
+    if write_coordinator is None:
+        return await run_db(db, fn, *args, as_model=as_model)
+    return await write_coordinator.run(fn, *args, as_model=as_model)
@@ -3,7 +3,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from fastapi.testclient import TestClient
 
-from osaifill.database import Base, get_db
+from osaifill.database import Base, enable_sqlite_foreign_keys, get_db
 from osaifill.main import app
 
 from sqlalchemy.pool import StaticPool
@@ -16,6 +16,8 @@ engine = create_engine(
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
+# 本番のエンジンと同じく外部キー制約（ON DELETE CASCADE）を有効にします
+enable_sqlite_foreign_keys(engine)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 @pytest.fixture(scope="function")
@@ -29,7 +31,9 @@ def db():
     yield session
     
     session.close()
-    transaction.rollback()
+    # 書き込みの失敗（IntegrityError など）でセッションが外側のトランザクションごとロールバック済みの場合があります
+    if transaction.is_active:
+        transaction.rollback()
     connection.close()
     Base.metadata.drop_all(bind=engine)
 
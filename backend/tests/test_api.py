@@ -159,3 +159,56 @@ def test_purchase_csv_import_export(client):
     assert res.status_code == 200
     assert "お茶" in res.text
     assert "麗子" in res.text
+
+def test_dashboard_aggregation_edge_cases(client):
+    """集計クエリ化したダッシュボードが未割当・カテゴリー未設定・購入しない等を正しく扱うか"""
+    ds_id = client.post("/api/datasets", json={"name": "Agg DS"}).json()["id"]
+    other_ds = client.post("/api/datasets", json={"name": "Other DS"}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "agg-1", "name": "財布1", "total_amount": 20000})
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "agg-2", "name": "財布2", "total_amount": 5000})
+    client.post("/api/budgets/agg-2/actual-expenses", json={"item_name": "実績", "amount": 700})
+
+    # 一部だけ割り当てた予定（未割当 600）
+    client.post("/api/purchases", json={
+        "dataset_id": ds_id, "item_name": "部分割当", "amount": 1000, "category": "固定費",
+        "status": "書いただけ", "assignments": [{"budget_id": "agg-1", "amount": 400}],
+    })
+    # 過剰に割り当てた予定（未割当は 0 扱い）
+    client.post("/api/purchases", json={
+        "dataset_id": ds_id, "item_name": "過剰割当", "amount": 500, "status": "見積済み",
+        "assignments": [{"budget_id": "agg-1", "amount": 300}, {"budget_id": "agg-2", "amount": 300}],
+    })
+    # カテゴリー未設定の予定（その他扱い、未割当 200）
+    client.post("/api/purchases", json={"dataset_id": ds_id, "item_name": "未分類", "amount": 200})
+    # 購入済みの旅費（予定外だが旅費総額には含む）
+    client.post("/api/purchases", json={
+        "dataset_id": ds_id, "item_name": "航空券", "amount": 3000, "category": "旅費",
+        "status": "購入済み", "assignments": [{"budget_id": "agg-1", "amount": 3000}],
+    })
+    # 購入しない旅費・固定費（総額から除外）
+    client.post("/api/purchases", json={"dataset_id": ds_id, "item_name": "中止", "amount": 9000, "category": "旅費", "status": "購入しない"})
+    client.post("/api/purchases", json={"dataset_id": ds_id, "item_name": "解約", "amount": 8000, "category": "固定費", "status": "購入しない"})
+    # 別データセットのアイテムは集計に含まれない
+    client.post("/api/purchases", json={"dataset_id": other_ds, "item_name": "他所", "amount": 99999, "category": "固定費"})
+
+    data = client.get(f"/api/dashboard?dataset_id={ds_id}").json()
+
+    assert data["fixed_cost_planned_total"] == 1000
+    assert data["travel_planned_total"] == 0
+    assert data["other_planned_total"] == 700
+    assert data["overall_planned_total"] == 1700
+    assert data["unassigned_planned_total"] == 800
+    assert data["fixed_cost_total"] == 1000
+    assert data["travel_cost_total"] == 3000
+    assert [i["item_name"] for i in data["travel_items"]] == ["航空券"]
+    assert len(data["travel_items"][0]["assignments"]) == 1
+    assert data["overall_actual_total"] == 700
+    assert data["overall_remaining_forecast"] == 25000 - 700 - 1700
+
+    budgets = {b["budget_id"]: b for b in data["budgets"]}
+    assert budgets["agg-1"]["planned_total"] == 700
+    assert budgets["agg-1"]["actual_total"] == 0
+    assert budgets["agg-1"]["remaining_forecast"] == 19300
+    assert budgets["agg-2"]["planned_total"] == 300
+    assert budgets["agg-2"]["actual_total"] == 700
+    assert budgets["agg-2"]["remaining_forecast"] == 4000
@@ -0,0 +1,76 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+from osaifill import migrations
+from osaifill.database import get_db
+from osaifill.main import app
+
+pytest.importorskip("aiosqlite")
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+
+
+@pytest.fixture
+def async_client(tmp_path):
+    """DATABASE_URL に sqlite+aiosqlite:// を指定した場合と同じく AsyncSession でルートを実行するクライアント"""
+    db_path = tmp_path / "async.db"
+    sync_engine = create_engine(f"sqlite:///{db_path}")
+    migrations.upgrade(sync_engine)
+    sync_engine.dispose()
+
+    # 接続はテストクライアントのイベントループで作られるため、プールに残さないようにします
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+
+    async def override_get_db():
+        async with AsyncSessionLocal() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    with TestClient(app) as c:
+        yield c
+    app.dependency_overrides.clear()
+
+
+def test_async_mode_end_to_end(async_client):
+    """非同期モードでも同期モードと同じレスポンスになるか（遅延ロードを含むシリアライズ・ストリーミングを含む）"""
+    client = async_client
+    ds_id = client.post("/api/datasets", json={"name": "Async DS"}).json()["id"]
+    assert client.post("/api/budgets", json={"dataset_id": ds_id, "id": "a-1", "name": "予算", "total_amount": 10000}).status_code == 200
+
+    res = client.post("/api/purchases", json={
+        "dataset_id": ds_id, "item_name": "家賃", "amount": 4000, "category": "固定費",
+        "assignments": [{"budget_id": "a-1", "amount": 3000}],
+    })
+    assert res.status_code == 200
+    purchase_id = res.json()["id"]
+    assert res.json()["assignments"][0]["amount"] == 3000
+
+    client.post(f"/api/purchases/import?dataset_id={ds_id}", json=[
+        {"dataset_id": ds_id, "item_name": "備品", "amount": 800, "assignments": [{"budget_id": "a-1", "amount": 800}]},
+    ])
+    assert client.patch(f"/api/purchases/{purchase_id}/status?status=購入済み").json()["status"] == "購入済み"
+    client.post("/api/budgets/a-1/actual-expenses", json={"item_name": "食費", "amount": 700})
+
+    budgets = client.get(f"/api/budgets?dataset_id={ds_id}").json()
+    assert [b["id"] for b in budgets] == ["a-1"]
+    assert sorted(p["item_name"] for p in client.get(f"/api/purchases?dataset_id={ds_id}").json()) == ["備品", "家賃"]
+
+    summary = client.get(f"/api/dashboard?dataset_id={ds_id}").json()
+    assert summary["overall_actual_total"] == 700
+    assert summary["budgets"][0]["planned_total"] == 800
+    assert summary["fixed_cost_total"] == 4000
+
+    client.post(f"/api/datasets/{ds_id}/purchase-import-setting", json={"mapping_json": '{"item_name": "アイテム名", "amount": "金額"}'})
+    files = {"file": ("p.csv", "アイテム名,金額\n文具,120\n", "text/csv")}
+    assert client.post(f"/api/purchases/import-csv?dataset_id={ds_id}", files=files).json()["inserted"] == 1
+
+    export = client.get(f"/api/purchases/export-csv?dataset_id={ds_id}")
+    assert export.status_code == 200
+    lines = export.content.decode("utf-8-sig").splitlines()
+    assert len(lines) == 1 + 3
+    assert "文具" in lines[-1]
+
+    assert client.delete(f"/api/purchases/{purchase_id}").status_code == 200
+    assert client.delete("/api/purchases/999999").status_code == 404
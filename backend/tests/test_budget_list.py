@@ -0,0 +1,59 @@
+from sqlalchemy import event
+
+
+def setup_budgets(client, count):
+    ds_id = client.post("/api/datasets", json={"name": "Budget List DS"}).json()["id"]
+    for i in range(count):
+        client.post("/api/budgets", json={"dataset_id": ds_id, "id": f"bl-{i}", "name": f"予算{i}", "total_amount": 1000})
+        client.post(f"/api/budgets/bl-{i}/actual-expenses", json={"item_name": "実績", "amount": 100})
+        client.post(f"/api/budgets/bl-{i}/import-setting", json={"mapping_json": "{}"})
+        client.post("/api/purchases", json={
+            "dataset_id": ds_id, "item_name": f"購入{i}", "amount": 300,
+            "assignments": [{"budget_id": f"bl-{i}", "amount": 300}],
+        })
+    return ds_id
+
+
+def count_selects(db, fn):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    engine = db.get_bind().engine
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        result = fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    return result, len(statements)
+
+
+def test_budget_list_query_count_is_constant(client, db):
+    """予算の件数に関係なく、一覧はバージョン確認 1 回 + 予算 1 回 + 子要素の種類ごとに 1 回のクエリで返るか"""
+    ds_id = setup_budgets(client, 6)
+    db.expire_all()
+
+    res, queries = count_selects(db, lambda: client.get(f"/api/budgets?dataset_id={ds_id}"))
+    budgets = res.json()
+    assert len(budgets) == 6
+    assert queries == 1 + 1 + 3
+    assert all(len(b["assignments"]) == 1 and len(b["actual_expenses"]) == 1 for b in budgets)
+    assert all(b["import_setting"]["mapping_json"] == "{}" for b in budgets)
+
+
+def test_budget_list_include_and_lightweight(client, db):
+    ds_id = setup_budgets(client, 3)
+    db.expire_all()
+
+    res, queries = count_selects(db, lambda: client.get(f"/api/budgets?dataset_id={ds_id}&lightweight=true"))
+    assert queries == 1 + 1
+    assert res.json()[0] == {
+        "id": "bl-0", "dataset_id": ds_id, "name": "予算0", "total_amount": 1000, "unit": "JPY", "description": None,
+    }
+
+    db.expire_all()
+    res, queries = count_selects(db, lambda: client.get(f"/api/budgets?dataset_id={ds_id}&include=assignments"))
+    assert queries == 1 + 2
+    assert set(res.json()[0]) == {"id", "dataset_id", "name", "total_amount", "unit", "description", "assignments"}
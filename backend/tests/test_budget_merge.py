@@ -78,3 +78,62 @@ def test_budget_merge(client):
     # 7. Verify Actual Expense is moved
     res_ae = client.get(f"/api/budgets/{b_a_id}/actual-expenses")
     assert any(ae["item_name"] == "Actual B" and ae["amount"] == 300 for ae in res_ae.json())
+
+
+def test_merge_many_budgets_collapses_assignments_and_hands_over_settings(client, db):
+    from osaifill import rollup
+
+    ds_id = client.post("/api/datasets", json={"name": "Merge Many DS"}).json()["id"]
+    for b_id, total in (("mt", 1000), ("ms1", 200), ("ms2", 300), ("ms3", 400)):
+        client.post("/api/budgets", json={"dataset_id": ds_id, "id": b_id, "name": b_id, "total_amount": total})
+    # 統合先に設定がないため、統合元のうち先に指定した予算（ms2）の設定を引き継ぎます
+    client.post("/api/budgets/ms3/import-setting", json={"mapping_json": '{"from": "ms3"}'})
+    client.post("/api/budgets/ms2/import-setting", json={"mapping_json": '{"from": "ms2"}'})
+    client.post("/api/budgets/ms1/actual-expenses", json={"item_name": "実績1", "amount": 50})
+    client.post("/api/budgets/ms3/actual-expenses", json={"item_name": "実績3", "amount": 70})
+
+    def create(name, assignments):
+        return client.post("/api/purchases", json={
+            "dataset_id": ds_id, "item_name": name, "amount": sum(a for _, a in assignments) + 10,
+            "assignments": [{"budget_id": b, "amount": a} for b, a in assignments],
+        }).json()["id"]
+
+    both = create("統合先と統合元", [("mt", 10), ("ms1", 20), ("ms3", 30)])
+    sources_only = create("統合元のみ", [("ms1", 5), ("ms2", 6)])
+    untouched = create("統合先のみ", [("mt", 7)])
+    single = create("統合元 1 つ", [("ms3", 8)])
+
+    res = client.post("/api/budgets/merge-many", json={"source_budget_ids": ["ms2", "ms1", "ms3"], "target_budget_id": "mt"})
+    assert res.status_code == 200
+    merged = res.json()
+    assert merged["total_amount"] == 1900
+    assert merged["import_setting"]["mapping_json"] == '{"from": "ms2"}'
+
+    assert [b["id"] for b in client.get(f"/api/budgets?dataset_id={ds_id}").json()] == ["mt"]
+    purchases = {p["id"]: p["assignments"] for p in client.get(f"/api/purchases?dataset_id={ds_id}").json()}
+    assert [(a["budget_id"], a["amount"]) for a in purchases[both]] == [("mt", 60)]
+    assert [(a["budget_id"], a["amount"]) for a in purchases[sources_only]] == [("mt", 11)]
+    assert [(a["budget_id"], a["amount"]) for a in purchases[untouched]] == [("mt", 7)]
+    assert [(a["budget_id"], a["amount"]) for a in purchases[single]] == [("mt", 8)]
+    assert sorted(e["item_name"] for e in client.get("/api/budgets/mt/actual-expenses").json()) == ["実績1", "実績3"]
+
+    dashboard = client.get(f"/api/dashboard?dataset_id={ds_id}").json()
+    assert [(b["budget_id"], b["actual_total"], b["planned_total"]) for b in dashboard["budgets"]] == [("mt", 120, 86)]
+    db.expire_all()
+    assert rollup.verify_dataset(db, ds_id) == []
+
+
+def test_merge_many_budgets_rejects_invalid_requests(client):
+    ds_a = client.post("/api/datasets", json={"name": "A"}).json()["id"]
+    ds_b = client.post("/api/datasets", json={"name": "B"}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_a, "id": "ra", "name": "A", "total_amount": 100})
+    client.post("/api/budgets", json={"dataset_id": ds_a, "id": "ra2", "name": "A2", "total_amount": 100})
+    client.post("/api/budgets", json={"dataset_id": ds_b, "id": "rb", "name": "B", "total_amount": 100})
+
+    # 別のデータセットの予算や存在しない予算を含む場合は、何も変更しません
+    assert client.post("/api/budgets/merge-many", json={"source_budget_ids": ["ra2", "rb"], "target_budget_id": "ra"}).status_code == 404
+    assert client.post("/api/budgets/merge-many", json={"source_budget_ids": ["ra2", "missing"], "target_budget_id": "ra"}).status_code == 404
+    assert client.post("/api/budgets/merge-many", json={"source_budget_ids": ["ra", "ra2"], "target_budget_id": "ra"}).status_code == 400
+    assert client.post("/api/budgets/merge-many", json={"source_budget_ids": [], "target_budget_id": "ra"}).status_code == 422
+    assert {b["id"] for b in client.get(f"/api/budgets?dataset_id={ds_a}").json()} == {"ra", "ra2"}
+    assert client.get("/api/budgets/ra/actual-expenses").status_code == 200
@@ -0,0 +1,85 @@
+from osaifill.cache import CachedResponse, ResponseCache, response_cache
+
+from .test_budget_list import count_selects
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def entry(size):
+    return CachedResponse(b"x" * size)
+
+
+def test_cache_evicts_least_recently_used_entry_over_memory_cap():
+    one = entry(100).size
+    cache = ResponseCache(max_bytes=one * 2, ttl_seconds=60)
+    cache.put("ds", "a", entry(100))
+    cache.put("ds", "b", entry(100))
+    assert cache.get("ds", "a") is not None  # a を最近使ったことにします
+    cache.put("ds", "c", entry(100))
+
+    assert cache.get("ds", "b") is None
+    assert cache.get("ds", "a") is not None
+    assert cache.get("ds", "c") is not None
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.evictions, stats.entries) == (3, 1, 1, 2)
+    assert stats.bytes == one * 2
+
+    # 上限より大きいエントリーは保持しません
+    cache.put("ds", "huge", entry(one * 3))
+    assert cache.get("ds", "huge") is None
+    assert cache.stats().entries == 2
+
+
+def test_cache_expires_entries_after_ttl_and_invalidates_per_dataset():
+    clock = FakeClock()
+    cache = ResponseCache(max_bytes=1 << 20, ttl_seconds=10, clock=clock)
+    cache.put("ds1", "a", entry(10))
+    cache.put("ds1", "b", entry(10))
+    cache.put("ds2", "a", entry(10))
+
+    clock.now = 11
+    assert cache.get("ds1", "a") is None
+    assert cache.stats().expirations == 1
+
+    cache.invalidate(["ds1"])
+    assert cache.get("ds1", "b") is None
+    assert cache.get("ds2", "a") is None  # ds2 も TTL 切れ
+    cache.put("ds2", "a", entry(10))
+    assert cache.get("ds2", "a") is not None
+    stats = cache.stats()
+    assert stats.invalidations == 1
+    assert stats.entries == 1
+
+
+def test_dashboard_and_lists_are_served_from_cache_until_a_write(client, db):
+    ds_id = client.post("/api/datasets", json={"name": "Cache DS"}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "cache-b", "name": "予算", "total_amount": 1000})
+    client.post("/api/purchases", json={"dataset_id": ds_id, "item_name": "品物", "amount": 300, "assignments": [{"budget_id": "cache-b", "amount": 300}]})
+
+    urls = [f"/api/dashboard?dataset_id={ds_id}", f"/api/budgets?dataset_id={ds_id}", f"/api/purchases?dataset_id={ds_id}&limit=1"]
+    first = [client.get(url) for url in urls]
+    before = response_cache.stats()
+
+    for url, expected in zip(urls, first):
+        res, queries = count_selects(db, lambda: client.get(url))
+        # バージョンの確認だけで、キャッシュした本文とヘッダーが返ります
+        assert queries == 1
+        assert res.json() == expected.json()
+        assert res.headers["etag"] == expected.headers["etag"]
+    assert response_cache.stats().hits == before.hits + len(urls)
+
+    # 書き込みのコミットでデータセットのエントリーが破棄され、新しい内容が返ります
+    client.post("/api/purchases", json={"dataset_id": ds_id, "item_name": "追加", "amount": 200, "assignments": [{"budget_id": "cache-b", "amount": 200}]})
+    assert response_cache.stats().invalidations >= before.invalidations + len(urls)
+    dashboard = client.get(urls[0]).json()
+    assert dashboard["overall_planned_total"] == 500
+    assert len(client.get(f"/api/purchases?dataset_id={ds_id}").json()) == 2
+
+    stats = client.get("/api/cache/stats").json()
+    assert set(stats) == {"hits", "misses", "evictions", "expirations", "invalidations", "entries", "bytes", "max_bytes"}
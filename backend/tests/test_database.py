@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+
+from osaifill.database import SQLITE_PROFILES, SqliteProfile, make_engine, pool_options_from_env, sqlite_profile_from_env
+
+
+def test_sqlite_profile_from_env_applies_overrides():
+    assert sqlite_profile_from_env({}) == SQLITE_PROFILES["tuned"]
+    assert sqlite_profile_from_env({"SQLITE_PROFILE": "default"}) == SqliteProfile()
+
+    profile = sqlite_profile_from_env({"SQLITE_JOURNAL_MODE": "delete", "SQLITE_BUSY_TIMEOUT_MS": "250", "SQLITE_CACHE_SIZE": ""})
+    assert (profile.journal_mode, profile.busy_timeout_ms) == ("DELETE", 250)
+    assert profile.cache_size == SQLITE_PROFILES["tuned"].cache_size
+
+    with pytest.raises(ValueError):
+        sqlite_profile_from_env({"SQLITE_PROFILE": "fast"})
+    with pytest.raises(ValueError):
+        # PRAGMA の値は SQL に埋め込むため、決まった値以外は受け付けません
+        sqlite_profile_from_env({"SQLITE_SYNCHRONOUS": "OFF; DROP TABLE datasets"})
+
+
+def test_make_engine_applies_pragmas_and_pool_settings(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'tuned.db'}", SQLITE_PROFILES["tuned"], pool_options_from_env({"DB_POOL_SIZE": "3", "DB_POOL_TIMEOUT": "2"}))
+    try:
+        with engine.connect() as conn:
+            pragma = lambda name: conn.execute(text(f"PRAGMA {name}")).scalar()
+            assert pragma("journal_mode") == "wal"
+            assert pragma("synchronous") == 1  # NORMAL
+            assert pragma("busy_timeout") == 5000
+            assert pragma("cache_size") == -64 * 1024
+            assert pragma("temp_store") == 2  # MEMORY
+        assert isinstance(engine.pool, QueuePool)
+        assert (engine.pool.size(), engine.pool._timeout) == (3, 2.0)
+    finally:
+        engine.dispose()
+
+    default = make_engine(f"sqlite:///{tmp_path / 'default.db'}", SQLITE_PROFILES["default"], {})
+    try:
+        with default.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "delete"
+    finally:
+        default.dispose()
+
+    # インメモリのデータベースにはプールの設定を渡しません
+    memory = make_engine("sqlite://", SQLITE_PROFILES["tuned"], {"pool_size": 3})
+    with memory.connect() as conn:
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+    memory.dispose()
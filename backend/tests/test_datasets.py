@@ -1,5 +1,8 @@
 import pytest
 import json
+from sqlalchemy import func
+
+from osaifill import models
 
 def test_dataset_crud(client):
     # 1. データセットの作成
@@ -93,3 +96,81 @@ def test_dataset_rollover(client):
     life_budget = next((b for b in budgets if b["name"] == "生活費"), None)
     assert life_budget is None
 
+
+
+def test_dataset_rollover_per_budget_carries_settings(client):
+    old_ds = client.post("/api/datasets", json={"name": "2024年度"}).json()["id"]
+    client.post(f"/api/datasets/{old_ds}/purchase-import-setting", json={"mapping_json": '{"item_name": "品名", "amount": "金額"}'})
+    client.post("/api/budgets", json={"dataset_id": old_ds, "id": "pb1", "name": "生活費", "total_amount": 10000})
+    client.post("/api/budgets/pb1/actual-expenses", json={"item_name": "食費", "amount": 3000})
+    client.post("/api/budgets/pb1/actual-expenses", json={"item_name": "日用品", "amount": 1000})
+    client.post("/api/budgets/pb1/import-setting", json={"mapping_json": '{"item_name": "内容", "amount": "金額"}'})
+    # 使い切った予算と、実績が予算を超えた予算は引き継ぎません
+    client.post("/api/budgets", json={"dataset_id": old_ds, "id": "pb2", "name": "娯楽費", "total_amount": 5000})
+    client.post("/api/budgets/pb2/actual-expenses", json={"item_name": "ゲーム", "amount": 5000})
+    client.post("/api/budgets", json={"dataset_id": old_ds, "id": "pb3", "name": "交通費", "total_amount": 1000})
+    client.post("/api/budgets/pb3/actual-expenses", json={"item_name": "電車", "amount": 1500})
+    client.post("/api/budgets", json={"dataset_id": old_ds, "id": "pb4", "name": "予備費", "total_amount": 2000})
+
+    res = client.post("/api/datasets/rollover", json={
+        "new_name": "2025年度", "source_dataset_id": old_ds, "budget_carry_over": "per_budget",
+    })
+    assert res.status_code == 200
+    new_ds = res.json()["id"]
+
+    budgets = {b["name"]: b for b in client.get(f"/api/budgets?dataset_id={new_ds}").json()}
+    assert {name: b["total_amount"] for name, b in budgets.items()} == {"生活費": 6000.0, "予備費": 2000.0}
+    assert budgets["生活費"]["id"] != "pb1"
+    assert budgets["生活費"]["import_setting"]["mapping_json"] == '{"item_name": "内容", "amount": "金額"}'
+    assert budgets["予備費"]["import_setting"] is None
+    setting = client.get(f"/api/datasets/{new_ds}/purchase-import-setting").json()
+    assert setting["mapping_json"] == '{"item_name": "品名", "amount": "金額"}'
+
+    dashboard = client.get(f"/api/dashboard?dataset_id={new_ds}").json()
+    assert sorted(b["actual_total"] for b in dashboard["budgets"]) == [0, 0]
+
+    # 設定を引き継がない場合は、取り込み設定をコピーしません
+    res = client.post("/api/datasets/rollover", json={
+        "new_name": "2025年度(設定なし)", "source_dataset_id": old_ds, "carry_over_settings": False,
+    })
+    assert client.get(f"/api/datasets/{res.json()['id']}/purchase-import-setting").json() is None
+
+
+def test_delete_dataset_cascades_in_database(client, db):
+    def fill(name):
+        ds = client.post("/api/datasets", json={"name": name}).json()["id"]
+        client.post("/api/members", json={"dataset_id": ds, "name": "担当"})
+        client.post("/api/budgets", json={"dataset_id": ds, "id": f"{name}-b", "name": "予算", "total_amount": 1000})
+        client.post(f"/api/budgets/{name}-b/actual-expenses", json={"item_name": "実績", "amount": 100})
+        client.post(f"/api/budgets/{name}-b/import-setting", json={"mapping_json": '{"a": "b"}'})
+        client.post(f"/api/datasets/{ds}/purchase-import-setting", json={"mapping_json": '{"a": "b"}'})
+        client.post("/api/purchases", json={
+            "dataset_id": ds, "item_name": "品物", "amount": 300, "assignments": [{"budget_id": f"{name}-b", "amount": 300}],
+        })
+        client.get(f"/api/dashboard?dataset_id={ds}")
+        return ds
+
+    deleted, kept = fill("del"), fill("keep")
+    child_models = [
+        models.Member, models.Budget, models.Purchase, models.BudgetAssignment, models.ActualExpense,
+        models.ImportSetting, models.PurchaseImportSetting, models.DatasetRollup, models.BudgetRollup,
+    ]
+    assert all(db.query(func.count()).select_from(m).scalar() == 2 for m in child_models)
+
+    assert client.delete(f"/api/datasets/{deleted}").status_code == 200
+    assert client.delete(f"/api/datasets/{deleted}").status_code == 404
+
+    # 子の行は ON DELETE CASCADE で削除され、別のデータセットの行は残ります
+    assert {m.__name__: db.query(func.count()).select_from(m).scalar() for m in child_models} == {m.__name__: 1 for m in child_models}
+    assert client.get("/api/budgets/keep-b/actual-expenses").json()[0]["amount"] == 100
+    assert client.get(f"/api/purchases?dataset_id={deleted}").json() == []
+    assert len(client.get(f"/api/purchases?dataset_id={kept}").json()) == 1
+
+
+def test_reference_to_missing_budget_is_rejected(client):
+    # 外部キー制約が有効なため、存在しない予算への割当は登録されません
+    ds = client.post("/api/datasets", json={"name": "FK"}).json()["id"]
+    res = client.post("/api/purchases", json={
+        "dataset_id": ds, "item_name": "品物", "amount": 100, "assignments": [{"budget_id": "missing", "amount": 100}],
+    })
+    assert res.status_code == 409
@@ -0,0 +1,106 @@
+import json
+
+from sqlalchemy import event
+
+from osaifill import models
+
+
+def version_of(db, ds_id):
+    db.expire_all()
+    return db.get(models.Dataset, ds_id).version
+
+
+def test_every_write_bumps_the_dataset_version(client, db):
+    """各書き込みのコミットでそのデータセットのバージョンだけが進むか"""
+    ds_id = client.post("/api/datasets", json={"name": "Version DS"}).json()["id"]
+    other_id = client.post("/api/datasets", json={"name": "Other DS"}).json()["id"]
+    other_version = version_of(db, other_id)
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "v-1", "name": "予算1", "total_amount": 1000})
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "v-2", "name": "予算2", "total_amount": 1000})
+    state = {"pid": None, "eid": None, "mid": None}
+
+    def create_purchase():
+        state["pid"] = client.post("/api/purchases", json={
+            "dataset_id": ds_id, "item_name": "PC", "amount": 100, "assignments": [{"budget_id": "v-1", "amount": 100}],
+        }).json()["id"]
+
+    def create_expense():
+        state["eid"] = client.post("/api/budgets/v-1/actual-expenses", json={"item_name": "食費", "amount": 10}).json()["id"]
+
+    def create_member():
+        state["mid"] = client.post("/api/members", json={"dataset_id": ds_id, "name": "太郎"}).json()["id"]
+
+    csv_files = lambda text: {"file": ("a.csv", text, "text/csv")}  # noqa: E731
+    writes = [
+        lambda: client.put(f"/api/datasets/{ds_id}", json={"name": "改名"}),
+        create_member,
+        lambda: client.put(f"/api/members/{state['mid']}", json={"name": "花子"}),
+        lambda: client.delete(f"/api/members/{state['mid']}"),
+        lambda: client.put("/api/budgets/v-1", json={"total_amount": 2000}),
+        create_purchase,
+        lambda: client.put(f"/api/purchases/{state['pid']}", json={"assignments": []}),
+        lambda: client.patch(f"/api/purchases/{state['pid']}/status?status=購入済み"),
+        lambda: client.post(f"/api/purchases/import?dataset_id={ds_id}", json=[{"dataset_id": ds_id, "item_name": "X", "amount": 1}]),
+        lambda: client.delete(f"/api/purchases/{state['pid']}"),
+        create_expense,
+        lambda: client.put(f"/api/actual-expenses/{state['eid']}", json={"item_name": "食費", "amount": 20}),
+        lambda: client.delete(f"/api/actual-expenses/{state['eid']}"),
+        lambda: client.post("/api/budgets/v-2/import-setting", json={"mapping_json": json.dumps({"item_name": "内容", "amount": "金額"})}),
+        lambda: client.post("/api/budgets/v-2/import-csv", files=csv_files("内容,金額\nA,5\n"), data={"overwrite": "false"}),
+        lambda: client.post("/api/budgets/v-2/import-csv", files=csv_files("内容,金額\n"), data={"overwrite": "true"}),
+        lambda: client.post(f"/api/datasets/{ds_id}/purchase-import-setting", json={"mapping_json": json.dumps({"item_name": "名前", "amount": "金額"})}),
+        lambda: client.post(f"/api/purchases/import-csv?dataset_id={ds_id}", files=csv_files("名前,金額\n"), data={"overwrite": "true"}),
+        lambda: client.post("/api/budgets/merge", json={"source_budget_id": "v-2", "target_budget_id": "v-1"}),
+        lambda: client.delete("/api/budgets/v-1"),
+    ]
+    for i, write in enumerate(writes):
+        before = version_of(db, ds_id)
+        write()
+        assert version_of(db, ds_id) > before, f"write #{i} did not bump the version"
+
+    assert version_of(db, other_id) == other_version
+
+
+def test_get_endpoints_answer_304_until_a_write(client, db):
+    ds_id = client.post("/api/datasets", json={"name": "ETag DS"}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "e-1", "name": "予算", "total_amount": 1000})
+    client.post("/api/purchases", json={"dataset_id": ds_id, "item_name": "PC", "amount": 100})
+
+    urls = [
+        f"/api/dashboard?dataset_id={ds_id}",
+        f"/api/purchases?dataset_id={ds_id}",
+        f"/api/budgets?dataset_id={ds_id}",
+        f"/api/members?dataset_id={ds_id}",
+        f"/api/purchases/export-csv?dataset_id={ds_id}",
+        f"/api/datasets/{ds_id}/purchase-import-setting",
+        "/api/budgets/e-1/actual-expenses",
+        "/api/budgets/e-1/import-setting",
+    ]
+    etags = {}
+    for url in urls:
+        res = client.get(url)
+        assert res.status_code == 200
+        etags[url] = res.headers["ETag"]
+
+    statements = []
+    engine = db.get_bind().engine
+    capture = lambda conn, cursor, statement, *args: statements.append(statement)  # noqa: E731
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        for url in urls:
+            res = client.get(url, headers={"If-None-Match": etags[url]})
+            assert res.status_code == 304, url
+            assert res.headers["ETag"] == etags[url]
+            assert res.content == b""
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    # 304 の応答はバージョンの確認 1 回だけで返ります
+    assert len(statements) == len(urls)
+
+    client.post("/api/purchases", json={"dataset_id": ds_id, "item_name": "マウス", "amount": 10})
+    res = client.get(urls[0], headers={"If-None-Match": etags[urls[0]]})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etags[urls[0]]
+
+    # 存在しないデータセットには ETag を付けず、通常どおり処理します
+    assert "ETag" not in client.get("/api/budgets/missing/actual-expenses").headers
@@ -56,3 +56,38 @@ def test_export_csv_content_validation(client):
     assert "500" in content
     # 現在のバックエンド実装にステータスが含まれているか確認
     assert "書いただけ" in content
+
+def test_export_csv_streams_in_chunks(client, monkeypatch):
+    """チャンク境界をまたいでも行の順序と割当ごとの展開が保たれるか"""
+    from osaifill import main
+
+    monkeypatch.setattr(main, "EXPORT_CHUNK_ROWS", 2)
+    ds_id = client.post("/api/datasets", json={"name": "Stream Test"}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "s-1", "name": "財布1", "total_amount": 5000})
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "s-2", "name": "財布2", "total_amount": 5000})
+
+    client.post("/api/purchases", json={"dataset_id": ds_id, "item_name": "A", "amount": 100})
+    client.post("/api/purchases", json={
+        "dataset_id": ds_id, "item_name": "B", "amount": 300,
+        "assignments": [{"budget_id": "s-1", "amount": 100}, {"budget_id": "s-2", "amount": 200}],
+    })
+    for name in ["C", "D", "E"]:
+        client.post("/api/purchases", json={
+            "dataset_id": ds_id, "item_name": name, "amount": 10, "assignments": [{"budget_id": "s-1", "amount": 10}],
+        })
+
+    with client.stream("GET", f"/api/purchases/export-csv?dataset_id={ds_id}") as res:
+        assert res.status_code == 200
+        chunks = list(res.iter_bytes())
+    content = b"".join(chunks).decode("utf-8-sig")
+
+    rows = [line.split(",") for line in content.splitlines()]
+    assert rows[0][0] == "担当者"
+    assert [(r[2], r[8], r[9]) for r in rows[1:]] == [
+        ("A", "", ""),
+        ("B", "s-1", "100.0"),
+        ("B", "s-2", "200.0"),
+        ("C", "s-1", "10.0"),
+        ("D", "s-1", "10.0"),
+        ("E", "s-1", "10.0"),
+    ]
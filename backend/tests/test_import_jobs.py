@@ -0,0 +1,183 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from osaifill import crud, importers, jobs, models
+
+from .test_import_logic import setup_dataset_and_mapping
+
+
+def submit_purchase_csv(client, ds_id, rows):
+    files = {"file": ("job.csv", "\n".join(["アイテム名,金額"] + rows) + "\n", "text/csv")}
+    res = client.post(f"/api/purchases/import-jobs?dataset_id={ds_id}", files=files)
+    assert res.status_code == 202
+    return res.json()
+
+
+def test_purchase_import_job_runs_in_background(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs, "IMPORT_SPOOL_DIR", str(tmp_path))
+    ds_id = setup_dataset_and_mapping(client)
+    job = submit_purchase_csv(client, ds_id, ["A,1", ",2", "B,3"])
+    assert job["kind"] == "purchases" and job["status"] in ("queued", "running")
+
+    jobs.wait(job["id"], timeout=5)
+    done = client.get(f"/api/import-jobs/{job['id']}").json()
+    assert done["status"] == "succeeded"
+    assert (done["rows_processed"], done["inserted"], done["skipped"], done["failed"]) == (3, 2, 1, 0)
+    assert done["started_at"] and done["finished_at"]
+    assert sorted(i["item_name"] for i in client.get(f"/api/purchases?dataset_id={ds_id}").json()) == ["A", "B"]
+    assert [j["id"] for j in client.get(f"/api/import-jobs?dataset_id={ds_id}").json()] == [job["id"]]
+    # 完了したジョブのアップロードファイルは削除されます
+    assert os.listdir(tmp_path) == []
+
+
+def test_running_job_reports_progress_and_can_be_cancelled(client, db, monkeypatch):
+    """チャンクごとに進捗が記録され、キャンセルすると次のチャンクの区切りで止まるか"""
+    ds_id = setup_dataset_and_mapping(client)
+    monkeypatch.setattr(importers, "IMPORT_CHUNK_ROWS", 2)
+
+    reached, release = threading.Event(), threading.Event()
+    original_bulk = crud.insert_purchases_bulk
+    calls = []
+
+    def paused_bulk(db, dataset_id, purchases):
+        calls.append(len(purchases))
+        if len(calls) == 2:
+            reached.set()
+            release.wait(5)
+        return original_bulk(db, dataset_id, purchases)
+
+    monkeypatch.setattr(crud, "insert_purchases_bulk", paused_bulk)
+
+    job = submit_purchase_csv(client, ds_id, [f"item-{i},{i}" for i in range(6)])
+    assert reached.wait(5)
+    running = client.get(f"/api/import-jobs/{job['id']}").json()
+    assert (running["status"], running["rows_processed"], running["inserted"]) == ("running", 2, 2)
+
+    cancelled = client.post(f"/api/import-jobs/{job['id']}/cancel").json()
+    assert cancelled["cancel_requested"] is True
+    release.set()
+    jobs.wait(job["id"], timeout=5)
+
+    done = client.get(f"/api/import-jobs/{job['id']}").json()
+    assert (done["status"], done["inserted"]) == ("cancelled", 4)
+    assert calls == [2, 2]
+    assert len(client.get(f"/api/purchases?dataset_id={ds_id}").json()) == 4
+
+
+@pytest.mark.parametrize("rows", [3, 4])
+def test_cancel_during_last_chunk_still_succeeds(client, db, monkeypatch, rows):
+    """最後のチャンクの登録中にキャンセルしても、すべての行を登録したジョブは完了として記録されるか"""
+    ds_id = setup_dataset_and_mapping(client)
+    monkeypatch.setattr(importers, "IMPORT_CHUNK_ROWS", 2)
+
+    reached, release = threading.Event(), threading.Event()
+    original_bulk = crud.insert_purchases_bulk
+    calls = []
+
+    def paused_bulk(db, dataset_id, purchases):
+        calls.append(len(purchases))
+        if len(calls) == 2:
+            reached.set()
+            release.wait(5)
+        return original_bulk(db, dataset_id, purchases)
+
+    monkeypatch.setattr(crud, "insert_purchases_bulk", paused_bulk)
+
+    # 3 行は端数の、4 行はちょうど埋まった最後のチャンクでキャンセルします
+    job = submit_purchase_csv(client, ds_id, [f"item-{i},{i}" for i in range(rows)])
+    assert reached.wait(5)
+    assert client.post(f"/api/import-jobs/{job['id']}/cancel").json()["cancel_requested"] is True
+    release.set()
+    jobs.wait(job["id"], timeout=5)
+
+    done = client.get(f"/api/import-jobs/{job['id']}").json()
+    assert (done["status"], done["rows_processed"], done["inserted"]) == ("succeeded", rows, rows)
+    assert calls == [2, rows - 2]
+
+
+def test_queued_job_cancelled_before_start_is_skipped(client, db, tmp_path):
+    ds_id = setup_dataset_and_mapping(client)
+    path = tmp_path / "queued.csv"
+    path.write_text("アイテム名,金額\nA,1\n", encoding="utf-8")
+    job = jobs.create_import_job(db, "purchases", ds_id, None, json.dumps({"item_name": "アイテム名", "amount": "金額"}), False, str(path))
+
+    res = client.post(f"/api/import-jobs/{job.id}/cancel")
+    assert res.json()["status"] == "cancelled"
+    jobs.run_import_job(sessionmaker(bind=db.get_bind()), job.id)
+
+    assert client.get(f"/api/import-jobs/{job.id}").json()["status"] == "cancelled"
+    assert client.get(f"/api/purchases?dataset_id={ds_id}").json() == []
+    assert not path.exists()
+    assert client.post("/api/import-jobs/missing/cancel").status_code == 404
+
+
+def test_actual_expense_import_job_and_interrupted_jobs(client, db, tmp_path):
+    ds_id = client.post("/api/datasets", json={"name": "Job DS"}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "job-b", "name": "予算", "total_amount": 1000})
+    client.post("/api/budgets/job-b/import-setting", json={"mapping_json": json.dumps({"item_name": "内容", "amount": "金額"})})
+
+    files = {"file": ("expenses.csv", "内容,金額\n電車,\"1,200\"\nバス,300\n", "text/csv")}
+    res = client.post("/api/budgets/job-b/import-jobs", files=files)
+    assert res.status_code == 202
+    job = res.json()
+    assert (job["dataset_id"], job["budget_id"]) == (ds_id, "job-b")
+    jobs.wait(job["id"], timeout=5)
+    done = client.get(f"/api/import-jobs/{job['id']}").json()
+    assert (done["status"], done["inserted"]) == ("succeeded", 2)
+    assert sorted(e["amount"] for e in client.get("/api/budgets/job-b/actual-expenses").json()) == [300, 1200]
+    assert client.post("/api/budgets/missing/import-jobs", files=files).status_code == 404
+
+    # 再起動前に実行待ちのまま残ったジョブは失敗として記録されます
+    path = tmp_path / "left.csv"
+    path.write_text("内容,金額\n", encoding="utf-8")
+    left = jobs.create_import_job(db, "actual_expenses", ds_id, "job-b", "{}", False, str(path))
+    assert jobs.fail_interrupted_jobs(db) == 1
+    interrupted = client.get(f"/api/import-jobs/{left.id}").json()
+    assert (interrupted["status"], interrupted["message"]) == ("failed", "Interrupted by a server restart")
+    assert not path.exists()
+
+
+def test_only_jobs_of_stopped_workers_are_failed(client, db, tmp_path):
+    ds_id = client.post("/api/datasets", json={"name": "Worker DS"}).json()["id"]
+    finished = subprocess.Popen([sys.executable, "-c", "pass"])
+    finished.wait()
+    host = socket.gethostname()
+    workers = {
+        "live": f"{host}:{os.getppid()}",  # 同じホストで実行中の別のワーカー
+        "remote": "other-host:1",  # 別のホストのワーカー
+        "stopped": f"{host}:{finished.pid}",
+        "legacy": None,  # worker を記録する前のジョブ
+    }
+    created = {}
+    for name, worker in workers.items():
+        path = tmp_path / f"{name}.csv"
+        path.write_text("アイテム名,金額\n", encoding="utf-8")
+        job = jobs.create_import_job(db, "purchases", ds_id, None, "{}", False, str(path))
+        db.query(models.ImportJob).filter(models.ImportJob.id == job.id).update({"worker": worker})
+        db.commit()
+        created[name] = (job.id, path)
+
+    assert jobs.fail_interrupted_jobs(db) == 2
+    for name, (job_id, path) in created.items():
+        stopped = name in ("stopped", "legacy")
+        assert client.get(f"/api/import-jobs/{job_id}").json()["status"] == ("failed" if stopped else "queued")
+        assert path.exists() is not stopped
+
+
+def test_import_job_returns_503_when_busy(client, monkeypatch):
+    ds_id = setup_dataset_and_mapping(client)
+    busy = importers.ImportPool(workers=1, queue_size=0)
+    busy._slots.acquire()
+    monkeypatch.setattr(importers, "import_pool", busy)
+
+    files = {"file": ("busy.csv", "アイテム名,金額\nA,1\n", "text/csv")}
+    res = client.post(f"/api/purchases/import-jobs?dataset_id={ds_id}", files=files)
+    assert res.status_code == 503
+    assert client.get(f"/api/import-jobs?dataset_id={ds_id}").json() == []
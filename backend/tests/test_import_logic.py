@@ -152,3 +152,150 @@ def test_purchase_import_status_normalization(client):
     items = client.get(f"/api/purchases?dataset_id={ds_id}").json()
     assert next(i for i in items if i["item_name"] == "PC")["status"] == "見積済み"
     assert next(i for i in items if i["item_name"] == "マウス")["status"] == "書いただけ"
+
+def test_purchase_import_chunked_counts(client, monkeypatch):
+    """チャンク単位の登録で登録・スキップ・失敗件数が報告され、失敗したチャンクだけが取り消されるか"""
+    from sqlalchemy.exc import OperationalError
+    from osaifill import crud, importers
+
+    ds_id = setup_dataset_and_mapping(client)
+    monkeypatch.setattr(importers, "IMPORT_CHUNK_ROWS", 2)
+
+    original_bulk = crud.insert_purchases_bulk
+    calls = []
+
+    def flaky_bulk(db, dataset_id, purchases):
+        calls.append([p.item_name for p in purchases])
+        if len(calls) == 2:
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return original_bulk(db, dataset_id, purchases)
+
+    monkeypatch.setattr(crud, "insert_purchases_bulk", flaky_bulk)
+
+    csv_rows = ["アイテム名,金額"] + ["A,1", ",2", "B,3", "C,4", "D,5", "E,6"]
+    files = {"file": ("chunks.csv", "\n".join(csv_rows) + "\n", "text/csv")}
+    res = client.post(f"/api/purchases/import-csv?dataset_id={ds_id}", files=files)
+    assert res.status_code == 200
+    body = res.json()
+    assert calls == [["A", "B"], ["C", "D"], ["E"]]
+    assert (body["count"], body["inserted"], body["skipped"], body["failed"]) == (3, 3, 1, 2)
+    assert "database is locked" in body["errors"][0]
+
+    items = client.get(f"/api/purchases?dataset_id={ds_id}").json()
+    assert sorted(i["item_name"] for i in items) == ["A", "B", "E"]
+
+def test_purchase_bulk_import_keeps_order(client):
+    """JSON の一括インポートで入力順に ID が振られ、割当も対応する購入アイテムに紐づくか"""
+    ds_id = client.post("/api/datasets", json={"name": "Bulk DS"}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "bulk-b", "name": "予算", "total_amount": 10000})
+
+    payload = [
+        {"dataset_id": ds_id, "item_name": f"item-{i}", "amount": 100 * (i + 1),
+         "unit": None if i % 2 else "USD", "note": "メモ" if i == 2 else None,
+         "assignments": [{"budget_id": "bulk-b", "amount": 10 * (i + 1)}] if i % 3 == 0 else []}
+        for i in range(7)
+    ]
+    res = client.post(f"/api/purchases/import?dataset_id={ds_id}", json=payload)
+    assert res.status_code == 200
+    created = res.json()
+    assert [p["item_name"] for p in created] == [p["item_name"] for p in payload]
+    assert [p["id"] for p in created] == sorted(p["id"] for p in created)
+    assert [p["unit"] for p in created] == ["USD", "JPY"] * 3 + ["USD"]
+    assert created[2]["note"] == "メモ"
+    assert [[a["amount"] for a in p["assignments"]] for p in created] == [[10], [], [], [40], [], [], [70]]
+    assert all(a["purchase_id"] == p["id"] for p in created for a in p["assignments"])
+
+def test_import_pool_applies_backpressure():
+    """インポートはワーカースレッドで実行され、上限を超えた分は待たずに拒否されるか"""
+    import asyncio
+    import threading
+    from sqlalchemy.orm import Session
+    from osaifill import importers
+
+    pool = importers.ImportPool(workers=1, queue_size=1)
+    session = Session()
+    release = threading.Event()
+    threads = []
+
+    def blocking_import(session, name):
+        threads.append(threading.current_thread().name)
+        release.wait(5)
+        return name
+
+    async def scenario():
+        running = asyncio.ensure_future(pool.run(session, blocking_import, "a"))
+        queued = asyncio.ensure_future(pool.run(session, blocking_import, "b"))
+        await asyncio.sleep(0)
+        with pytest.raises(importers.ImportBusyError):
+            await pool.run(session, blocking_import, "c")
+        release.set()
+        results = await asyncio.gather(running, queued)
+        # 枠が空けば再び受け付けます
+        results.append(await pool.run(session, blocking_import, "d"))
+        return results
+
+    assert asyncio.run(scenario()) == ["a", "b", "d"]
+    assert all(name.startswith("osaifill-import") for name in threads)
+
+
+def test_import_csv_returns_503_when_busy(client, monkeypatch):
+    from osaifill import importers
+
+    ds_id = setup_dataset_and_mapping(client)
+    busy = importers.ImportPool(workers=1, queue_size=0)
+    busy._slots.acquire()
+    monkeypatch.setattr(importers, "import_pool", busy)
+
+    files = {"file": ("busy.csv", "アイテム名,金額\nA,1\n", "text/csv")}
+    res = client.post(f"/api/purchases/import-csv?dataset_id={ds_id}", files=files)
+    assert res.status_code == 503
+    assert res.headers["Retry-After"]
+    assert client.get(f"/api/purchases?dataset_id={ds_id}").json() == []
+
+
+def test_failed_overwrite_import_keeps_existing_purchases(client, db):
+    """読めないファイルで上書きインポートしても、既存の購入アイテムは削除されない"""
+    ds_id = setup_dataset_and_mapping(client)
+    client.post("/api/purchases", json={"dataset_id": ds_id, "item_name": "既存の机", "amount": 1000})
+
+    # UTF-8 として読めない（Shift_JIS の）ファイル
+    csv_content = "アイテム名,金額\n新しい椅子,2000\n".encode("shift_jis")
+    res = client.post(
+        f"/api/purchases/import-csv?dataset_id={ds_id}",
+        files={"file": ("sjis.csv", io.BytesIO(csv_content), "text/csv")}, data={"overwrite": "true"},
+    )
+    assert res.status_code == 500
+    assert [p["item_name"] for p in client.get(f"/api/purchases?dataset_id={ds_id}").json()] == ["既存の机"]
+
+    # 空のファイルを最後まで読めた場合は、従来どおり既存データを削除します
+    res = client.post(
+        f"/api/purchases/import-csv?dataset_id={ds_id}",
+        files={"file": ("empty.csv", io.BytesIO("アイテム名,金額\n".encode("utf-8")), "text/csv")}, data={"overwrite": "true"},
+    )
+    assert res.status_code == 200
+    assert client.get(f"/api/purchases?dataset_id={ds_id}").json() == []
+
+
+def test_row_with_missing_budget_fails_only_that_row(client, db):
+    """存在しない予算を指す行だけが失敗し、同じチャンクの他の行は登録される"""
+    ds_id = setup_dataset_and_mapping(client)
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "b-ok", "name": "予算", "total_amount": 10000})
+
+    csv_content = (
+        "アイテム名,金額,対応予算ID,割当金額\n"
+        "机,1000,b-ok,1000\n"
+        "椅子,500,b-missing,500\n"
+        "棚,300,,\n"
+    )
+    res = client.post(
+        f"/api/purchases/import-csv?dataset_id={ds_id}",
+        files={"file": ("mixed.csv", io.BytesIO(csv_content.encode("utf-8")), "text/csv")},
+    )
+    assert res.status_code == 200
+    body = res.json()
+    assert (body["inserted"], body["failed"]) == (2, 1)
+    assert body["errors"] == ["Row 2: budget 'b-missing' not found"]
+    assert body["message"] == "Import completed with errors"
+
+    purchases = client.get(f"/api/purchases?dataset_id={ds_id}").json()
+    assert sorted(p["item_name"] for p in purchases) == ["机", "棚"]
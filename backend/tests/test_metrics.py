@@ -0,0 +1,70 @@
+import io
+import json
+
+from sqlalchemy import text
+
+from osaifill import metrics
+from osaifill.database import make_engine
+
+
+def test_histogram_renders_cumulative_buckets():
+    hist = metrics.Histogram("test_seconds", "Test.", (0.1, 1.0), ("route",))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        hist.observe(value, "/a")
+
+    lines = hist.render()
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/a",le="1"} 3' in lines
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{route="/a"} 4' in lines
+    assert (hist.count("/a"), hist.sum("/a")) == (4, 4.05)
+
+
+def test_requests_are_counted_per_route_with_sql_statements(client):
+    metrics.reset()
+    ds_id = client.post("/api/datasets", json={"name": "Metrics DS"}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "m-b", "name": "予算", "total_amount": 1000})
+    assert client.get(f"/api/dashboard?dataset_id={ds_id}").status_code == 200
+    assert client.delete("/api/budgets/missing").status_code == 404
+
+    # パスパラメーターではなくルートのテンプレートで集計します
+    assert metrics.HTTP_REQUESTS.value("GET", "/api/dashboard", "200") == 1
+    assert metrics.HTTP_REQUESTS.value("DELETE", "/api/budgets/{budget_id}", "404") == 1
+    # スレッドプールで実行した SQL もリクエストの集計に含まれます
+    assert metrics.HTTP_DB_QUERIES.sum("GET", "/api/dashboard") >= 1
+    assert metrics.HTTP_DB_SECONDS.sum("GET", "/api/dashboard") > 0
+    assert metrics.DB_QUERIES.value() >= metrics.HTTP_DB_QUERIES.sum("POST", "/api/budgets")
+
+    body = client.get("/api/metrics")
+    assert body.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'osaifill_http_requests_total{method="GET",route="/api/dashboard",status="200"} 1' in body.text
+    assert "# TYPE osaifill_http_request_duration_seconds histogram" in body.text
+
+
+def test_import_and_export_rows_are_recorded(client):
+    metrics.reset()
+    ds_id = client.post("/api/datasets", json={"name": "Metrics CSV DS"}).json()["id"]
+    client.post(f"/api/datasets/{ds_id}/purchase-import-setting", json={"mapping_json": json.dumps({"item_name": "品名", "amount": "金額"})})
+    csv_data = "品名,金額\n" + "".join(f"品物{i},{100 + i}\n" for i in range(30))
+    response = client.post(
+        f"/api/purchases/import-csv?dataset_id={ds_id}", files={"file": ("p.csv", io.BytesIO(csv_data.encode("utf-8")), "text/csv")},
+    )
+    assert response.json()["count"] == 30
+    client.get(f"/api/purchases/export-csv?dataset_id={ds_id}")
+
+    assert metrics.ROWS.value("import", "purchases") == 30
+    assert metrics.ROWS.value("export", "purchases") == 30
+    assert metrics.ROW_SECONDS.value("import", "purchases") > 0
+
+
+def test_pool_checkout_wait_is_recorded(tmp_path):
+    metrics.reset()
+    engine = make_engine(f"sqlite:///{tmp_path / 'metrics.db'}", pool_options={"pool_size": 1, "max_overflow": 0})
+    try:
+        for _ in range(3):
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        assert type(engine.pool).__name__ == "TimedQueuePool"
+        assert metrics.POOL_CHECKOUT_WAIT.count() == 3
+    finally:
+        engine.dispose()
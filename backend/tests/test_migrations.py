@@ -0,0 +1,150 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import Connection
+
+from osaifill import migrations
+from osaifill.database import Base, make_engine
+from osaifill.money import to_minor
+
+
+@pytest.fixture
+def file_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'osaifill.db'}")
+    yield engine
+    engine.dispose()
+
+
+def describe_schema(engine):
+    insp = inspect(engine)
+    return {
+        table: (
+            sorted((c["name"], str(c["type"])) for c in insp.get_columns(table)),
+            sorted(i["name"] for i in insp.get_indexes(table)),
+            sorted(
+                (fk["referred_table"], tuple(fk["constrained_columns"]), fk["options"].get("ondelete"))
+                for fk in insp.get_foreign_keys(table)
+            ),
+        )
+        for table in insp.get_table_names()
+        if table != "schema_migrations"
+    }
+
+
+def test_fresh_database_matches_models(file_engine, tmp_path):
+    """マイグレーションで作成したスキーマが models.py の定義と一致するか"""
+    applied = migrations.upgrade(file_engine)
+    assert [m.version for m in applied] == [m.version for m in migrations.MIGRATIONS]
+    assert migrations.current_version(file_engine) == migrations.MIGRATIONS[-1].version
+
+    expected_engine = create_engine(f"sqlite:///{tmp_path / 'expected.db'}")
+    Base.metadata.create_all(bind=expected_engine)
+    assert describe_schema(file_engine) == describe_schema(expected_engine)
+    expected_engine.dispose()
+
+    # 2回目は何も適用されない
+    assert migrations.upgrade(file_engine) == []
+
+
+def test_upgrade_existing_database_in_place(file_engine):
+    """マイグレーション導入前（create_all のみ）のデータベースをデータを保ったまま更新できるか"""
+    with file_engine.begin() as conn:
+        migrations._initial(conn)
+        conn.execute(text("INSERT INTO datasets (id, name) VALUES ('ds', '旧データ')"))
+        conn.execute(text(
+            "INSERT INTO purchases (id, dataset_id, item_name, amount, status) VALUES (1, 'ds', 'ノート', 300, '書いただけ')"
+        ))
+
+    migrations.upgrade(file_engine)
+
+    with file_engine.connect() as conn:
+        assert conn.execute(text("SELECT item_name FROM purchases")).scalar() == "ノート"
+        plan = " ".join(
+            row[-1] for row in conn.execute(text(
+                "EXPLAIN QUERY PLAN SELECT * FROM purchases WHERE dataset_id = 'ds' AND status = '書いただけ'"
+            ))
+        )
+    assert "ix_purchases_dataset_status_category" in plan
+    assert "ix_budget_assignments_budget_purchase" in [
+        i["name"] for i in inspect(file_engine).get_indexes("budget_assignments")
+    ]
+
+
+def test_cascade_migration_drops_orphans_and_cascades_deletes(file_engine):
+    """外部キーを作り直すマイグレーションで、既存の行を保ったまま ON DELETE CASCADE が有効になるか"""
+    migrations.upgrade(file_engine, target=6)
+    with file_engine.begin() as conn:
+        for statement in (
+            "INSERT INTO datasets (id, name) VALUES ('ds', '旧データ')",
+            "INSERT INTO budgets (id, dataset_id, name, total_amount) VALUES ('b', 'ds', '予算', 1000)",
+            "INSERT INTO purchases (id, dataset_id, item_name, amount) VALUES (1, 'ds', 'ノート', 300)",
+            "INSERT INTO budget_assignments (id, purchase_id, budget_id, amount) VALUES (1, 1, 'b', 300)",
+            "INSERT INTO actual_expenses (id, budget_id, amount) VALUES (1, 'b', 100)",
+            # 外部キー制約が無効だった頃に残った、親のない行
+            "INSERT INTO purchases (id, dataset_id, item_name, amount) VALUES (2, 'gone', '孤児', 1)",
+            "INSERT INTO budget_assignments (id, purchase_id, budget_id, amount) VALUES (2, 2, 'gone', 1)",
+        ):
+            conn.execute(text(statement))
+
+    assert 7 in [m.version for m in migrations.upgrade(file_engine)]
+
+    with file_engine.connect() as conn:
+        assert conn.execute(text("SELECT id FROM purchases")).scalars().all() == [1]
+        assert conn.execute(text("SELECT id FROM budget_assignments")).scalars().all() == [1]
+        assert conn.execute(text("PRAGMA foreign_key_check")).fetchall() == []
+
+    engine = make_engine(file_engine.url)
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM datasets WHERE id = 'ds'"))
+            for table in ("budgets", "purchases", "budget_assignments", "actual_expenses"):
+                assert conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar() == 0
+    finally:
+        engine.dispose()
+
+
+def test_integer_money_migration_converts_amounts(file_engine):
+    """金額の列を 1/100 単位の整数に変換し、作り直したテーブルでも全文検索の索引が追従するか"""
+    migrations.upgrade(file_engine, target=8)
+    with file_engine.begin() as conn:
+        for statement in (
+            "INSERT INTO datasets (id, name) VALUES ('ds', '旧データ')",
+            "INSERT INTO budgets (id, dataset_id, name, total_amount) VALUES ('b', 'ds', '予算', 1000.5)",
+            "INSERT INTO purchases (id, dataset_id, item_name, amount) VALUES (1, 'ds', 'ノートパソコン', 0.1)",
+            "INSERT INTO budget_assignments (id, purchase_id, budget_id, amount) VALUES (1, 1, 'b', 0.1)",
+            "INSERT INTO actual_expenses (id, budget_id, item_name, amount) VALUES (1, 'b', '会議室の利用料', 1234.56)",
+            "INSERT INTO actual_expenses (id, budget_id, item_name, amount) VALUES (2, 'b', '切手', 1.005)",
+            "INSERT INTO budget_rollups (budget_id, actual_total, planned_total) VALUES ('b', 1234.56, 0.30000000000000004)",
+        ):
+            conn.execute(text(statement))
+
+    assert [m.version for m in migrations.upgrade(file_engine)] == [9]
+
+    with file_engine.begin() as conn:
+        assert conn.execute(text("SELECT total_amount, typeof(total_amount) FROM budgets")).one() == (100050, "integer")
+        assert conn.execute(text("SELECT amount FROM purchases")).scalar() == 10
+        assert conn.execute(text("SELECT amount FROM budget_assignments")).scalar() == 10
+        # アプリの to_minor と同じく四捨五入します（SQL の ROUND(1.005 * 100) は 100 になります）
+        assert conn.execute(text("SELECT amount FROM actual_expenses ORDER BY id")).scalars().all() == [123456, to_minor(1.005)] == [123456, 101]
+        assert conn.execute(text("SELECT actual_total, planned_total FROM budget_rollups")).one() == (123456, 30)
+
+        conn.execute(text("INSERT INTO purchases (id, dataset_id, item_name, amount) VALUES (2, 'ds', 'プロジェクター', 5000000)"))
+        conn.execute(text("UPDATE purchases SET item_name = 'ノートパソコン（予備）' WHERE id = 1"))
+        assert conn.execute(text("SELECT rowid FROM purchases_fts WHERE purchases_fts MATCH 'プロジェクター'")).scalars().all() == [2]
+        assert conn.execute(text("SELECT rowid FROM purchases_fts WHERE purchases_fts MATCH '（予備）'")).scalars().all() == [1]
+        assert conn.execute(text("SELECT rowid FROM actual_expenses_fts WHERE actual_expenses_fts MATCH '会議室'")).scalars().all() == [1]
+
+
+def test_failed_migration_is_rolled_back(file_engine, monkeypatch):
+    migrations.upgrade(file_engine)
+    latest = migrations.current_version(file_engine)
+
+    def broken(conn: Connection) -> None:
+        conn.exec_driver_sql("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [migrations.Migration(latest + 1, "broken", broken)])
+    with pytest.raises(RuntimeError):
+        migrations.upgrade(file_engine)
+
+    assert "half_done" not in inspect(file_engine).get_table_names()
+    assert migrations.current_version(file_engine) == latest
@@ -0,0 +1,84 @@
+import io
+import json
+
+from sqlalchemy import text
+
+from osaifill import rollup
+from osaifill.money import MAX_AMOUNT, from_minor, to_minor
+
+
+def test_to_minor_rounds_decimal_amounts():
+    assert to_minor(0.1) == 10
+    assert to_minor(1.005) == 101
+    assert to_minor(-2.5) == -250
+    assert to_minor(3) == 300
+    assert from_minor(to_minor(1234.56)) == 1234.56
+
+
+def test_amounts_are_stored_as_integers_and_summed_exactly(client, db):
+    ds_id = client.post("/api/datasets", json={"name": "Money DS"}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "m-1", "name": "予算", "total_amount": 1.3})
+    # 0.1 を 10 回足すと浮動小数点では 0.9999999999999999 になります
+    for _ in range(10):
+        client.post("/api/budgets/m-1/actual-expenses", json={"item_name": "切手", "amount": 0.1})
+    for amount in (0.1, 0.2):
+        res = client.post("/api/purchases", json={
+            "dataset_id": ds_id, "item_name": "文具", "amount": amount, "assignments": [{"budget_id": "m-1", "amount": amount}],
+        })
+        # API は従来どおり小数の金額を返します
+        assert res.json()["amount"] == amount
+
+    assert db.execute(text("SELECT amount, typeof(amount) FROM actual_expenses LIMIT 1")).one() == (10, "integer")
+
+    summary = client.get(f"/api/dashboard?dataset_id={ds_id}").json()
+    assert summary["overall_actual_total"] == 1.0
+    assert summary["overall_planned_total"] == 0.3
+    assert summary["overall_remaining_forecast"] == 0.0
+    assert summary["budgets"][0]["remaining_forecast"] == 0.0
+    assert rollup.verify_dataset(db, ds_id) == []
+
+    # 一括インポートの実績額もデータベース上で合計し直します
+    client.post("/api/budgets/m-1/import-setting", json={"budget_id": "m-1", "mapping_json": '{"item_name": "内容", "amount": "金額"}'})
+    csv_data = "内容,金額\n" + "切手,0.1\n" * 3
+    client.post("/api/budgets/m-1/import-csv", files={"file": ("e.csv", io.BytesIO(csv_data.encode("utf-8")), "text/csv")}, data={"overwrite": "true"})
+    assert client.get(f"/api/dashboard?dataset_id={ds_id}").json()["budgets"][0]["actual_total"] == 0.3
+    assert rollup.verify_dataset(db, ds_id) == []
+
+
+def test_rollover_and_merge_add_amounts_exactly(client):
+    ds_id = client.post("/api/datasets", json={"name": "Money DS"}).json()["id"]
+    for budget_id, total in (("m-1", 0.1), ("m-2", 0.2)):
+        client.post("/api/budgets", json={"dataset_id": ds_id, "id": budget_id, "name": budget_id, "total_amount": total})
+
+    new_ds = client.post("/api/datasets/rollover", json={"new_name": "Next", "source_dataset_id": ds_id}).json()
+    carried = client.get(f"/api/budgets?dataset_id={new_ds['id']}").json()
+    assert [b["total_amount"] for b in carried] == [0.3]
+
+    merged = client.post("/api/budgets/merge", json={"source_budget_id": "m-2", "target_budget_id": "m-1"}).json()
+    assert merged["total_amount"] == 0.3
+
+
+def test_out_of_range_amounts_are_rejected(client):
+    ds_id = client.post("/api/datasets", json={"name": "Money DS"}).json()["id"]
+    assert client.post("/api/budgets", json={"dataset_id": ds_id, "id": "m-1", "name": "予算", "total_amount": MAX_AMOUNT}).status_code == 200
+    # 最小単位への変換や SQLite の INTEGER で溢れる金額は、保存する前に 422 で拒否します
+    for amount in (1e30, -(MAX_AMOUNT + 1)):
+        assert client.post("/api/budgets", json={"dataset_id": ds_id, "name": "大きすぎる予算", "total_amount": amount}).status_code == 422
+        assert client.put("/api/budgets/m-1", json={"total_amount": amount}).status_code == 422
+        res = client.post("/api/purchases", json={
+            "dataset_id": ds_id, "item_name": "文具", "amount": 1, "assignments": [{"budget_id": "m-1", "amount": amount}],
+        })
+        assert res.status_code == 422
+        assert client.post("/api/budgets/m-1/actual-expenses", json={"item_name": "切手", "amount": amount}).status_code == 422
+
+    # CSV インポートでは範囲外の行だけが失敗し、同じチャンクの他の行は登録されます
+    mapping = {"item_name": "アイテム名", "amount": "金額", "budget_id": "予算", "asgn_amount": "割当"}
+    client.post(f"/api/datasets/{ds_id}/purchase-import-setting", json={"mapping_json": json.dumps(mapping)})
+    csv_data = "アイテム名,金額,予算,割当\n机,1000,,\n椅子,1e30,,\n棚,inf,,\n本,500,m-1,1e30\nペン,100,m-1,100\n"
+    res = client.post(f"/api/purchases/import-csv?dataset_id={ds_id}", files={"file": ("p.csv", io.BytesIO(csv_data.encode("utf-8")), "text/csv")})
+    assert res.status_code == 200
+    body = res.json()
+    assert (body["inserted"], body["failed"]) == (2, 3)
+    assert [e.split(":")[0] for e in body["errors"]] == ["Row 2", "Row 3", "Row 4"]
+    items = client.get(f"/api/purchases?dataset_id={ds_id}").json()
+    assert sorted(i["item_name"] for i in items) == ["ペン", "机"]
@@ -0,0 +1,121 @@
+import pytest
+from sqlalchemy import event
+
+from osaifill import crud, schemas
+
+STATUSES = ["書いただけ", "見積済み", "購入済み"]
+CATEGORIES = ["固定費", "旅費", None]
+
+
+def setup_purchases(client, count=23):
+    ds_id = client.post("/api/datasets", json={"name": "Paging DS"}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "pg-b", "name": "予算", "total_amount": 10000})
+    client.post(f"/api/purchases/import?dataset_id={ds_id}", json=[
+        {
+            "dataset_id": ds_id, "item_name": f"item-{i}", "amount": (i * 37) % 11 * 100,
+            "status": STATUSES[i % 3], "category": CATEGORIES[i % 3], "priority": i % 5 + 1,
+            "member_name": "A" if i % 2 else "B",
+            "assignments": [{"budget_id": "pg-b", "amount": 10}] if i % 4 == 0 else [],
+        }
+        for i in range(count)
+    ])
+    return ds_id
+
+
+def read_all_pages(client, url, limit):
+    items, cursor, pages = [], None, 0
+    while True:
+        res = client.get(f"{url}&limit={limit}" + (f"&cursor={cursor}" if cursor else ""))
+        assert res.status_code == 200
+        page = res.json()
+        assert len(page) <= limit
+        items.extend(page)
+        pages += 1
+        cursor = res.headers.get("X-Next-Cursor")
+        if not cursor:
+            return items, pages
+
+
+@pytest.mark.parametrize("sort", ["id", "amount", "priority", "category"])
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_purchase_pages_match_full_listing(client, sort, order):
+    """ページを順にたどった結果が、limit なしの一覧と同じ並び・同じ件数になるか（重複・欠落なし）"""
+    ds_id = setup_purchases(client)
+    url = f"/api/purchases?dataset_id={ds_id}&sort={sort}&order={order}"
+    everything = client.get(url).json()
+    assert len(everything) == 23
+    assert "X-Next-Cursor" not in client.get(url).headers
+
+    paged, pages = read_all_pages(client, url, limit=5)
+    assert [p["id"] for p in paged] == [p["id"] for p in everything]
+    assert pages == 5
+
+    # NULL を含む列でも SQLite の並び順（昇順で NULL が先頭）と一致すること
+    def key(p):
+        v = p[sort]
+        return (v is not None, v if v is not None else 0, p["id"])
+    expected = sorted(everything, key=key, reverse=(order == "desc"))
+    assert [p["id"] for p in everything] == [p["id"] for p in expected]
+
+
+def test_purchase_filters(client):
+    ds_id = setup_purchases(client)
+    res = client.get(
+        f"/api/purchases?dataset_id={ds_id}&status=書いただけ&status=見積済み&category=固定費"
+        "&member_name=B&priority_min=2&priority_max=4"
+    ).json()
+    assert res and all(
+        p["status"] in ("書いただけ", "見積済み") and p["category"] == "固定費" and p["member_name"] == "B"
+        and 2 <= p["priority"] <= 4
+        for p in res
+    )
+
+    assigned = client.get(f"/api/purchases?dataset_id={ds_id}&budget_id=pg-b").json()
+    assert [p["item_name"] for p in assigned] == [f"item-{i}" for i in range(0, 23, 4)]
+    assert all(p["assignments"] for p in assigned)
+
+
+def test_expense_and_budget_pages(client):
+    ds_id = setup_purchases(client, count=1)
+    for i in range(7):
+        client.post("/api/budgets/pg-b/actual-expenses", json={"item_name": f"exp-{i}", "amount": (i * 3) % 4})
+    everything = client.get("/api/budgets/pg-b/actual-expenses?sort=amount&order=desc").json()
+    paged, _ = read_all_pages(client, "/api/budgets/pg-b/actual-expenses?sort=amount&order=desc", limit=3)
+    assert [e["id"] for e in paged] == [e["id"] for e in everything]
+    assert [e["amount"] for e in everything] == sorted((e["amount"] for e in everything), reverse=True)
+
+    for name in ["c", "a", "b"]:
+        client.post("/api/budgets", json={"dataset_id": ds_id, "id": f"pg-x{name}", "name": name, "total_amount": 1})
+    names, _ = read_all_pages(client, f"/api/budgets?dataset_id={ds_id}&sort=name", limit=2)
+    assert [b["name"] for b in names] == ["a", "b", "c", "予算"]
+
+
+def test_invalid_page_parameters(client):
+    ds_id = setup_purchases(client, count=1)
+    assert client.get(f"/api/purchases?dataset_id={ds_id}&cursor=not-a-cursor").status_code == 400
+    assert client.get(f"/api/purchases?dataset_id={ds_id}&limit=0").status_code == 422
+    assert client.get(f"/api/purchases?dataset_id={ds_id}&sort=item_name").status_code == 422
+
+
+@pytest.mark.parametrize("sort", ["id", "amount", "priority", "category"])
+def test_purchase_sorts_use_indexes(db, client, sort):
+    """各並び順が一時 B-tree でのソートではなくインデックスの順で読み出されるか"""
+    ds_id = setup_purchases(client, count=3)
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SELECT purchases."):
+            statements.append((statement, parameters))
+
+    engine = db.get_bind().engine
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        first = crud.get_purchases(db, ds_id, schemas.PurchaseListQuery(dataset_id=ds_id, sort=sort, limit=1))
+        crud.get_purchases(db, ds_id, schemas.PurchaseListQuery(dataset_id=ds_id, sort=sort, limit=1, cursor=first.next_cursor))
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    assert len(statements) == 2
+    for statement, parameters in statements:
+        plan = " ".join(str(row[-1]) for row in db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters))
+        assert "TEMP B-TREE" not in plan, plan
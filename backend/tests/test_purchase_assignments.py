@@ -0,0 +1,49 @@
+from osaifill import querylog, rollup
+
+
+def setup_purchase(client):
+    ds_id = client.post("/api/datasets", json={"name": "Assign DS"}).json()["id"]
+    for budget_id in ("as-1", "as-2", "as-3"):
+        client.post("/api/budgets", json={"dataset_id": ds_id, "id": budget_id, "name": budget_id, "total_amount": 1000})
+    purchase = client.post("/api/purchases", json={
+        "dataset_id": ds_id, "item_name": "机", "amount": 300, "status": "見積済み",
+        "assignments": [{"budget_id": "as-1", "amount": 100}, {"budget_id": "as-2", "amount": 200}],
+    }).json()
+    return ds_id, purchase
+
+
+def assignment_ids(purchase):
+    return {a["budget_id"]: a["id"] for a in purchase["assignments"]}
+
+
+def test_unchanged_assignments_are_not_rewritten(client, db):
+    ds_id, purchase = setup_purchase(client)
+
+    # 順序だけが違う同じ割当と、同じ値の項目では書き込みを行いません
+    with querylog.capture() as log:
+        res = client.put(f"/api/purchases/{purchase['id']}", json={
+            "item_name": "机", "amount": 300,
+            "assignments": [{"budget_id": "as-2", "amount": 200}, {"budget_id": "as-1", "amount": 100}],
+        })
+    assert res.status_code == 200
+    writes = [q.statement for q in log.queries if q.statement.lstrip().split()[0].upper() in ("INSERT", "UPDATE", "DELETE")]
+    assert writes == []
+    assert assignment_ids(res.json()) == assignment_ids(purchase)
+
+
+def test_assignments_are_diffed_by_budget(client, db):
+    ds_id, purchase = setup_purchase(client)
+    before = assignment_ids(purchase)
+
+    res = client.put(f"/api/purchases/{purchase['id']}", json={
+        "assignments": [{"budget_id": "as-1", "amount": 150}, {"budget_id": "as-3", "amount": 50}],
+    })
+    after = {a["budget_id"]: (a["id"], a["amount"]) for a in res.json()["assignments"]}
+
+    # as-1 は同じ行を更新し、as-2 は削除、as-3 は追加します
+    assert after["as-1"] == (before["as-1"], 150)
+    assert set(after) == {"as-1", "as-3"}
+    assert after["as-3"][0] not in before.values()
+    assert rollup.verify_dataset(db, ds_id) == []
+    budgets = {b["budget_id"]: b["planned_total"] for b in client.get(f"/api/dashboard?dataset_id={ds_id}").json()["budgets"]}
+    assert budgets == {"as-1": 150, "as-2": 0, "as-3": 50}
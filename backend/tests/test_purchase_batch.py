@@ -0,0 +1,65 @@
+from osaifill import querylog, rollup
+
+
+def setup_dataset(client, budget_id="bt-1"):
+    ds_id = client.post("/api/datasets", json={"name": "Batch DS"}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": budget_id, "name": "予算", "total_amount": 10000})
+    ids = []
+    for i, (category, member) in enumerate([("旅費", "A"), ("旅費", "B"), ("固定費", "A"), ("その他", "A")]):
+        ids.append(client.post("/api/purchases", json={
+            "dataset_id": ds_id, "item_name": f"品物{i}", "amount": 1000, "category": category, "member_name": member,
+            "status": "書いただけ", "assignments": [{"budget_id": budget_id, "amount": 400}],
+        }).json()["id"])
+    return ds_id, ids
+
+
+def test_batch_update_by_ids(client, db):
+    ds_id, ids = setup_dataset(client)
+    other_ds, other_ids = setup_dataset(client, "bt-other")
+
+    # 別のデータセットの ID は対象になりません
+    res = client.patch("/api/purchases/batch", json={
+        "dataset_id": ds_id, "ids": ids[:2] + other_ids[:1], "patch": {"priority": 1, "status": "購入済み"}, "return_rows": True,
+    })
+    assert res.status_code == 200
+    body = res.json()
+    assert body["updated"] == 2
+    assert [(p["id"], p["priority"], p["status"]) for p in body["purchases"]] == [(i, 1, "購入済み") for i in ids[:2]]
+    assert body["purchases"][0]["assignments"][0]["budget_id"] == "bt-1"
+
+    statuses = {p["id"]: p["status"] for p in client.get(f"/api/purchases?dataset_id={other_ds}").json()}
+    assert set(statuses.values()) == {"書いただけ"}
+    # ステータスの変更はロールアップ（予定額）に反映されます
+    assert rollup.verify_dataset(db, ds_id) == []
+    assert client.get(f"/api/dashboard?dataset_id={ds_id}").json()["travel_planned_total"] == 0
+
+
+def test_batch_update_by_filter_in_one_statement(client, db):
+    ds_id, ids = setup_dataset(client)
+
+    # 条件に使った項目（status）を更新しても、条件から外れた行の差分がロールアップに反映されます
+    with querylog.capture() as log:
+        res = client.patch("/api/purchases/batch", json={
+            "dataset_id": ds_id, "filter": {"status": ["書いただけ"], "category": ["旅費"]}, "patch": {"status": "保留"},
+        })
+    assert res.json() == {"updated": 2, "purchases": None}
+    assert len([q for q in log.queries if q.statement.lstrip().upper().startswith("UPDATE PURCHASES")]) == 1
+    assert rollup.verify_dataset(db, ds_id) == []
+
+    # ロールアップに関係しない項目だけなら集計は行いません
+    with querylog.assert_max_queries(2):
+        res = client.patch("/api/purchases/batch", json={"dataset_id": ds_id, "filter": {"member_name": "A"}, "patch": {"note": "まとめて"}})
+    assert res.json()["updated"] == 3
+    notes = {p["id"]: p["note"] for p in client.get(f"/api/purchases?dataset_id={ds_id}").json()}
+    assert notes == {ids[0]: "まとめて", ids[1]: None, ids[2]: "まとめて", ids[3]: "まとめて"}
+
+
+def test_batch_update_requires_one_target_and_a_patch(client):
+    ds_id, ids = setup_dataset(client)
+    for body in (
+        {"dataset_id": ds_id, "patch": {"priority": 1}},
+        {"dataset_id": ds_id, "ids": ids, "filter": {}, "patch": {"priority": 1}},
+        {"dataset_id": ds_id, "ids": ids, "patch": {}},
+    ):
+        assert client.patch("/api/purchases/batch", json=body).status_code == 400
+    assert client.patch("/api/purchases/batch", json={"dataset_id": ds_id, "ids": [], "patch": {"priority": 1}}).status_code == 422
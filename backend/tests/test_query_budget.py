@@ -0,0 +1,95 @@
+import logging
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from osaifill import querylog
+from osaifill.database import get_db
+
+
+def setup_dataset(client, budgets):
+    ds_id = client.post("/api/datasets", json={"name": "Budget DS"}).json()["id"]
+    client.post("/api/members", json={"dataset_id": ds_id, "name": "担当"})
+    for b in range(budgets):
+        client.post("/api/budgets", json={"dataset_id": ds_id, "id": f"qb-{b}", "name": f"予算{b}", "total_amount": 1000})
+        client.post(f"/api/budgets/qb-{b}/actual-expenses", json={"budget_id": f"qb-{b}", "item_name": "実績", "amount": 10})
+    for i in range(budgets * 2):
+        client.post("/api/purchases", json={
+            "dataset_id": ds_id, "item_name": f"品物{i}", "amount": 100, "category": "旅費", "status": "買い物中",
+            "assignments": [{"budget_id": f"qb-{i % budgets}", "amount": 50}, {"budget_id": f"qb-{(i + 1) % budgets}", "amount": 50}],
+        })
+    return ds_id
+
+
+# エンドポイントごとのクエリ数の上限（データの件数に依存しないこと）
+QUERY_BUDGETS = {
+    "dashboard": (7, lambda c, ds: c.get(f"/api/dashboard?dataset_id={ds}")),
+    "budget_list": (5, lambda c, ds: c.get(f"/api/budgets?dataset_id={ds}")),
+    "purchase_list": (3, lambda c, ds: c.get(f"/api/purchases?dataset_id={ds}")),
+    "member_list": (2, lambda c, ds: c.get(f"/api/members?dataset_id={ds}")),
+    "actual_expense_list": (2, lambda c, ds: c.get("/api/budgets/qb-0/actual-expenses")),
+    "export_csv": (2, lambda c, ds: c.get(f"/api/purchases/export-csv?dataset_id={ds}")),
+    "update_purchase": (13, lambda c, ds: c.put("/api/purchases/1", json={
+        "dataset_id": ds, "item_name": "更新", "amount": 10, "assignments": [{"budget_id": "qb-0", "amount": 5}],
+    })),
+    "batch_update_purchases": (6, lambda c, ds: c.patch("/api/purchases/batch", json={
+        "dataset_id": ds, "filter": {"status": ["買い物中"]}, "patch": {"status": "購入済み", "priority": 1},
+    })),
+    "rollover_dataset": (9, lambda c, ds: c.post("/api/datasets/rollover", json={"new_name": "翌年度", "source_dataset_id": ds})),
+    "rollover_dataset_per_budget": (9, lambda c, ds: c.post("/api/datasets/rollover", json={
+        "new_name": "翌年度", "source_dataset_id": ds, "budget_carry_over": "per_budget",
+    })),
+    "merge_many_budgets": (18, lambda c, ds: c.post("/api/budgets/merge-many", json={"source_budget_ids": ["qb-1", "qb-2"], "target_budget_id": "qb-0"})),
+    "delete_dataset": (2, lambda c, ds: c.delete(f"/api/datasets/{ds}")),
+    "delete_budget": (7, lambda c, ds: c.delete("/api/budgets/qb-0")),
+    "merge_budgets": (18, lambda c, ds: c.post("/api/budgets/merge", json={"source_budget_id": "qb-1", "target_budget_id": "qb-0"})),
+}
+
+
+@pytest.mark.parametrize("name", list(QUERY_BUDGETS))
+@pytest.mark.parametrize("budgets", [3, 8])
+def test_endpoint_query_budget(client, db, name, budgets):
+    limit, call = QUERY_BUDGETS[name]
+    ds_id = setup_dataset(client, budgets)
+    db.expire_all()
+    with querylog.assert_max_queries(limit):
+        assert call(client, ds_id).status_code == 200
+
+
+def test_assert_max_queries_flags_budget_and_repeated_statements(db):
+    with querylog.assert_max_queries(2) as log:
+        db.execute(text("SELECT 1"))
+    assert log.count == 1
+
+    with pytest.raises(querylog.QueryBudgetExceeded, match="3 queries executed"):
+        with querylog.assert_max_queries(2, repeat_threshold=None):
+            for i in range(3):
+                db.execute(text("SELECT :i"), {"i": i})
+
+    # パラメーターだけが違う同じ文の繰り返しは、上限の範囲内でも N+1 として検出します
+    with pytest.raises(querylog.QueryBudgetExceeded, match="executed 3 times"):
+        with querylog.assert_max_queries(10, repeat_threshold=3):
+            for i in range(3):
+                db.execute(text("SELECT :i"), {"i": i})
+
+
+def test_middleware_reports_query_count_and_warns_on_repeats(db, caplog):
+    app = FastAPI()
+
+    @app.get("/loop")
+    def loop(n: int, session=Depends(get_db)):
+        for i in range(n):
+            session.execute(text("SELECT :i"), {"i": i})
+        return {"n": n}
+
+    app.dependency_overrides[get_db] = lambda: db
+    querylog.install()
+    client = TestClient(querylog.QueryLogMiddleware(app, repeat_threshold=3))
+
+    with caplog.at_level(logging.WARNING, logger="osaifill.querylog"):
+        assert client.get("/loop?n=2").headers["x-query-count"] == "2"
+        assert not caplog.records
+        assert client.get("/loop?n=4").headers["x-query-count"] == "4"
+    assert "GET /loop executed the same statement 4 times" in caplog.text
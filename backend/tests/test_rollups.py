@@ -0,0 +1,113 @@
+import pytest
+import json
+
+from osaifill import models, rollup
+
+
+def setup_dataset(client):
+    ds_id = client.post("/api/datasets", json={"name": "Rollup DS"}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "r-1", "name": "予算1", "total_amount": 10000})
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "r-2", "name": "予算2", "total_amount": 5000})
+    return ds_id
+
+
+def test_rollups_follow_every_write_path(client, db):
+    """各書き込み経路の後でロールアップが実データからの再計算と一致するか"""
+    ds_id = setup_dataset(client)
+
+    # 購入アイテムの作成・更新・ステータス変更・削除
+    p1 = client.post("/api/purchases", json={
+        "dataset_id": ds_id, "item_name": "家賃", "amount": 4000, "category": "固定費",
+        "assignments": [{"budget_id": "r-1", "amount": 3000}],
+    }).json()["id"]
+    p2 = client.post("/api/purchases", json={
+        "dataset_id": ds_id, "item_name": "新幹線", "amount": 2000, "category": "旅費",
+        "assignments": [{"budget_id": "r-2", "amount": 2000}],
+    }).json()["id"]
+    assert rollup.verify_dataset(db, ds_id) == []
+
+    client.put(f"/api/purchases/{p1}", json={
+        "amount": 4500, "assignments": [{"budget_id": "r-1", "amount": 1000}, {"budget_id": "r-2", "amount": 500}],
+    })
+    client.patch(f"/api/purchases/{p2}/status?status=購入済み")
+    assert rollup.verify_dataset(db, ds_id) == []
+
+    # 一括インポート
+    client.post(f"/api/purchases/import?dataset_id={ds_id}", json=[
+        {"dataset_id": ds_id, "item_name": "備品", "amount": 800, "assignments": [{"budget_id": "r-2", "amount": 300}]},
+        {"dataset_id": ds_id, "item_name": "消耗品", "amount": 200},
+    ])
+    client.delete(f"/api/purchases/{p2}")
+    assert rollup.verify_dataset(db, ds_id) == []
+
+    # 実績の作成・更新・削除・CSVインポート（追加・上書き）
+    exp_id = client.post("/api/budgets/r-1/actual-expenses", json={"item_name": "食費", "amount": 700}).json()["id"]
+    client.put(f"/api/actual-expenses/{exp_id}", json={"item_name": "食費", "amount": 900})
+    client.post("/api/budgets/r-2/actual-expenses", json={"item_name": "雑費", "amount": 100})
+    client.post("/api/budgets/r-2/import-setting", json={"mapping_json": '{"item_name": "内容", "amount": "金額"}'})
+    files = {"file": ("a.csv", "内容,金額\nA,50\nB,25\n", "text/csv")}
+    client.post("/api/budgets/r-2/import-csv", files=files, data={"overwrite": "false"})
+    assert rollup.verify_dataset(db, ds_id) == []
+    files = {"file": ("b.csv", "内容,金額\nC,400\n", "text/csv")}
+    client.post("/api/budgets/r-2/import-csv", files=files, data={"overwrite": "true"})
+    assert rollup.verify_dataset(db, ds_id) == []
+
+    # 予算の統合・削除
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "r-3", "name": "予算3", "total_amount": 1000})
+    client.post("/api/purchases", json={
+        "dataset_id": ds_id, "item_name": "移動される", "amount": 600,
+        "assignments": [{"budget_id": "r-3", "amount": 600}],
+    })
+    client.post("/api/budgets/merge", json={"source_budget_id": "r-2", "target_budget_id": "r-3"})
+    assert rollup.verify_dataset(db, ds_id) == []
+    client.delete("/api/budgets/r-3")
+    assert rollup.verify_dataset(db, ds_id) == []
+
+    summary = client.get(f"/api/dashboard?dataset_id={ds_id}").json()
+    assert summary["unassigned_planned_total"] == 4500 - 1000 + 800 + 200 + 600
+    assert [b["budget_id"] for b in summary["budgets"]] == ["r-1"]
+    assert summary["budgets"][0]["actual_total"] == 900
+    assert summary["budgets"][0]["planned_total"] == 1000
+
+    # 購入アイテムの全削除（上書きインポート）
+    client.post(
+        f"/api/datasets/{ds_id}/purchase-import-setting",
+        json={"mapping_json": json.dumps({"item_name": "アイテム名", "amount": "金額"})},
+    )
+    files = {"file": ("p.csv", "アイテム名,金額\n新規,300\n", "text/csv")}
+    client.post(f"/api/purchases/import-csv?dataset_id={ds_id}", files=files, data={"overwrite": "true"})
+    assert rollup.verify_dataset(db, ds_id) == []
+
+
+def test_rollup_drift_is_detected_and_rebuilt(client, db):
+    ds_id = setup_dataset(client)
+    client.post("/api/purchases", json={
+        "dataset_id": ds_id, "item_name": "家賃", "amount": 4000, "category": "固定費",
+        "assignments": [{"budget_id": "r-1", "amount": 4000}],
+    })
+
+    db.query(models.BudgetRollup).filter(models.BudgetRollup.budget_id == "r-1").update(
+        {models.BudgetRollup.planned_total: 1.0}
+    )
+    drifts = rollup.verify_dataset(db, ds_id)
+    assert [(d.budget_id, d.field, d.expected) for d in drifts] == [("r-1", "planned_total", 4000.0)]
+
+    rollup.rebuild_dataset(db, ds_id)
+    assert rollup.verify_dataset(db, ds_id) == []
+
+
+def test_dashboard_backfills_missing_rollups(client, db):
+    """ロールアップ導入前に作成されたデータセットは初回のダッシュボード表示で補完されるか"""
+    ds_id = setup_dataset(client)
+    client.post("/api/budgets/r-1/actual-expenses", json={"item_name": "食費", "amount": 300})
+    client.post("/api/purchases", json={"dataset_id": ds_id, "item_name": "電気代", "amount": 1200, "category": "固定費"})
+
+    db.query(models.BudgetRollup).delete()
+    db.query(models.DatasetRollup).delete()
+    db.commit()
+
+    summary = client.get(f"/api/dashboard?dataset_id={ds_id}").json()
+    assert summary["overall_actual_total"] == 300
+    assert summary["fixed_cost_planned_total"] == 1200
+    assert summary["unassigned_planned_total"] == 1200
+    assert rollup.verify_dataset(db, ds_id) == []
@@ -0,0 +1,98 @@
+import io
+import json
+
+from sqlalchemy import text
+
+from osaifill import search
+
+
+def setup_dataset(client, name="Search DS", budget_id="sr-1"):
+    ds_id = client.post("/api/datasets", json={"name": name}).json()["id"]
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": budget_id, "name": "予算", "total_amount": 100000})
+    ids = {}
+    for item_name, note, member in [
+        ("ノートパソコン", "在宅勤務用のノートパソコン", "田中"),
+        ("ボールペン", "事務用品", "鈴木"),
+        ("パソコン用の机", None, "田中"),
+        ("新幹線の切符", "出張", "佐藤"),
+        ("マウス", "ノートパソコン用", "鈴木"),
+    ]:
+        ids[item_name] = client.post("/api/purchases", json={
+            "dataset_id": ds_id, "item_name": item_name, "amount": 1000, "note": note, "member_name": member,
+        }).json()["id"]
+    return ds_id, ids
+
+
+def names(res):
+    assert res.status_code == 200, res.text
+    return [p["item_name"] for p in res.json()]
+
+
+def test_purchase_search_ranks_substring_matches(client):
+    ds_id, ids = setup_dataset(client)
+    other_ds, _ = setup_dataset(client, "Other DS", "sr-2")
+
+    # 3 文字以上の語は trigram の索引で部分一致し、関連度（品名とメモの両方に含む方が上位）の順に並びます
+    assert names(client.get(f"/api/purchases/search?dataset_id={ds_id}&q=ノートパソコン")) == ["ノートパソコン", "マウス"]
+    assert sorted(names(client.get(f"/api/purchases/search?dataset_id={ds_id}&q=パソコン"))) == ["ノートパソコン", "パソコン用の机", "マウス"]
+    # 空白区切りの語はすべてを含むものに一致します（2 文字以下の語は LIKE で絞り込みます）
+    assert names(client.get(f"/api/purchases/search?dataset_id={ds_id}&q=パソコン 机")) == ["パソコン用の机"]
+    assert names(client.get(f"/api/purchases/search?dataset_id={ds_id}&q=田中")) == ["ノートパソコン", "パソコン用の机"]
+    assert names(client.get(f"/api/purchases/search?dataset_id={ds_id}&q=事務用")) == ["ボールペン"]
+    assert names(client.get(f"/api/purchases/search?dataset_id={ds_id}&q=\"%_")) == []
+    assert client.get(f"/api/purchases/search?dataset_id={ds_id}&q=").status_code == 422
+    # 空白だけの q もすべての購入アイテムを返さずに 422 になります
+    assert client.get(f"/api/purchases/search?dataset_id={ds_id}&q=%20%E3%80%80%20").status_code == 422
+
+    # ページネーション（X-Next-Cursor）
+    first = client.get(f"/api/purchases/search?dataset_id={ds_id}&q=ノートパソコン&limit=1")
+    assert names(first) == ["ノートパソコン"]
+    second = client.get(f"/api/purchases/search?dataset_id={ds_id}&q=ノートパソコン&limit=1&cursor={first.headers['x-next-cursor']}")
+    assert names(second) == ["マウス"]
+    assert "x-next-cursor" not in second.headers
+
+
+def test_search_index_follows_writes_and_imports(client, db):
+    ds_id, ids = setup_dataset(client)
+    url = f"/api/purchases/search?dataset_id={ds_id}&q="
+
+    client.put(f"/api/purchases/{ids['ボールペン']}", json={"item_name": "万年筆セット"})
+    assert names(client.get(url + "ボールペン")) == []
+    assert names(client.get(url + "万年筆")) == ["万年筆セット"]
+
+    client.delete(f"/api/purchases/{ids['新幹線の切符']}")
+    assert names(client.get(url + "新幹線")) == []
+
+    # CSV インポートの一括 INSERT も索引に登録されます
+    client.post(f"/api/datasets/{ds_id}/purchase-import-setting", json={"mapping_json": json.dumps({"item_name": "品名", "amount": "金額"})})
+    csv_data = "品名,金額\nプロジェクター,50000\n延長ケーブル,1200\n"
+    client.post(f"/api/purchases/import-csv?dataset_id={ds_id}", files={"file": ("p.csv", io.BytesIO(csv_data.encode("utf-8")), "text/csv")})
+    assert names(client.get(url + "プロジェクター")) == ["プロジェクター"]
+
+    # データセットの削除（ON DELETE CASCADE）でも索引から消えます
+    client.delete(f"/api/datasets/{ds_id}")
+    assert db.execute(text("SELECT COUNT(*) FROM purchases_fts WHERE purchases_fts MATCH 'プロジェクター'")).scalar() == 0
+
+
+def test_actual_expense_search_and_rebuild(client, db):
+    ds_id, _ = setup_dataset(client)
+    client.post("/api/budgets", json={"dataset_id": ds_id, "id": "sr-3", "name": "予算3", "total_amount": 1000})
+    client.post("/api/budgets/sr-1/actual-expenses", json={"item_name": "タクシー代（出張）", "amount": 3000})
+    client.post("/api/budgets/sr-3/actual-expenses", json={"item_name": "タクシー代", "amount": 2000})
+    client.post("/api/budgets/sr-3/actual-expenses", json={"item_name": "会議室の利用料", "amount": 5000})
+
+    def amounts(query):
+        res = client.get(f"/api/actual-expenses/search?dataset_id={ds_id}&{query}")
+        assert res.status_code == 200, res.text
+        return sorted(e["amount"] for e in res.json())
+
+    assert amounts("q=タクシー") == [2000, 3000]
+    assert amounts("q=タクシー&budget_id=sr-3") == [2000]
+    assert amounts("q=会議") == [5000]
+
+    # 索引を空にしても、rebuild で元のテーブルから作り直せます
+    db.execute(text("INSERT INTO actual_expenses_fts(actual_expenses_fts) VALUES ('delete-all')"))
+    db.commit()
+    assert db.execute(text("SELECT COUNT(*) FROM actual_expenses_fts WHERE actual_expenses_fts MATCH 'タクシー'")).scalar() == 0
+    search.rebuild(db)
+    assert db.execute(text("SELECT COUNT(*) FROM actual_expenses_fts WHERE actual_expenses_fts MATCH 'タクシー'")).scalar() == 2
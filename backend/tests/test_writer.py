@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from osaifill import crud, migrations, models, rollup, schemas, writer
+from osaifill.database import get_db, make_engine
+from osaifill.main import app
+
+
+@pytest.fixture
+def file_db(tmp_path):
+    url = f"sqlite:///{tmp_path / 'writer.db'}"
+    engine = make_engine(url)
+    migrations.upgrade(engine)
+    coordinator = writer.WriteCoordinator(writer.make_writer_engine(url), max_batch=64, max_delay=0.005)
+    yield sessionmaker(bind=engine, autoflush=False), coordinator
+    coordinator.close()
+    engine.dispose()
+
+
+def test_concurrent_writes_are_group_committed_with_separate_results(file_db):
+    SessionLocal, coordinator = file_db
+    with SessionLocal() as db:
+        ds_id = str(crud.create_dataset(db, schemas.DatasetCreate(name="Writer DS")).id)
+        crud.create_budget(db, schemas.BudgetCreate(id="w-b", dataset_id=ds_id, name="予算", total_amount=1000))
+
+    results, errors = [], []
+    lock = threading.Lock()
+
+    def client_thread(i):
+        try:
+            if i % 10 == 9:
+                # 引数が不正な書き込みは crud 関数の中で例外になります
+                value = coordinator.submit(crud.update_budget, "w-b", None).result(5)
+            else:
+                value = coordinator.submit(crud.create_purchase, schemas.PurchaseCreate(
+                    dataset_id=ds_id, item_name=f"item-{i}", amount=100,
+                    assignments=[schemas.BudgetAssignmentCreate(budget_id="w-b", amount=100)],
+                ), as_model=schemas.Purchase).result(5)
+            with lock:
+                results.append(value)
+        except AttributeError as e:
+            with lock:
+                errors.append(e)
+
+    threads = [threading.Thread(target=client_thread, args=(i,)) for i in range(40)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(results) == 36 and len(errors) == 4
+    assert all(isinstance(r, schemas.Purchase) and r.assignments[0].amount == 100 for r in results)
+    assert len({r.id for r in results}) == 36
+    # 失敗した書き込みだけが取り消され、同じバッチの他の書き込みはコミットされます
+    assert coordinator.writes == 40
+    assert coordinator.batches < coordinator.writes
+    with SessionLocal() as db:
+        assert db.query(models.Purchase).count() == 36
+        assert rollup.verify_dataset(db, ds_id) == []
+        assert db.query(models.Dataset.version).scalar() >= 1
+
+
+def test_api_writes_go_through_the_coordinator(file_db, monkeypatch):
+    SessionLocal, coordinator = file_db
+    monkeypatch.setattr(writer, "write_coordinator", coordinator)
+
+    def override_get_db():
+        with SessionLocal() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        with TestClient(app) as client:
+            ds_id = client.post("/api/datasets", json={"name": "API Writer DS"}).json()["id"]
+            client.post("/api/budgets", json={"dataset_id": ds_id, "id": "api-w-b", "name": "予算", "total_amount": 1000})
+            created = client.post("/api/purchases", json={
+                "dataset_id": ds_id, "item_name": "品物", "amount": 400, "assignments": [{"budget_id": "api-w-b", "amount": 400}],
+            }).json()
+            assert client.patch(f"/api/purchases/{created['id']}/status?status=購入済み").json()["status"] == "購入済み"
+            assert client.delete("/api/budgets/missing").status_code == 404
+
+            dashboard = client.get(f"/api/dashboard?dataset_id={ds_id}").json()
+            assert dashboard["budgets"][0]["actual_total"] == 0
+            assert [p["item_name"] for p in client.get(f"/api/purchases?dataset_id={ds_id}").json()] == ["品物"]
+    finally:
+        app.dependency_overrides.clear()
+    assert coordinator.writes >= 5
@@ -15,6 +15,7 @@ export function DatasetForm({ onClose, onSuccess }: DatasetFormProps) {
   const [name, setName] = useState("");
   const [sourceId, setSourceId] = useState<string | null>(activeDatasetId);
   const [carryBudget, setCarryBudget] = useState(true);
+  const [carryPerBudget, setCarryPerBudget] = useState(false);
   const [carryMembers, setCarryMembers] = useState(true);
   const [carrySettings, setCarrySettings] = useState(true);
   const [isSubmitting, setIsSubmitting] = useState(false);
@@ -30,7 +31,8 @@ export function DatasetForm({ onClose, onSuccess }: DatasetFormProps) {
         source_dataset_id: sourceId,
         carry_over_budget: carryBudget,
         carry_over_members: carryMembers,
-        carry_over_settings: carrySettings
+        carry_over_settings: carrySettings,
+        budget_carry_over: carryPerBudget ? "per_budget" : "merged"
       });
       onSuccess(newDs.id);
     } catch (error) {
@@ -106,6 +108,15 @@ export function DatasetForm({ onClose, onSuccess }: DatasetFormProps) {
                       <Wallet className="h-3.5 w-3.5" /> {t('dataset.carry_budget')}
                     </span>
                   </label>
+
+                  {carryBudget && (
+                    <label className="flex items-center gap-2 cursor-pointer group pl-6">
+                      <input type="checkbox" checked={carryPerBudget} onChange={e => setCarryPerBudget(e.target.checked)} className="h-4 w-4" />
+                      <span className="text-ui-small text-muted-foreground group-hover:text-primary transition-colors">
+                        {t('dataset.carry_budget_per_wallet')}
+                      </span>
+                    </label>
+                  )}
                 </div>
               )}
             </div>
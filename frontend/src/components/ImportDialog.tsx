@@ -1,6 +1,6 @@
 import { useState, useEffect, useRef } from "react";
 import { useTranslation } from "react-i18next";
-import api from "@/lib/api";
+import api, { importJobApi } from "@/lib/api";
 import { X, Upload, Save, FileSpreadsheet, AlertCircle } from "lucide-react";
 import { cn } from "@/lib/utils";
 
@@ -76,11 +76,12 @@ export function ImportDialog({ budget, onClose, onSuccess }: ImportDialogProps)
       formData.append("file", file);
       formData.append("overwrite", String(overwrite));
 
-      const res = await api.post(`/budgets/${bId}/import-csv`, formData, {
+      const res = await api.post(`/budgets/${bId}/import-jobs`, formData, {
         headers: { "Content-Type": "multipart/form-data" }
       });
+      const job = await importJobApi.waitForCompletion(res.data.id);
       
-      alert(t('import_success', { count: res.data.count }));
+      alert(t('import_success', { count: job.inserted }));
       onSuccess();
     } catch {
       alert(t('import_dialog.import_failed'));
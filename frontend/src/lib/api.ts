@@ -19,16 +19,20 @@ export const datasetApi = {
     source_dataset_id?: string | null, 
     carry_over_budget: boolean, 
     carry_over_members: boolean, 
-    carry_over_settings: boolean 
+    carry_over_settings: boolean,
+    // 予算の余りを「前年度繰越」に合算する（merged）か、予算ごとに引き継ぐ（per_budget）か
+    budget_carry_over?: "merged" | "per_budget"
   }) => api.post("/datasets/rollover", data).then(res => res.data),
 };
 
 export const budgetApi = {
-  list: (datasetId: string) => api.get(`/budgets?dataset_id=${datasetId}`).then(res => res.data),
+  // 予算一覧の画面では子要素（割当・実績・インポート設定）を使わないため、予算本体のみを取得します
+  list: (datasetId: string) => api.get(`/budgets?dataset_id=${datasetId}&lightweight=true`).then(res => res.data),
   create: (data: { dataset_id: string, name: string, total_amount: number, unit?: string, description?: string, id?: string }) => api.post("/budgets", data).then(res => res.data),
   update: (id: string, data: { name?: string, total_amount?: number, unit?: string, description?: string }) => api.put(`/budgets/${id}`, data).then(res => res.data),
   delete: (id: string) => api.delete(`/budgets/${id}`).then(res => res.data),
   merge: (sourceId: string, targetId: string) => api.post("/budgets/merge", { source_budget_id: sourceId, target_budget_id: targetId }).then(res => res.data),
+  mergeMany: (sourceIds: string[], targetId: string) => api.post("/budgets/merge-many", { source_budget_ids: sourceIds, target_budget_id: targetId }).then(res => res.data),
 };
 
 export const actualExpenseApi = {
@@ -36,6 +40,7 @@ export const actualExpenseApi = {
   create: (budgetId: string, data: { item_name?: string, amount: number, unit?: string }) => api.post(`/budgets/${budgetId}/actual-expenses`, data).then(res => res.data),
   update: (id: number, data: { item_name?: string, amount: number, unit?: string }) => api.put(`/actual-expenses/${id}`, data).then(res => res.data),
   delete: (id: number) => api.delete(`/actual-expenses/${id}`).then(res => res.data),
+  search: (datasetId: string, q: string, budgetId?: string) => api.get("/actual-expenses/search", { params: { dataset_id: datasetId, q, budget_id: budgetId } }).then(res => res.data),
 };
 
 export const memberApi = {
@@ -47,6 +52,8 @@ export const memberApi = {
 
 export const purchaseApi = {
   list: (datasetId: string) => api.get(`/purchases?dataset_id=${datasetId}`).then(res => res.data),
+  // 品名・メモ・担当者を関連度の高い順に検索します
+  search: (datasetId: string, q: string) => api.get("/purchases/search", { params: { dataset_id: datasetId, q } }).then(res => res.data),
   create: (data: { 
     dataset_id: string, 
     member_name?: string, 
@@ -71,20 +78,56 @@ export const purchaseApi = {
     assignments?: { budget_id: string, amount: number }[]
   }) => api.put(`/purchases/${id}`, data).then(res => res.data),
   updateStatus: (id: number, status: string) => api.patch(`/purchases/${id}/status?status=${status}`).then(res => res.data),
+  // ids または filter に一致する購入アイテムに同じ値を 1 回のリクエストで設定します
+  batchUpdate: (data: {
+    dataset_id: string,
+    ids?: number[],
+    filter?: { status?: string[], category?: string[], member_name?: string },
+    patch: { member_name?: string, category?: string, unit?: string, status?: string, priority?: number, note?: string },
+    return_rows?: boolean
+  }) => api.patch("/purchases/batch", data).then(res => res.data as { updated: number, purchases: any[] | null }),
   delete: (id: number) => api.delete(`/purchases/${id}`).then(res => res.data),
   getImportSetting: (datasetId: string) => api.get(`/datasets/${datasetId}/purchase-import-setting`).then(res => res.data),
   saveImportSetting: (datasetId: string, mappingJson: string) => api.post(`/datasets/${datasetId}/purchase-import-setting`, { mapping_json: mappingJson }).then(res => res.data),
   exportCsv: (datasetId: string) => window.open(`${API_BASE_URL}/purchases/export-csv?dataset_id=${datasetId}`, '_blank'),
-  importCsv: (datasetId: string, file: File, overwrite: boolean) => {
+  // 大きなファイルでもタイムアウトしないよう、インポートジョブとして登録して完了を待ちます
+  importCsv: async (datasetId: string, file: File, overwrite: boolean) => {
     const formData = new FormData();
     formData.append("file", file);
     formData.append("overwrite", String(overwrite));
-    return api.post(`/purchases/import-csv?dataset_id=${datasetId}`, formData, {
+    const job = await api.post(`/purchases/import-jobs?dataset_id=${datasetId}`, formData, {
       headers: { "Content-Type": "multipart/form-data" }
     }).then(res => res.data);
+    return importJobApi.waitForCompletion(job.id);
   }
 };
 
+export type ImportJob = {
+  id: string,
+  status: "queued" | "running" | "succeeded" | "failed" | "cancelled",
+  rows_processed: number,
+  inserted: number,
+  skipped: number,
+  failed: number,
+  errors: string[],
+  message?: string | null,
+};
+
+export const importJobApi = {
+  get: (jobId: string): Promise<ImportJob> => api.get(`/import-jobs/${jobId}`).then(res => res.data),
+  cancel: (jobId: string): Promise<ImportJob> => api.post(`/import-jobs/${jobId}/cancel`).then(res => res.data),
+  // ジョブが終了するまで進捗を確認し、成功したジョブを返します（失敗・キャンセル時は例外）
+  waitForCompletion: async (jobId: string, onProgress?: (job: ImportJob) => void, intervalMs = 1000): Promise<ImportJob> => {
+    for (;;) {
+      const job = await importJobApi.get(jobId);
+      onProgress?.(job);
+      if (job.status === "succeeded") return job;
+      if (job.status === "failed" || job.status === "cancelled") throw new Error(job.message ?? job.status);
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+  },
+};
+
 export const dashboardApi = {
   getSummary: (datasetId: string) => api.get(`/dashboard?dataset_id=${datasetId}`).then(res => res.data),
 };